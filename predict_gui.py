@@ -4,13 +4,13 @@ import config
 import json
 import numpy as np
 from src.data_methods import *
-from src.leap_methods import collect_frame
+from src.leap_methods import FrameDecoder, LeapReader
+from src.resampling import FrameResampler
 from src.classes import *
+from src.inference import load_prediction_model, StreamingPredictor, BatchScheduler, can_stream
 import random
 import tkinter as tk
 import matplotlib.pyplot as plt 
-# import tensorflow as tf
-from tensorflow_core.python import keras
 from itertools import cycle
 
 # dead bird from https://www.flickr.com/photos/9516941@N08/3180449008
@@ -24,8 +24,8 @@ from itertools import cycle
 
 
 
-# capture every nth frame, slowing input to roughly 25fps
-n = 4
+# capture frames at this rate, slowing input to 25fps
+target_fps = 25
 
 #### set up gui
 
@@ -39,58 +39,61 @@ gui = GUI(root)
 # Create another window for settings
 settings_window = tk.Toplevel()
 settings_window.geometry("600x400")
-settings_gui = SettingsGUI(settings_window)
+# the model should be fed frames at the rate it was trained on
+model_fps = int(get_description(path='models/prediction_model/').get('fps', 5))
+settings_gui = SettingsGUI(settings_window, model_fps=model_fps)
 
 
 ##### set up model and prediction
 
-model = None
-# load the prediction model
-for file in os.scandir('models/prediction_model'):
-    if file.path[-2:] == 'h5':
-        model = keras.models.load_model(file)
-assert model != None, 'No h5 file found in prediction model folder'
-
 model_path = 'models/prediction_model/'
+# load the prediction model: 'numpy' runs it without tensorflow, 'tflite' runs the model.tflite written by
+# quantize_model.py, and 'keras' imports tensorflow to run it
+backend = 'numpy'
+model = load_prediction_model(model_path, backend=backend)
 # mapping of gestures to integers: need this for decoding model output
 gestures, g2idx, idx2g = get_gestures(version='prediction', path=model_path)
 # set whether or not to derive features and drop unused VoI
 derive_features = True
 # which hands will be used in predicting?
 hands = ['left', 'right']
-# Get the VoI that are used as predictors
-VoI = get_VoI(path=model_path)
-if derive_features:
-    VoI_drop = get_VoI_drop(path=model_path)
-    VoI_predictors = [v for v in VoI if v not in VoI_drop]
-    # use these to get VoI, labelled by hand
-    VoI_predictors = [hand + '_' + v for v in VoI_predictors for hand in hands]
-else:
-    VoI = [hand + '_' + v for v in VoI for hand in hands]
+# Get the VoI needed for prediction and fury, and those of them that aren't predictors
+VoI, VoI_drop = get_required_VoI(path=model_path, derive_features=derive_features, fury=True)
+# compile a decoder that unpacks only the VoI from each frame
+decoder = FrameDecoder([hand + '_' + v for v in VoI for hand in hands] + ['timestamp'], hands=hands)
+# use these to get the VoI predictors, labelled by hand
+VoI_predictors = [hand + '_' + v for v in VoI if v not in VoI_drop for hand in hands]
 
 # get dictionary with one and two handed derived variables to use in prediction
 derived_feature_dict = get_derived_feature_dict(path=model_path)
-# get mean and standard deviation dictionaries
-# these are used for standardizing input to model
-with open(model_path + 'means_dict.json', 'r') as f:
-    means_dict = json.load(f)
-with open(model_path + 'stds_dict.json', 'r') as f:
-    stds_dict = json.load(f)
+# get the means and standard deviations used for standardizing input to model
+standardizer = Standardizer(path=model_path)
+# compile the computation of the model's input (and raw fury) from the decoded values of each frame
+predictors = VoI_predictors + (features.derived_feature_names(derived_feature_dict, hands) if derive_features else [])
+feature_engine = features.LiveFeatureEngine(decoder.columns, predictors,
+    derived_feature_dict if derive_features else {'one_handed': [], 'two_handed': []}, standardizer, hands)
+print(feature_engine.predictors)
+timestamp_idx = decoder.columns.index('timestamp')
 
 # no of frames to keep stored in memory for prediction
-keep = model.input.shape[-2]
+keep = model.input_shape[-2]
 # set up circular buffer for storing model input data
-model_input_data = CircularBuffer((model.input.shape[-2],model.input.shape[-1]))
-
-# keep track of total no. of frames received
-frames_total = 0
-# no. captured continuously
+model_input_data = CircularBuffer((model.input_shape[-2],model.input_shape[-1]))
+# decides which frames are fed to the model, using their timestamps
+model_resampler = FrameResampler(settings_gui.settings['model fps'])
+# a unidirectional model can be advanced a frame at a time, rather than re-running the whole buffer for each prediction
+streamer = StreamingPredictor(model) if can_stream(model) else None
+streamed_pred = None
+# otherwise windows are predicted by a scheduler, as the prediction service's are, which would batch them with those of
+# any other stream. There's only this one, so there's nothing to wait for
+scheduler = BatchScheduler(model, max_delay=0) if streamer is None else None
+
+# no. of frames used, i.e. with a hand in. Periodic updates (previous fury, the graph) are every so many of these,
+# so they don't depend on the frame rate of the device
 frames_recorded = 0
 
-# store previous frame, just in case a hand drops out, and we need to vill in values
-previous_frame = None
-# indicator the next successfully received frame will be the first
-first_two_handed_frame = True
+# store previous frame's values, just in case a hand drops out, and we need to vill in values
+previous_values = None
 
 
 #### initialize variables for fury, angularity, and pred confidence calculations
@@ -139,15 +142,25 @@ gesture = 'no_gesture'
 gesture_change = False
 
 websocket_cache = {}
+# receive and decode frames in the background, so that the gui and model never hold up the device
+reader = LeapReader(websocket_cache, unpack=decoder.unpack, target_fps=target_fps).start()
+dropped = 0
 
 while True:
     # update the gui
     root.update_idletasks()
     root.update()
 
-    frames_total += 1
-    
-    packed_frame = collect_frame(frames_total, n, websocket_cache)
+    # wait briefly for the next frame, so the gui stays responsive when there is none
+    received = reader.get(timeout=0.01)
+    if received is None:
+        n_hands = 0
+    else:
+        _, (frame_values, hands_present) = received
+        n_hands = hands_present.sum()
+    if reader.dropped > dropped:
+        print(f'Warning: falling behind, {reader.dropped - dropped} frames dropped')
+        dropped = reader.dropped
 
     # check if the time range to graph has changed
     if x_axis_range != settings_gui.settings['x axis range']:
@@ -187,21 +200,20 @@ while True:
 
 
     
-    if len(packed_frame) > 0:
+    if n_hands > 0:
         frames_recorded += 1
         frame_index = (frames_recorded - 1) % keep
-        # length of packed frame is ~350 if one hand present, ~700 for two
-        if len(packed_frame) < 400 and previous_frame == None:
+        if n_hands < len(hands) and previous_values is None:
             print('need two hands to start')
             gui.label.configure(image=gui.bad)
             gui.gesture.set('position hands')
         # if we have at least one hand, and a previous frame to supplement any missing hand data, then we can proceed
         else:
-            # if a hand is missing, fill in the data from the previous frame
-            if len(packed_frame) < 400:
-                previous_frame.update(packed_frame)
-                packed_frame = previous_frame.copy()
-                if frames_total % 5 == 0:
+            # fill in anything missing, a hand or just some of its values, from the previous frame
+            if previous_values is not None:
+                np.copyto(frame_values, previous_values, where=np.isnan(frame_values))
+            if n_hands < len(hands):
+                if frames_recorded % 5 == 0:
                     print('Warning: a hand is missing')
                 if not hand_missing:
                     gui.img = tk.PhotoImage(file=f'data/images/hand_missing.png')
@@ -210,28 +222,12 @@ while True:
 
             else:
                 hand_missing = False
-                previous_frame = packed_frame.copy()
-            # get the derived features
-            if derive_features:
-                new_features = features.get_derived_features(packed_frame, derived_feature_dict)
-                packed_frame.update(new_features)
-            
-            # if this is the first two handed frame, generate a sorted list of variables used for prediction, including derived features
-            if first_two_handed_frame:
-                first_two_handed_frame = False
-                # for the first frame only, set previous complete frame to the current frame
-                previous_complete_frame = packed_frame.copy()
-                if derive_features:
-                    all_predictors = VoI_predictors + [pred for pred in new_features.keys()]
-                    all_predictors.sort()
-                else:
-                    all_predictors = sorted(VoI)
-                print(all_predictors)
+            previous_values = frame_values
+            # get the standardized model input, with derived features, and raw furiosness, looking at how fast hands are moving
+            frame = feature_engine.process(frame_values)
 
-            
             ### calculate fury and angularity
-            # calculate raw furiosness, looking at how fast hands are moving
-            raw_fury = features.get_fury2(packed_frame, previous_complete_frame)
+            raw_fury = feature_engine.raw_fury
             # update moving average
             fury = settings_gui.settings['fury beta'] * fury + (1 - settings_gui.settings['fury beta']) * raw_fury
             # calculate raw angularity, looking at how movement levels have changed
@@ -244,13 +240,13 @@ while True:
             else:
                 angularity = settings_gui.settings['angularity beta'] * angularity + (1 - settings_gui.settings['angularity beta']) * raw_angularity
             # how often to update the previous value of fury will change the sensitivity of angularity
-            if frames_total % 10 == 0:
+            if frames_recorded % 10 == 0:
                 previous_fury = raw_fury
             # update prediction confidence moving average
             pred_confidence = settings_gui.settings['confidence beta'] * pred_confidence + (1 - settings_gui.settings['confidence beta']) * adjusted_raw_pred_confidence
 
             ### Update circular buffers and plot
-            if frames_total % settings_gui.settings['graph update interval'] == 0:
+            if frames_recorded % settings_gui.settings['graph update interval'] == 0:
                 # buffers
                 fury_cb.add(fury)
                 angularity_cb.add(angularity)
@@ -303,19 +299,23 @@ while True:
             gui.label_fury.configure(foreground="#%02x%02x%02x" % (int(fury * 255),int((1-fury) * 255),0,))
             gui.label_angularity.configure(foreground="#%02x%02x%02x" % (int(angularity * 255),int((1-angularity) * 255),0,))
 
-            previous_complete_frame = packed_frame.copy()
-
-            frame = np.empty(model.input.shape[-1])
-            for i, p in enumerate(all_predictors):
-                frame[i] = (packed_frame[p] - means_dict[p]) / stds_dict[p]
-            if frames_total % settings_gui.settings['every nth frame to model'] == 0:
-                model_input_data.add(frame)
+            if model_resampler.target_fps != settings_gui.settings['model fps']:
+                model_resampler = FrameResampler(settings_gui.settings['model fps'])
+            if model_resampler.accept(frame_values[timestamp_idx]):
+                if streamer is not None:
+                    streamed_pred = streamer.update(frame, frame_values[timestamp_idx])
+                else:
+                    model_input_data.add(frame)
 
             # make a prediction every pred_interval number of frames
             # but first ensure there is a complete training example's worth of consecutive frames
             if frames_recorded >= keep and frames_recorded % settings_gui.settings['prediction interval'] == 0:
-                # feed example into model, and get a prediction
-                pred = model.predict(np.expand_dims(model_input_data.get(), axis=0))
+                if streamer is not None:
+                    # the model has already seen every frame, so just take its latest prediction
+                    pred = np.expand_dims(streamed_pred, axis=0)
+                else:
+                    # feed example into model, and get a prediction
+                    pred = np.expand_dims(scheduler.submit(model_input_data.get()).result(), axis=0)
                 # sometimes getting nan at the start. Need to find source of this.
                 if not np.isnan(pred[0][0]):
                     # confidence of prediction is used for plotting. Often very high. Rescale.
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import itertools
+import threading
+import websockets
+from src.service import PredictionService
+
+# Predicts gestures for any number of clients, each connection being a session (see src/service.py), so that GUIs
+# and recorders don't need tensorflow, the feature pipeline or the model. Clients send the frames of a device
+# (e.g. everything received from ws://127.0.0.1:6437/v6.json), or model input they have computed themselves, and get
+# back json of the gesture, confidence, fury and angularity for each frame used.
+
+parser = argparse.ArgumentParser(description="serve gesture predictions over websockets")
+parser.add_argument("--host", default="127.0.0.1", help="address to serve on")
+parser.add_argument("-p", "--port", type=int, default=6440, help="port to serve on")
+parser.add_argument("-u", "--unix", help="path of a unix socket to serve on, instead of a port")
+parser.add_argument("-m", "--model", default="models/prediction_model/", help="model folder")
+parser.add_argument("-b", "--backend", default="numpy", choices=["numpy", "tflite", "keras"],
+    help="how to run the model, as for load_prediction_model")
+parser.add_argument("-w", "--workers", type=int, default=None, help="no. of worker processes, defaults to one per core")
+
+
+async def session(websocket, service, outboxes, session_ids):
+    """passes a client's messages to its session, and the session's results back"""
+    session_id = next(session_ids)
+    outbox = asyncio.Queue()
+    outboxes[session_id] = outbox
+    service.open(session_id)
+
+    async def send_results():
+        while True:
+            await websocket.send(await outbox.get())
+
+    sender = asyncio.ensure_future(send_results())
+    try:
+        async for message in websocket:
+            service.send(session_id, message)
+    except websockets.ConnectionClosed:
+        pass
+    finally:
+        sender.cancel()
+        service.close(session_id)
+        del outboxes[session_id]
+
+
+def dispatch_results(service, outboxes, loop):
+    """hands each result from the workers to its session's connection"""
+    while True:
+        result = service.results()
+        if result is None:
+            continue
+        session_id, message = result
+        outbox = outboxes.get(session_id)
+        if outbox is not None:
+            loop.call_soon_threadsafe(outbox.put_nowait, message)
+
+
+async def serve(args):
+    service = PredictionService(processes=args.workers, model_path=args.model, backend=args.backend)
+    outboxes = {}
+    session_ids = itertools.count()
+    threading.Thread(target=dispatch_results, args=(service, outboxes, asyncio.get_running_loop()),
+        name='dispatch_results', daemon=True).start()
+    handler = lambda websocket, path=None: session(websocket, service, outboxes, session_ids)
+    if args.unix:
+        server = await websockets.unix_serve(handler, args.unix)
+        print(f'{len(service.workers)} workers serving predictions on {args.unix}')
+    else:
+        server = await websockets.serve(handler, args.host, args.port)
+        print(f'{len(service.workers)} workers serving predictions on ws://{args.host}:{args.port}')
+    await server.wait_closed()
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import time
+import numpy as np
+from src.recording import list_recordings
+from src.inference import QUANTIZATIONS, bundle_examples, export_tflite, load_prediction_model
+
+# Converts a model folder's model to TensorFlow Lite (see src/inference.py), then compares it with the keras model:
+# the accuracy of each on the examples of validation recordings, how often they predict the same gesture,
+# and the latency of a single prediction, as made by predict_gui.py.
+
+parser = argparse.ArgumentParser(description="convert a prediction model to TensorFlow Lite, and compare it with keras")
+parser.add_argument("-m", "--model", default="models/prediction_model/", help="model folder")
+parser.add_argument("-c", "--calibration", default="data/loops/",
+    help="folder of recordings to calibrate int8 quantization with, e.g. those the model was trained on")
+parser.add_argument("-v", "--validation", default="data/validation/", help="folder of recordings to evaluate on")
+parser.add_argument("-q", "--quantization", default="int8", choices=QUANTIZATIONS, help="how to quantize the model")
+parser.add_argument("-n", "--max-examples", type=int, default=500, help="max no. of examples to calibrate with")
+parser.add_argument("-r", "--runs", type=int, default=200, help="no. of predictions to time each backend over")
+
+
+def latencies(model, X, runs):
+    """times single example predictions, as the GUI makes them, returning the p50 and p99 in milliseconds"""
+    times = []
+    for i in range(runs):
+        x = X[i % len(X)][np.newaxis]
+        start = time.perf_counter()
+        model.predict(x, verbose=0)
+        times.append(time.perf_counter() - start)
+    return np.percentile(times, 50) * 1000, np.percentile(times, 99) * 1000
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    tflite_path = export_tflite(args.model, calibration_files=list_recordings(args.calibration),
+        quantization=args.quantization, max_examples=args.max_examples)
+    X, y = bundle_examples(list_recordings(args.validation), path=args.model)
+    X = X.astype(np.float32)
+    print(f'{len(X)} validation examples')
+    models = {backend: load_prediction_model(args.model, backend=backend) for backend in ('keras', 'numpy', 'tflite')}
+    predictions = {backend: model.predict(X, verbose=0) for backend, model in models.items()}
+    h5_size = os.path.getsize(next(file.path for file in os.scandir(args.model) if file.name.endswith('.h5')))
+    sizes = {'keras': h5_size, 'numpy': h5_size, 'tflite': os.path.getsize(tflite_path)}
+    reference = np.argmax(predictions['keras'], axis=1)
+    keras_accuracy = np.mean(reference == y)
+    print(f'{"backend":<8}{"accuracy":>10}{"delta":>10}{"agreement":>11}{"max diff":>10}{"p50 ms":>9}{"p99 ms":>9}{"bytes":>9}')
+    for backend, model in models.items():
+        predicted = np.argmax(predictions[backend], axis=1)
+        accuracy = np.mean(predicted == y)
+        p50, p99 = latencies(model, X, args.runs)
+        max_diff = np.max(np.abs(predictions[backend] - predictions['keras']))
+        print(f'{backend:<8}{accuracy:>10.4f}{accuracy - keras_accuracy:>+10.4f}{np.mean(predicted == reference):>11.4f}'
+            f'{max_diff:>10.2g}{p50:>9.3f}{p99:>9.3f}{sizes[backend]:>9}')
+    print(f'{args.quantization} model written to {tflite_path}')
@@ -6,7 +6,8 @@ import json
 import pandas as pd
 import numpy as np
 from src.data_methods import get_gestures
-from src.leap_methods import collect_frame
+from src.leap_methods import FrameMerger
+from src.recording import StreamingRecorder
 import src.features as features
 import random
 import time
@@ -31,11 +32,10 @@ next_gesture = 0
 current_gesture = 0
 # whether or not to store captured frames
 record = True
-# collect only every nth frame, use this for lowering frame rate
-n = 4
+# frame rate to collect frames at, use this for lowering frame rate
+target_fps = 25
 
 if __name__ == "__main__":
-    frames = []
     frames_total = 0
     # variables for gesture messages
     gesturing = False
@@ -68,21 +68,29 @@ if __name__ == "__main__":
         print_variable = input('input variable name (e.g. right_grabAngle): ')
     else:
         raise Exception('Input not a valid mode')
+    if record:
+        # write frames to disk as they are recorded, if recording crashes they can be recovered with src.recording.merge_parts
+        parts_dir = f"recordings/.parts_{time.strftime('%Y%m%d_%H%M%S')}/"
+        print(f'Recording to {parts_dir}')
+        recorder = StreamingRecorder(parts_dir)
+    # read every device concurrently, merging their frames by timestamp
+    # keep plenty of frames buffered, so that none are dropped from the recording
+    merger = FrameMerger(websocket_cache, target_fps=target_fps, maxlen=256).start()
     try:
         while True:
-            frames_total += 1
+            group = merger.get(timeout=0.1)
 
-            packed_frame = collect_frame(frames_total, n, websocket_cache)
+            if group:
+                for packed_frame in group:
+                    frames_total += 1
+                    # store variable indicating gesture
+                    if mode == 1 or mode == 2 or mode == 3:
+                        packed_frame["gesture"] = gestures[current_gesture]
+                    elif mode == 4:
+                        packed_frame["gesture"] = gesture
 
-            if len(packed_frame) > 0:                
-                # store variable indicating gesture
-                if mode == 1 or mode == 2 or mode == 3:
-                    packed_frame["gesture"] = gestures[current_gesture]
-                elif mode == 4:
-                    packed_frame["gesture"] = gesture
-                
-                if record:
-                    frames.append(packed_frame)
+                    if record:
+                        recorder.add(packed_frame)
 
                 # change to the next gesture
                 if (mode == 1 or mode == 2) and change_time < time.time():
@@ -132,8 +140,10 @@ if __name__ == "__main__":
 
                             
     except KeyboardInterrupt:
+        merger.stop()
+        if merger.dropped > 0:
+            print(f'Warning: {merger.dropped} frames were dropped')
         if mode != 5:
             fn = input("Enter filename to save recording to: ")
-            df = pd.DataFrame(frames)
-            df.to_csv(f"recordings/{fn}.csv", index=False)
+            recorder.close(f"recordings/{fn}.csv")
             print("Saved")
\ No newline at end of file
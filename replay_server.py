@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import json
+import time
+import pandas as pd
+import websockets
+from src.leap_methods import unpack_frame, peek_timestamp
+
+# Stands in for a leap motion device, replaying a recording over the same websocket protocol.
+# Point config.devices at it, e.g. {"url": "ws://127.0.0.1:6437/v6.json", "mode": "desktop"},
+# and record.py, predict_gui.py etc. can be run, tested and timed without a device.
+
+parser = argparse.ArgumentParser(description="replay a recording as if it were a leap motion device")
+parser.add_argument("recording", help="CSV saved by record.py, or captured json (.jsonl) with the json of one frame per line")
+parser.add_argument("--host", default="127.0.0.1", help="address to serve on")
+parser.add_argument("-p", "--port", type=int, default=6437,
+    help="port to serve on, defaults to the leap motion port. Frames from device n of a recording are served on port + n")
+parser.add_argument("-s", "--speed", type=float, default=1.0,
+    help="replay speed, 1 is real time, 2 twice as fast, etc. 0 sends frames as fast as the client will take them")
+parser.add_argument("-l", "--loop", action="store_true", help="keep replaying the recording until the client disconnects")
+
+# sent by a leap motion device when a connection is opened
+VERSION = json.dumps({"serviceVersion": "4.0.0+52173", "version": 6})
+DEVICE_EVENT = json.dumps({"event": {"state": {"attached": True, "id": "replay", "streaming": True, "type": "Peripheral"}, "type": "deviceEvent"}})
+
+
+def load_messages(path):
+    """loads a recording as a dict of device index: list of (timestamp, json of the frame)"""
+    devices = {}
+    if path.endswith('.jsonl') or path.endswith('.json'):
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                timestamp = peek_timestamp(line) if line else None
+                # skip blank lines and events
+                if timestamp is not None:
+                    devices.setdefault(0, []).append((timestamp, line))
+    else:
+        recording = pd.read_csv(path)
+        if 'device_index' not in recording.columns:
+            recording['device_index'] = 0
+        for packed_frame in recording.to_dict('records'):
+            frame = unpack_frame(packed_frame)
+            # match the compact json sent by a leap motion device
+            devices.setdefault(int(packed_frame['device_index']), []).append((frame["timestamp"], json.dumps(frame, separators=(',', ':'))))
+    return devices
+
+
+def with_timestamp(message, timestamp):
+    """replaces the timestamp in the json of a frame"""
+    start = message.find('"timestamp":') + len('"timestamp":')
+    end = start
+    while message[end] not in ',}':
+        end += 1
+    return message[:start] + str(timestamp) + message[end:]
+
+
+async def log_messages(websocket, device_index):
+    """print messages from the client, e.g. {"optimizeHMD": false}"""
+    async for message in websocket:
+        print(device_index, 'received', message)
+
+
+async def replay(websocket, messages, device_index, speed, loop):
+    """send a connected client the version handshake, then the frames of the recording"""
+    await websocket.send(VERSION)
+    await websocket.send(DEVICE_EVENT)
+    listener = asyncio.ensure_future(log_messages(websocket, device_index))
+    # keep timestamps increasing when looping, spacing each replay by the mean time between frames
+    first, last = messages[0][0], messages[-1][0]
+    span = last - first + (last - first) // max(len(messages) - 1, 1)
+    sent = 0
+    start = time.perf_counter()
+    n_replays = 0
+    try:
+        while True:
+            offset = n_replays * span
+            replay_start = time.perf_counter()
+            for timestamp, message in messages:
+                if speed > 0:
+                    # wait until this frame is due, scheduling from the start so that delays don't accumulate
+                    delay = replay_start + (timestamp - first) / 1e6 / speed - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                elif sent % 100 == 0:
+                    # let the listener run now and then
+                    await asyncio.sleep(0)
+                await websocket.send(message if offset == 0 else with_timestamp(message, timestamp + offset))
+                sent += 1
+            n_replays += 1
+            if not loop:
+                break
+    except websockets.ConnectionClosed:
+        pass
+    finally:
+        listener.cancel()
+    elapsed = time.perf_counter() - start
+    print(f'{device_index} sent {sent} frames in {elapsed:.2f}s, {sent / elapsed:.1f} fps')
+    await websocket.close()
+
+
+async def serve(args):
+    devices = load_messages(args.recording)
+    servers = []
+    for device_index, messages in sorted(devices.items()):
+        # the path requested (e.g. /v6.json) is ignored
+        handler = lambda websocket, path=None, messages=messages, device_index=device_index: \
+            replay(websocket, messages, device_index, args.speed, args.loop)
+        servers.append(await websockets.serve(handler, args.host, args.port + device_index))
+        print(f'device {device_index}: replaying {len(messages)} frames on ws://{args.host}:{args.port + device_index}/v6.json')
+    await asyncio.gather(*[server.wait_closed() for server in servers])
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
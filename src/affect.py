@@ -0,0 +1,155 @@
+import os
+import numpy as np
+import pandas as pd
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+import src.features as features
+from src.resampling import resample_mask
+from src.recording import is_archive, archive_columns, read_archive, list_recordings
+
+#### methods for computing the affective dimension (fury and angularity) of whole recordings at once
+
+# These give the same curves as predict_gui.py would, if a recording were replayed to it (e.g. by replay_server.py):
+# frames are taken at the GUI's frame rate, missing values (e.g. a hand) are filled in from the previous frame, and
+# fury and angularity are smoothed with the GUI's default betas, with angularity compared against the raw fury of the
+# last frame whose frames_recorded (the no. of frames with a hand in so far) was a multiple of 10.
+
+def raw_fury(df):
+    """get_fury2 for every frame of a df at once, each frame compared with the one before, and the first with itself
+
+    df needs the palmVelocity and fingertip positions of both hands, with no missing values.
+    """
+    velocity = df[[f'{hand}_palmVelocity_{i}' for i in (0,1,2) for hand in ('left', 'right')]].to_numpy(dtype=np.float64)
+    fingers = features.get_derived_features_batch(df, {'one_handed': ['adjacent_finger_distances'], 'two_handed': []})
+    fingers = fingers.to_numpy(dtype=np.float64)
+    fur1 = np.max(np.abs(velocity), axis=1) / 1500
+    fur2 = np.max(np.abs(np.diff(fingers, axis=0, prepend=fingers[:1])), axis=1) / 60
+    return np.maximum(np.minimum(fur1, 1), np.minimum(fur2, 1))
+
+
+def moving_average(values, beta, block=128):
+    """y[n] = beta * y[n-1] + values[n], from y[-1] = 0, for every n at once
+
+    values are split into blocks, each block's moving average is found (from zero) as a matrix product, and the value
+    carried from one block into the next is itself a moving average, of the blocks' last values, with beta**block.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if n == 0:
+        return values.copy()
+    # decay[j, k] is beta**(j - k), for k <= j
+    lag = np.subtract.outer(np.arange(min(n, block)), np.arange(min(n, block)))
+    decay = np.where(lag >= 0, beta ** np.maximum(lag, 0), 0)
+    if n <= block:
+        return decay @ values
+    blocks = np.concatenate((values, np.zeros(-n % block))).reshape(-1, block)
+    within = blocks @ decay.T
+    carried = moving_average(within[:, -1], beta**block, block)
+    within[1:] += carried[:-1, np.newaxis] * beta ** np.arange(1, block + 1)
+    return within.reshape(-1)[:n]
+
+
+def affect_curves(raw, frames_recorded, fury_beta=0.9, angularity_beta=0.975):
+    """smoothed fury, and angularity, from the raw fury of consecutive frames, as predict_gui.py computes them
+
+    Arguments:
+    raw -- array of raw fury, as from raw_fury
+    frames_recorded -- array of the no. of frames with a hand in, as of each frame, counted as the GUI counts them
+    fury_beta, angularity_beta -- floats, the betas of the moving averages, as in the GUI's settings
+
+    Returns:
+    fury, raw_angularity, angularity -- arrays, one value per frame
+    """
+    raw = np.asarray(raw, dtype=np.float64)
+    frames_recorded = np.asarray(frames_recorded)
+    index = np.arange(len(raw))
+    fury = moving_average((1 - fury_beta) * raw, fury_beta)
+    # angularity compares with the raw fury of the last frame before this one with frames_recorded a multiple of 10
+    updated = np.where(frames_recorded % 10 == 0, index, -1)
+    previous = np.concatenate(([-1], np.maximum.accumulate(updated)[:-1])) if len(raw) else updated
+    previous_fury = np.where(previous >= 0, raw[previous], 0)
+    raw_angularity = np.abs(previous_fury - raw)
+    # a sudden movement drives angularity up immediately, otherwise it's a moving average. So after a spike it is the
+    # moving average of everything so far, less what there was before the spike, decayed since
+    spikes = raw_angularity > 0.72
+    total = moving_average(np.where(spikes, raw_angularity, (1 - angularity_beta) * raw_angularity), angularity_beta)
+    spike = np.maximum.accumulate(np.where(spikes, index, -1)) if len(raw) else index
+    before_spike = np.where(spike > 0, total[np.maximum(spike - 1, 0)], 0)
+    angularity = total - np.where(spike >= 0, angularity_beta ** (index - spike + 1) * before_spike, 0)
+    return fury, raw_angularity, angularity
+
+
+def recording_affect(raw_file, target_fps=25, fury_beta=0.9, angularity_beta=0.975, device=0):
+    """fury and angularity of every frame the GUI would use, when a recording is replayed to it
+
+    Arguments:
+    raw_file -- str, path of a CSV or recording archive. Archives store values as float32, so their curves can
+        differ very slightly from the GUI's
+    target_fps -- int, frame rate the GUI takes frames at
+    fury_beta, angularity_beta -- floats, the betas of the moving averages, as in the GUI's settings
+    device -- int, which device of a multi device recording to use
+
+    Returns:
+    df -- pandas df indexed by row of the recording, of timestamp, frames_recorded, raw_fury, fury, raw_angularity
+        and angularity
+    """
+    raw_file = os.fspath(raw_file)
+    variables = [hand + '_' + v for v in features.required_variables({'one_handed': [], 'two_handed': []}, fury=True)
+        for hand in ('left', 'right')]
+    usecols = ['timestamp', 'device_index'] + variables
+    if is_archive(raw_file):
+        df = read_archive(raw_file, columns=[c for c in usecols if c in archive_columns(raw_file)])
+    else:
+        with open(raw_file, 'r') as f:
+            columns = pd.read_csv(f, nrows=0).columns
+        df = pd.read_csv(raw_file, usecols=[c for c in usecols if c in columns], dtype={'timestamp': np.int64})
+    if 'device_index' in df.columns:
+        df = df[df['device_index'] == device]
+    empty = pd.DataFrame(columns=['timestamp', 'frames_recorded', 'raw_fury', 'fury', 'raw_angularity', 'angularity'])
+    if not all(c in df.columns for c in variables):
+        # a hand never appears, so the GUI would never start
+        return empty
+    df = df[resample_mask(df['timestamp'], target_fps)]
+    present = {hand: df[f'{hand}_palmVelocity_0'].notna().to_numpy() for hand in ('left', 'right')}
+    any_hand = present['left'] | present['right']
+    # frames without hands are skipped, but every frame with a hand counts, including those before the GUI starts,
+    # which it does once it has seen both hands
+    df = df.assign(frames_recorded=np.cumsum(any_hand))
+    started = np.logical_or.accumulate(present['left'] & present['right'])
+    df = df[any_hand & started]
+    if len(df) == 0:
+        return empty
+    # a missing hand is filled in from the previous frame
+    df = df.ffill()
+    raw = raw_fury(df)
+    fury, raw_angularity, angularity = affect_curves(raw, df['frames_recorded'].to_numpy(), fury_beta, angularity_beta)
+    return pd.DataFrame({'timestamp': df['timestamp'].to_numpy(), 'frames_recorded': df['frames_recorded'].to_numpy(),
+        'raw_fury': raw, 'fury': fury, 'raw_angularity': raw_angularity, 'angularity': angularity}, index=df.index)
+
+
+def folder_affect(folder='data/loops/', out_dir=None, processes=1, **kwargs):
+    """fury and angularity of every recording in a folder, as from recording_affect
+
+    Arguments:
+    folder -- str, folder of recordings
+    out_dir -- str, if given each recording's curves are also written to out_dir, as name.affect.csv
+    processes -- int, no. of worker processes to use, None uses one per core
+    kwargs -- passed on to recording_affect
+
+    Returns:
+    curves -- dict of recording path: df
+    """
+    files = sorted(list_recordings(folder))
+    process_file = partial(recording_affect, **kwargs)
+    if processes == 1:
+        results = list(map(process_file, files))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(process_file, files))
+    curves = dict(zip(files, results))
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+        for file, df in curves.items():
+            name = os.path.splitext(os.path.basename(os.path.normpath(file)))[0]
+            df.to_csv(os.path.join(out_dir, name + '.affect.csv'), index_label='row')
+    return curves
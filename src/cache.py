@@ -0,0 +1,135 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+# bump this when a change to the processing code changes its output, so that old cache entries are not used
+CACHE_VERSION = 5
+
+# files in params/ that affect processed recordings
+PARAM_FILES = ['VoI.txt', 'VoI_drop.txt', 'derived_features_one_handed.txt', 'derived_features_two_handed.txt',
+    'means_dict.json', 'stds_dict.json']
+# those of them that only affect standardized recordings
+DICT_FILES = ['means_dict.json', 'stds_dict.json']
+
+
+def processing_key(content, params_path='params/', param_files=PARAM_FILES, **kwargs):
+    """key for a processed recording, from a str identifying its content, the parameter files, and any other settings"""
+    sha1 = hashlib.sha1()
+    sha1.update(f'{CACHE_VERSION}:{content}'.encode())
+    for name in param_files:
+        param_file = os.path.join(params_path, name)
+        if os.path.exists(param_file):
+            with open(param_file, 'rb') as f:
+                sha1.update(name.encode() + f.read())
+    sha1.update(json.dumps(kwargs, sort_keys=True).encode())
+    return sha1.hexdigest()
+
+
+def file_signature(path):
+    """total size, latest modification time and no. of files of a recording, either a file, or a folder such as an archive"""
+    path = os.fspath(path)
+    if os.path.isdir(path):
+        files = sorted(os.path.join(path, f) for f in os.listdir(path))
+    else:
+        files = [path]
+    stats = [os.stat(f) for f in files]
+    return [sum(s.st_size for s in stats), max(s.st_mtime_ns for s in stats), len(files)]
+
+
+class RecordingCache:
+    """on disk cache of processed recordings, keyed by the content of the recording and everything that affects processing
+
+    Entries are .npz files of named arrays in cache_dir. When the cache grows beyond max_bytes, the least recently
+    used entries are removed. Hashing a recording means reading all of it, so hashes are remembered for as long as
+    the recording's size and modification time stay the same.
+
+    Arguments:
+    cache_dir -- str, folder to keep entries in, created if it doesn't exist
+    max_bytes -- int, size the cache is kept under
+    """
+    def __init__(self, cache_dir='data/cache/', max_bytes=2 * 1024**3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._hashes_path = os.path.join(cache_dir, 'hashes.json')
+        self._hashes = {}
+        if os.path.exists(self._hashes_path):
+            with open(self._hashes_path) as f:
+                self._hashes = json.load(f)
+
+    def file_hash(self, path):
+        """sha1 of a recording's content, either a file, or a folder such as a recording archive"""
+        path = os.path.abspath(os.fspath(path))
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, f) for f in os.listdir(path))
+        else:
+            files = [path]
+        signature = file_signature(path)
+        remembered = self._hashes.get(path)
+        if remembered is not None and remembered['signature'] == signature:
+            return remembered['sha1']
+        sha1 = hashlib.sha1()
+        for f in files:
+            with open(f, 'rb') as fh:
+                for block in iter(lambda: fh.read(1024 * 1024), b''):
+                    sha1.update(block)
+        # other processes may be using the same cache, so add to the latest hashes on disk
+        if os.path.exists(self._hashes_path):
+            with open(self._hashes_path) as f:
+                self._hashes.update(json.load(f))
+        self._hashes[path] = {'signature': signature, 'sha1': sha1.hexdigest()}
+        self._write_json(self._hashes_path, self._hashes)
+        return sha1.hexdigest()
+
+    def key(self, raw_file, params_path='params/', param_files=PARAM_FILES, **kwargs):
+        """key for a processed recording, from its content, the parameter files, and any other settings in kwargs"""
+        return processing_key(self.file_hash(raw_file), params_path=params_path, param_files=param_files, **kwargs)
+
+    def get(self, key):
+        """returns a dict of the arrays stored under key, or None if there is no such entry"""
+        path = os.path.join(self.cache_dir, key + '.npz')
+        try:
+            # mark as recently used
+            os.utime(path)
+            with np.load(path, allow_pickle=False) as npz:
+                return {name: npz[name] for name in npz.files}
+        except FileNotFoundError:
+            # never stored, or removed by another process using the same cache
+            return None
+
+    def put(self, key, **arrays):
+        """stores arrays under key, then removes old entries if the cache is too big"""
+        path = os.path.join(self.cache_dir, key + '.npz')
+        tmp_path = os.path.join(self.cache_dir, f'{key}.{os.getpid()}.tmp.npz')
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """removes least recently used entries until the cache is under max_bytes"""
+        entries = [e for e in os.scandir(self.cache_dir) if e.name.endswith('.npz') and not e.name.endswith('.tmp.npz')]
+        sizes = []
+        for e in entries:
+            try:
+                stat = e.stat()
+            except FileNotFoundError:
+                # removed by another process using the same cache
+                continue
+            sizes.append((stat.st_mtime, stat.st_size, e.path))
+        sizes.sort()
+        total = sum(size for _, size, _ in sizes)
+        for _, size, path in sizes:
+            if total <= self.max_bytes:
+                break
+            total -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _write_json(self, path, obj):
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(obj, f)
+        os.replace(tmp_path, path)
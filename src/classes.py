@@ -29,7 +29,7 @@ class GUI:
 
 class SettingsGUI:
     """tkinter gui for changing settings during application run"""
-    def __init__(self, master):
+    def __init__(self, master, model_fps=5):
         # dictionaries of current settings values 
         self.settings = {}
         # dictionary of tk spinbox objects
@@ -56,7 +56,7 @@ class SettingsGUI:
         self.create_setting('x axis range', 1, 150, 1, 30)
         self.create_setting('effective confidence zero', 0.05, 0.95, 0.05, 0.7)
         self.create_setting('min conf. to change image', 0.0, 0.95, 0.05, 0.55)
-        self.create_setting('every nth frame to model', 1, 10, 1, 5)
+        self.create_setting('model fps', 1, 30, 1, model_fps)
         self.create_setting('labels gather?', 0, 1, 1, 0)
 
         self.update_button = tk.Button(self.master, text='Update Settings', command=self.update_settings, font=self.text_format)
@@ -7,8 +7,13 @@ Created on Tue Jan  7 12:11:33 2020
 import numpy as np
 import pandas as pd
 import src.features as features
+from src.recording import is_archive, archive_columns, read_archive, list_recordings
+from src.cache import RecordingCache, PARAM_FILES, DICT_FILES
+from src.resampling import FrameResampler, resample_mask
 import json
 import os
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 
 #### methods for reading in or creating parameter files in params/
 
@@ -47,6 +52,40 @@ def get_derived_feature_dict(path = 'params/'):
     feature_dict['two_handed'] = read_ignoring_comments(f'{path}derived_features_two_handed.txt')
     return feature_dict
 
+def get_required_VoI(path='params/', derive_features=True, fury=False):
+    """the variables of interest that are actually needed, and those of them to drop once features are derived
+
+    The predictors are the VoI in VoI.txt that aren't in VoI_drop.txt, or all of them without derive_features. Besides
+    these, only the variables that the derived features are declared to need (see FEATURES in src/features.py) are
+    kept, to be dropped once they have been used. So VoI that nothing uses are never decoded, read or carried, and
+    VoI.txt doesn't have to list what the derived features need.
+
+    Arguments:
+    path -- str, folder of the params, or of a model
+    derive_features -- bool, whether features are derived
+    fury -- bool, if true the variables needed by get_fury2 are kept too, as when predicting live
+
+    Returns:
+    VoI -- list of the variables to read, in the order of VoI.txt, followed by any others that are needed
+    VoI_drop -- list of those of VoI that aren't predictors
+    """
+    VoI = get_VoI(path)
+    predictors = [v for v in VoI if v not in get_VoI_drop(path)] if derive_features else VoI
+    derived_feature_dict = get_derived_feature_dict(path) if derive_features else {'one_handed': [], 'two_handed': []}
+    # VoI don't have a hand, so what either hand needs is kept
+    needed = features.required_variables(derived_feature_dict, ['left', 'right'], fury=fury)
+    required = [v for v in VoI if v in predictors or v in needed] + [v for v in needed if v not in VoI]
+    return required, [v for v in required if v not in predictors]
+
+def get_description(path = 'params/'):
+    """fetches a model's description.txt as a dictionary, e.g. {'fps': '5', 'example length': '10', ...}"""
+    description = {}
+    for line in read_ignoring_comments(f'{path}description.txt'):
+        if ':' in line:
+            key, value = line.split(':', 1)
+            description[key.strip()] = value.strip()
+    return description
+
 def create_dicts(df):
     """generates dictionaries for mean and std of a pandas df's columns, saving them to params/"""
     with open('params/means_dict.json', 'w') as f:
@@ -55,15 +94,131 @@ def create_dicts(df):
         json.dump(df.std().to_dict(), f)
 
 
+class Standardizer:
+    """standardizes predictors, using the means and standard deviations in a params or model folder
+
+    The dictionaries are read once. compile aligns them with a list of predictors, in sorted order (the order in which
+    the model takes its predictors), as mean and std vectors, so that standardizing a frame, or a whole batch of frames,
+    is a single vectorized operation. The same object is used in training (df2X_y) and live prediction (predict_gui.py).
+
+    Arguments:
+    path -- str, folder containing means_dict.json and stds_dict.json, e.g. 'params/' or 'models/prediction_model/'
+    columns -- list of predictors to compile for straight away, optional
+    """
+    def __init__(self, path='params/', columns=None):
+        with open(f'{path}means_dict.json', 'r') as f:
+            self.means_dict = json.load(f)
+        with open(f'{path}stds_dict.json', 'r') as f:
+            self.stds_dict = json.load(f)
+        self.columns = None
+        if columns is not None:
+            self.compile(columns)
+
+    def compile(self, columns):
+        """aligns the means and stds with the predictors in columns, returning the predictors in sorted order"""
+        columns = sorted(columns)
+        if columns != self.columns:
+            missing = [c for c in columns if c not in self.means_dict or c not in self.stds_dict]
+            assert not missing, f'no mean or std for {missing}, the dictionaries need regenerating (see create_dicts)'
+            self.means = np.array([self.means_dict[c] for c in columns])
+            self.stds = np.array([self.stds_dict[c] for c in columns])
+            self.columns = columns
+        return self.columns
+
+    def apply(self, values, out=None):
+        """standardizes values, an array of shape (..., predictors) with predictors in sorted order
+
+        out -- array to write the result to, e.g. values itself, to standardize in place
+        """
+        out = np.subtract(values, self.means, out=out)
+        return np.divide(out, self.stds, out=out)
+
+
 #### methods for the different steps in getting training examples from a CSV file
 
-def CSV2VoI(raw_file='data/recordings/fist_test.csv', VoI_file='params/VoI.txt', target_fps=25):
+def get_raw_columns(columns, VoI):
+    """returns the columns of a recording needed for extracting the VoI, in the order they appear in columns"""
+    needed = {'gesture', 'timestamp', 'currentFrameRate', 'device_index'}
+    needed.update(hand + '_' + v for v in VoI for hand in ('left', 'right'))
+    return [c for c in columns if c in needed]
+
+
+def read_resampled(raw_file, VoI, target_fps=25, chunksize=20000, rows=None):
+    """reads the columns of a recording needed for the VoI, resampling to target_fps as it is read
+
+    CSVs are read chunksize rows at a time, and only the needed columns are parsed, as float32, so that
+    the whole recording never has to fit in memory at full width.
+
+    Arguments:
+    raw_file -- str, path of a CSV or recording archive
+    VoI -- list of variables of interest, without handedness
+    target_fps -- int, output fps
+    chunksize -- int, no. of rows of a CSV to read at a time
+    rows -- (start, stop) row numbers, if given only these rows of the recording are read
+
+    Returns:
+    raw -- pandas df of the resampled frames, indexed by row number in the recording
+    mean_fps -- float, average currentFrameRate of the recording, before resampling. If the recording has no
+        currentFrameRate, the average frame rate of each device, from its timestamps, or nan if that can't be found either
+    n_frames -- int, no. of frames in the recording, before resampling
+    """
+    if is_archive(raw_file):
+        raw = read_archive(raw_file, columns=get_raw_columns(archive_columns(raw_file), VoI), rows=rows)
+        if rows is not None:
+            raw.index += rows[0]
+        chunks = [raw]
+    else:
+        with open(raw_file, 'r') as f:
+            columns = pd.read_csv(f, nrows=0).columns
+        usecols = get_raw_columns(columns, VoI)
+        dtype = {c: np.float32 for c in usecols}
+        dtype.update({'gesture': str, 'timestamp': np.int64})
+        if rows is None:
+            chunks = pd.read_csv(raw_file, usecols=usecols, dtype=dtype, chunksize=chunksize)
+        else:
+            # skipping a number of lines is much quicker than skipping a list of them
+            chunk = pd.read_csv(raw_file, header=None, names=columns, skiprows=rows[0] + 1, nrows=rows[1] - rows[0],
+                usecols=usecols, dtype=dtype)
+            chunk.index += rows[0]
+            chunks = [chunk]
+    resampled = []
+    # resampler for each device, carried over from one chunk to the next
+    resamplers = {}
+    fps_sum, fps_count, n_frames = 0.0, 0, 0
+    # first timestamp, last timestamp and no. of frames of each device, in case there is no currentFrameRate
+    spans = {}
+    for chunk in chunks:
+        if 'currentFrameRate' in chunk.columns:
+            fps_sum += chunk['currentFrameRate'].sum()
+            fps_count += chunk['currentFrameRate'].count()
+        n_frames += len(chunk)
+        groups = chunk['device_index'] if 'device_index' in chunk.columns else None
+        for device, timestamps in (chunk['timestamp'].groupby(groups) if groups is not None else [(0, chunk['timestamp'])]):
+            if len(timestamps):
+                first, last, count = spans.get(device, (timestamps.iloc[0], None, 0))
+                spans[device] = (first, timestamps.iloc[-1], count + len(timestamps))
+        resampled.append(chunk[resample_mask(chunk['timestamp'], target_fps, groups=groups, resamplers=resamplers)])
+    if fps_count:
+        mean_fps = fps_sum / fps_count
+    else:
+        # leap timestamps are in microseconds
+        device_fps = [(count, (count - 1) / (last - first) * 1e6) for first, last, count in spans.values() if last > first]
+        mean_fps = sum(c * fps for c, fps in device_fps) / sum(c for c, _ in device_fps) if device_fps else np.nan
+        print(f'WARNING: {os.fspath(raw_file)} has no currentFrameRate, '
+            + ('the frame rate is taken from its timestamps' if device_fps else 'and its frame rate is unknown'))
+    return pd.concat(resampled), mean_fps, n_frames
+
+
+def CSV2VoI(raw_file='data/recordings/fist_test.csv', VoI_file='params/VoI.txt', target_fps=25, rows=None,
+        derive_features=True):
     """Turns a csv file of raw leap data into a pandas df containing gesture + variables of interest
     
     Attributes:
-    raw_file -- str, giving the path/name of the leap motion data
+    raw_file -- str, giving the path/name of the leap motion data, either a CSV or a recording archive (see src/recording.py)
     VoI_file -- str, giving the path/name of the txt file, with a variable of interest for each line
-    target_fps -- int, output fps. Every nth frame is taken to acheive this, n is calculated using average fps of file
+    target_fps -- int, output fps. Frames are taken using their timestamps to acheive this, see FrameResampler
+    rows -- (start, stop) row numbers, if given only these rows of the recording are read
+    derive_features -- bool, whether features will be derived, as only the VoI they need are read (see get_required_VoI)
 
     Note:
     The VoI txt file shouldn't reference handedness for each of its chosen variables, or contain any
@@ -72,26 +227,18 @@ def CSV2VoI(raw_file='data/recordings/fist_test.csv', VoI_file='params/VoI.txt',
     The error thrown when VoI contains an invalid name does not specify which name is invalid. This is annoying!
 
     """
-    # get the raw leap data from a csv file
-    with open(raw_file, 'r') as f:
-        raw = pd.read_csv(f)
-
-    # get the variables of interest
-    VoI = get_VoI()
-
-    # get the average frame rate of the file
-    mean_fps = raw['currentFrameRate'].mean()
-    # get number of frames to skip
-    skip = round(mean_fps / target_fps)
-    if skip == 0:
-        print('WARNING: Average file frame rate is less that half the target frame rate. Taking every frame.')
-        skip = 1
-    # replace raw df with skipped frame version
-    raw = raw.iloc[::skip,:]
+    # get the variables of interest, leaving out any that won't be used
+    VoI, _ = get_required_VoI(derive_features=derive_features)
+
+    # get the columns of the raw leap data needed for the VoI from a csv file or archive,
+    # resampling each device separately as it is read
+    raw, mean_fps, n_frames = read_resampled(raw_file, VoI, target_fps=target_fps, rows=rows)
+    if mean_fps < target_fps:
+        print('WARNING: Average file frame rate is less than the target frame rate. Taking every frame.')
 
     print(f'mean fps: {mean_fps:.2f}')
     print(f'target fps: {target_fps}')
-    print(f'taking every {skip} frames')
+    print(f'taking {len(raw)} of {n_frames} frames')
     
 
     ### get df with VoI only
@@ -125,22 +272,25 @@ def CSV2VoI(raw_file='data/recordings/fist_test.csv', VoI_file='params/VoI.txt',
 
 
 def df2X_y(df, g2idx = {'no_gesture': 0, 'so_so': 1, 'open_close': 2, 'maybe': 3}, hands=['right', 'left'],
-            derive_features=True, standardize=True, dicts_gen=False, mirror=False):
+            derive_features=True, standardize=True, dicts_gen=False, mirror=False, standardizer=None, return_columns=False):
     """Extracts X and y from pandas data frame, drops nan rows, and normalizes variables
 
     Arguments:
     df -- a dataframe of leap motion capture data
     g2idx -- dict mapping gesture names to integers
-    hands -- list of hands to keep columns for
+    hands -- list of hands to keep columns for, in any order, as features are derived for them in a fixed order
     derive_features -- bool, indicates whether or not to derive more features
     standardize -- bool, indicates whether or not to standardize and center variables
     create_dicts -- if true, new standard deviations and means dictionary are generated from the df, and saved to params/.
         needed if new features have been added to the model.
     mirror -- if true, flips data so that left hand becomes right hand and vice versa
+    standardizer -- Standardizer to standardize with, by default one is made from the dictionaries in params/
+    return_columns -- if true, the names of the predictors are returned too, e.g. for making a Mirror
 
     Returns:
     df.values -- np array of shape (time steps, features), predictors for every time step
     y -- np array of shape (time steps), with an int label for every time step
+    columns -- list of the predictors in df.values, in sorted order, if return_columns is true
 
     Note:
     Purging na rows is a bit clumsy, it results in sudden time jumps in the input.
@@ -181,10 +331,11 @@ def df2X_y(df, g2idx = {'no_gesture': 0, 'so_so': 1, 'open_close': 2, 'maybe': 3
     # at this point, we may wish to derive some more features, and drop some of the original VoI
     if derive_features:
         derived_feature_dict = get_derived_feature_dict()
-        df = pd.concat([df, pd.DataFrame.from_records(df.apply(features.get_derived_features,args=(derived_feature_dict,),axis=1))], axis=1)
-        for hand in hands:
-            for VoI in get_VoI_drop():
-                df.drop(hand + '_' + VoI, axis=1, inplace=True)
+        df = pd.concat([df, features.get_derived_features_batch(df, derived_feature_dict, hands)], axis=1)
+        # drop what isn't a predictor, including anything VoI_drop.txt lists that wasn't read
+        _, VoI_drop = get_required_VoI()
+        VoI_drop = dict.fromkeys(VoI_drop + get_VoI_drop())
+        df = df.drop(columns=[hand + '_' + VoI for hand in hands for VoI in VoI_drop if hand + '_' + VoI in df.columns])
     
     # extract the gesture label after dealing with nans
     y = [g2idx[i] for i in df['gesture']]
@@ -194,28 +345,68 @@ def df2X_y(df, g2idx = {'no_gesture': 0, 'so_so': 1, 'open_close': 2, 'maybe': 3
     if dicts_gen:
         create_dicts(df)
 
+    # make sure that columns are in alphabetical order, so that model training and deployment accord with one another
+    df = df.reindex(sorted(df.columns), axis=1)
+    X = df.to_numpy(dtype=np.float64)
+
     # perform mean normalization and scaling for unit variance
     if standardize:
         # use the dictionaries of means and stds for each variable
-        with open('params/means_dict.json', 'r') as f:
-            means_dict = json.load(f)
-        for col in df.columns:
-            df[col] = df[col] - means_dict[col]
-        with open('params/stds_dict.json', 'r') as f:
-            stds_dict = json.load(f)
-        for col in df.columns:
-            df[col] = df[col] / stds_dict[col]
-    
+        if standardizer is None:
+            standardizer = Standardizer()
+        standardizer.compile(df.columns)
+        standardizer.apply(X, out=X)
+
     # get range for each variable, to check normalization:
-    # print(df.min(), df.max())
-    # make sure that columns are in alphabetical order, so that model training and deployment accord with one another
-    df = df.reindex(sorted(df.columns), axis=1)
-    
-    return df.values, np.array(y)
+    # print(X.min(axis=0), X.max(axis=0))
+    if return_columns:
+        return X, np.array(y), list(df.columns)
+    return X, np.array(y)
+
 
 
+def get_window_starts(y, n_frames=30, stride=None):
+    """finds where each example starts, for examples of n_frames taken from within runs of the same gesture
+
+    Arguments:
+    y -- labels for each frame
+    n_frames -- int, length of each example
+    stride -- int, how far apart examples within a run are, defaults to n_frames // 2
 
-def X_y2examples(X,y=[],n_frames=30, stride=None):
+    Returns:
+    starts -- np array of the index of the first frame of each example
+    labels -- np array of the label of each example
+    """
+    if stride == None:
+        stride = n_frames // 2
+    y = np.asarray(y)
+    # run length encoding: the start and (non inclusive) end of each run of the same gesture
+    changes = np.flatnonzero(y[1:] != y[:-1]) + 1
+    run_starts = np.concatenate(([0], changes))
+    run_ends = np.concatenate((changes, [len(y)]))
+    # no. of examples that fit in each run
+    counts = np.where(run_ends - run_starts >= n_frames, (run_ends - run_starts - n_frames) // stride + 1, 0)
+    runs = np.repeat(np.arange(len(run_starts)), counts)
+    # position of each example within its run
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return run_starts[runs] + k * stride, y[run_starts[runs]]
+
+
+def sliding_windows(X, n_frames=30):
+    """read only view of X of shape (len(X) - n_frames + 1, n_frames, features), window i being X[i:i+n_frames]
+
+    No data is copied: indexing the view with window starts gives examples.
+    """
+    X = np.asarray(X)
+    if len(X) < n_frames:
+        windows = np.empty((0, n_frames) + X.shape[1:], dtype=X.dtype)
+        windows.flags.writeable = False
+        return windows
+    # the window axis is added last, move it to be the frames axis
+    return np.moveaxis(np.lib.stride_tricks.sliding_window_view(X, n_frames, axis=0), -1, 1)
+
+
+def X_y2examples(X,y=[],n_frames=30, stride=None, as_index=False):
     """splits a contiguous list of frames and labels up into single gesture examples of length n_frames
     
     Arguments:
@@ -223,10 +414,15 @@ def X_y2examples(X,y=[],n_frames=30, stride=None):
     y -- labels for each frame
     n_frames -- int, length of each training example
     stride -- int, determines how far to move along the sliding window that takes training examples, defaults to n_frames // 2
+    as_index -- bool, if true, examples are not copied out of X, see Returns
 
     Returns:
     X_final -- np array of shape (examples, frames, features)
     y_final -- np array of shape (examples), using integers to indicate gestures. I.e. not one hot.
+    or if as_index is true:
+    windows -- read only view of X, of every window of n_frames (see sliding_windows)
+    starts -- np array of shape (examples), windows[starts] gives X_final
+    y_final -- as above
 
     Note:
     A sliding window is used to take training examples, with stride equal to half of frame size
@@ -236,40 +432,17 @@ def X_y2examples(X,y=[],n_frames=30, stride=None):
     # # simple test case
     # X = [[0,1],[0,2],[0,3],[0,4],[0,5],[0,6],[0,7],[0,8],[1,1],[1,2],[1,3],[1,4],[1,5],[3,1],[3,2],[3,3],[3,4],[3,5],[3,6],[3,7],[4,1],[4,2]]
     # y = [0,0,0,0,0,0,0,0,1,1,1,1,1,3,3,3,3,3,3,3,4,4]
+    X = np.asarray(X)
     
     # if there are no y labels, then just return X split up into n_frames length examples
     if len(y) == 0:
-        return np.array([X[i:i+n_frames] for i in range(0, len(X) - len(X) % n_frames, n_frames)])
-    
-    if stride == None:
-        stride = n_frames // 2
-    
-    #### part 1: get the start and end indices of each gesture
-    # each sublist contains two indices, for start and end
-    Xsplit = [[0]]
-    # ysplit contains a label for each sublist in Xsplit
-    ysplit = [y[0]]
-    for i, g in enumerate(y):
-        # check if this frame is a different gestre
-        if g != ysplit[-1]:
-            # note down i - 1 as last index of previous gesture
-            Xsplit[-1].append(i-1)
-            # note down i as first index of current gesture
-            Xsplit.append([i])
-            ysplit.append(g)
-    Xsplit[-1].append(len(X)-1)
-
-    #### part 2: split up into examples, using the generated indices
-    X_final = []
-    y_final = []
-    for i, g in enumerate(ysplit):
-        # iterate over what will be the end index of each training example
-        # we add 2 to the upper bound because it is non inclusive (+1), but then neither is the stop index when slicing to get the example (+1 again)
-        for j in range(Xsplit[i][0] + n_frames, Xsplit[i][1] + 2, stride):
-            X_final.append(X[j-n_frames:j])
-            y_final.append(g)
-
-    return np.array(X_final), np.array(y_final)
+        return X[:len(X) - len(X) % n_frames].reshape((-1, n_frames) + X.shape[1:])
+
+    starts, y_final = get_window_starts(y, n_frames=n_frames, stride=stride)
+    windows = sliding_windows(X, n_frames=n_frames)
+    if as_index:
+        return windows, starts, y_final
+    return windows[starts], y_final
 
 
 def synced_shuffle(x, y):
@@ -292,43 +465,202 @@ def mirror_data(df, hands=['left', 'right']):
     return df_flipped
 
 
+class Mirror:
+    """mirrors standardized data, so that the left hand becomes the right hand and vice versa
+
+    Gives the same result as mirroring the data with mirror_data, then deriving features and standardizing it
+    again, but as a precomputed column permutation and per column scale and offset, so it is cheap enough to apply
+    to each batch as it is used. Raw variables ending in _0 (x coordinates) change sign when mirrored. Derived features
+    are distances and angles, which don't, so they only swap hands.
+
+    Arguments:
+    columns -- list of predictors, in the order of the data to be mirrored (sorted, as returned by df2X_y)
+    standardizer -- Standardizer the data was standardized with, or None if it isn't standardized
+    derived_feature_dict -- dict of the derived features in the data, as from get_derived_feature_dict, None if none
+    """
+    def __init__(self, columns, standardizer=None, derived_feature_dict=None):
+        columns = list(columns)
+        derived = set()
+        if derived_feature_dict is not None:
+            derived = set(features.derived_feature_names(derived_feature_dict))
+            # a one handed feature that isn't computed for each hand can't be swapped
+            for c in features.derived_feature_names({'one_handed': derived_feature_dict['one_handed'], 'two_handed': []}):
+                if 'left' not in c and 'right' not in c and c in columns:
+                    raise ValueError(f'{c} is not computed for each hand, so data containing it cannot be mirrored')
+        column_idx = {c: i for i, c in enumerate(columns)}
+        self.columns = columns
+        self.permutation = np.empty(len(columns), dtype=int)
+        sign = np.ones(len(columns))
+        for i, c in enumerate(columns):
+            mirrored = c.replace('left', 'lft').replace('right', 'left').replace('lft', 'right')
+            if mirrored not in column_idx:
+                raise ValueError(f'cannot mirror {c}, there is no {mirrored} to swap it with')
+            self.permutation[i] = column_idx[mirrored]
+            if c.endswith('0') and c not in derived:
+                sign[i] = -1
+        if standardizer is not None:
+            assert standardizer.compile(columns) == columns, 'columns must be in sorted order, as used by the standardizer'
+            means, stds = standardizer.means, standardizer.stds
+            # unstandardize the swapped column, flip it, and standardize it as this column
+            self.scale = sign * stds[self.permutation] / stds
+            self.offset = (sign * means[self.permutation] - means) / stds
+        else:
+            self.scale = sign
+            self.offset = np.zeros(len(columns))
+
+    def apply(self, X, out=None):
+        """returns the mirror image of X, an array of shape (..., predictors)
+
+        out -- array to write the result to, e.g. X itself, to mirror in place
+        """
+        out = np.take(X, self.permutation, axis=-1, out=out)
+        out *= self.scale
+        out += self.offset
+        return out
+
+
 #### methods for combining the above together, to go straight from a CSVs to training examples
 
+def file2X_y(raw_file, target_fps=30, g2idx={'no_gesture': 0, 'so_so': 1}, hands=['left', 'right'], standardize=True,
+        dicts_gen=False, derive_features=True, cache=None):
+    """gets VoI from a CSV or archive, and turns them into contiguous X and y, using a cache if one is given
+
+    Arguments:
+    raw_file -- str, path of the recording
+    cache -- RecordingCache, or None to always process the recording. Not used if dicts_gen is true
+    dicts_gen -- bool, if true, the dictionaries are generated from this recording alone, as for df2X_y. To generate
+        them from many recordings, use folder2examples or folder2dicts
+    the other arguments are as for CSV2VoI and df2X_y
+
+    Returns:
+    X_contiguous, y_contiguous, columns -- as from df2X_y with return_columns, or None if the recording doesn't
+        contain data for every hand in hands
+    """
+    print(' ')
+    print(os.fspath(raw_file))
+    if cache is not None and not dicts_gen:
+        # the dictionaries only affect standardized data, so computing them doesn't change the key of unstandardized data
+        param_files = PARAM_FILES if standardize else [name for name in PARAM_FILES if name not in DICT_FILES]
+        key = cache.key(raw_file, param_files=param_files, target_fps=target_fps, g2idx=g2idx, hands=hands,
+            standardize=standardize, derive_features=derive_features)
+        cached = cache.get(key)
+        if cached is not None:
+            print('using cached data')
+            return (cached['X'], cached['y'], list(cached['columns'])) if 'X' in cached else None
+    df = CSV2VoI(raw_file=raw_file, VoI_file='params/VoI.txt', target_fps=target_fps, derive_features=derive_features)
+    X_y = None
+    if all(len(df.filter(regex=hand).columns) > 0 for hand in hands):
+        X_y = df2X_y(df, g2idx, hands=hands, standardize=standardize, dicts_gen=dicts_gen,
+            derive_features=derive_features, return_columns=True)
+    else:
+        print(f'WARNING: skipping {os.fspath(raw_file)}, it does not contain data for every hand in {hands}')
+    if cache is not None and not dicts_gen:
+        if X_y is None:
+            # remember that the recording is skipped
+            cache.put(key)
+        else:
+            cache.put(key, X=X_y[0], y=X_y[1], columns=np.array(X_y[2]))
+    return X_y
+
+
+def X_y2mirrored_examples(X_y, n_frames=30, mirror=True, standardize=True, derive_features=True):
+    """splits each recording's contiguous X and y into examples, adding their mirror images if mirror is true
+
+    Arguments:
+    X_y -- list of (X_contiguous, y_contiguous, columns) from file2X_y, one for each recording
+    the other arguments are as for file2X_y and X_y2examples
+
+    Returns:
+    X, y -- as from X_y2examples, for all of the recordings, not shuffled. Empty, of shape (0, n_frames, features),
+        if no recording is long enough for an example
+    """
+    # examples are indexed out of each recording's windows (see sliding_windows) straight into X, so are copied once
+    recordings = []
+    for X_contiguous, y_contiguous, columns in X_y:
+        # every row may have been dropped, e.g. for nans
+        if len(y_contiguous) == 0:
+            continue
+        windows, starts, y_file = X_y2examples(X_contiguous, y=y_contiguous, n_frames=n_frames, as_index=True)
+        if len(starts):
+            recordings.append((windows, starts, y_file, columns))
+    if not recordings:
+        n_features = len(X_y[0][2]) if X_y else 0
+        return np.empty((0, n_frames, n_features)), np.empty(0, dtype=int)
+    copies = 2 if mirror else 1
+    n_examples = sum(len(starts) for _, starts, _, _ in recordings)
+    X = np.empty((copies * n_examples,) + recordings[0][0].shape[1:],
+        dtype=np.result_type(*[windows for windows, _, _, _ in recordings]))
+    y = np.empty(copies * n_examples, dtype=np.result_type(*[y_file for _, _, y_file, _ in recordings]))
+    # one mirror for each set of columns, made once and applied to each recording's examples
+    mirrors = {}
+    i = 0
+    for windows, starts, y_file, columns in recordings:
+        n = len(starts)
+        np.take(windows, starts, axis=0, out=X[i:i + n])
+        y[i:i + n] = y_file
+        if mirror:
+            if tuple(columns) not in mirrors:
+                mirrors[tuple(columns)] = Mirror(columns, standardizer=Standardizer() if standardize else None,
+                    derived_feature_dict=get_derived_feature_dict() if derive_features else None)
+            # the mirror images of a recording's examples follow them
+            mirrors[tuple(columns)].apply(X[i:i + n], out=X[i + n:i + 2 * n])
+            y[i + n:i + 2 * n] = y_file
+        i += copies * n
+    return X, y
+
+
 def CSV2examples(raw_file='data/recordings/test1.csv', target_fps=30,
-        g2idx={'no_gesture': 0, 'so_so': 1}, hands=['left', 'right'], n_frames=25, standardize=True, dicts_gen=False, mirror=True, derive_features=True):
-    """all of the above: gets VoI, and using these, splits a CSV to X and y"""
-    df = CSV2VoI(raw_file=raw_file, VoI_file='params/VoI.txt', target_fps=target_fps)
-    X_contiguous, y_contiguous = df2X_y(df, g2idx, hands=hands, standardize=standardize, dicts_gen=dicts_gen, mirror=False, derive_features=derive_features)
-    X, y = X_y2examples(X_contiguous, y=y_contiguous, n_frames=n_frames)
-    if mirror:
-        X_contiguous, y_contiguous = df2X_y(df, g2idx, hands=hands, standardize=standardize, dicts_gen=dicts_gen, mirror=True, derive_features=derive_features)
-        X2, y2 = X_y2examples(X_contiguous, y=y_contiguous, n_frames=n_frames)
-        X = np.concatenate([X,X2])
-        y = np.concatenate([y, y2])
+        g2idx={'no_gesture': 0, 'so_so': 1}, hands=['left', 'right'], n_frames=25, standardize=True, dicts_gen=False, mirror=True, derive_features=True,
+        cache_dir='data/cache/'):
+    """all of the above: gets VoI, and using these, splits a CSV to X and y
+
+    cache_dir -- str, folder for caching processed recordings (see src/cache.py), or None to not cache
+    """
+    cache = RecordingCache(cache_dir) if cache_dir is not None else None
+    X_y = file2X_y(raw_file, target_fps=target_fps, g2idx=g2idx, hands=hands, standardize=standardize,
+        dicts_gen=dicts_gen, derive_features=derive_features, cache=cache)
+    X, y = X_y2mirrored_examples([X_y] if X_y is not None else [], n_frames=n_frames, mirror=mirror,
+        standardize=standardize, derive_features=derive_features)
     synced_shuffle(X, y)
     return X, y
 
 
 def folder2examples(folder='data/loops/', target_fps=30,
         g2idx={'no_gesture': 0, 'so_so': 1}, hands=['left', 'right'], n_frames=25, standardize=True,
-        dicts_gen=False, mirror=True, derive_features=True):
-    '''all of the above: gets VoI, splits a folder of CSVs to X and y'''
-    # create empty data frame
-    df = pd.DataFrame()
-    # read in all training data from folder
-    for file in os.scandir(folder):
-        print(' ')
-        print(file)
-        df2 = CSV2VoI(file, target_fps=target_fps)
-        df = pd.concat([df, df2], ignore_index=True)
-    X_contiguous, y_contiguous = df2X_y(df, g2idx, hands=hands, standardize=standardize, dicts_gen=dicts_gen, mirror=False, derive_features=derive_features)
-    X, y = X_y2examples(X_contiguous, y=y_contiguous, n_frames=n_frames)
-    if mirror:
-        X_contiguous, y_contiguous = df2X_y(df, g2idx, hands=hands, standardize=standardize, dicts_gen=dicts_gen, mirror=True, derive_features=derive_features)
-        X2, y2 = X_y2examples(X_contiguous, y=y_contiguous, n_frames=n_frames)
-        X = np.concatenate([X,X2])
-        y = np.concatenate([y, y2])
-    synced_shuffle(X, y)
-    return X, y
+        dicts_gen=False, mirror=True, derive_features=True, cache_dir='data/cache/', processes=1):
+    '''all of the above: gets VoI, splits a folder of CSVs to X and y
 
+    cache_dir -- str, folder for caching processed recordings (see src/cache.py), or None to not cache.
+        With a cache, only recordings (or params) that have changed since the last call are processed again,
+        so e.g. n_frames can be changed cheaply
+    processes -- int, no. of worker processes to process recordings in parallel with. 1 processes them one at a time
+        in this process, None uses one process per core
+    dicts_gen -- bool, if true, new means and standard deviations dictionaries are generated from every recording in
+        the folder together (see folder2dicts in src/stats.py) and saved to params/, before any recording is standardized
 
+    Note:
+    Each recording is split into examples separately, so that no example contains frames from two recordings.
+    Mirror images are made from the examples, using Mirror, rather than by processing each recording twice.
+    '''
+    if dicts_gen:
+        # imported here, as src/stats.py imports this module
+        from src.stats import folder2dicts
+        # written in this process, before any worker starts, as workers read them (and cache keys hash them)
+        folder2dicts([folder], target_fps=target_fps, g2idx=g2idx, hands=hands, derive_features=derive_features,
+            cache_dir=cache_dir, processes=processes)
+        # every recording is then standardized with the same dictionaries
+        dicts_gen = False
+    cache = RecordingCache(cache_dir) if cache_dir is not None else None
+    files = list_recordings(folder)
+    process_file = partial(file2X_y, target_fps=target_fps, g2idx=g2idx, hands=hands, standardize=standardize,
+        dicts_gen=dicts_gen, derive_features=derive_features, cache=cache)
+    if processes == 1:
+        results = map(process_file, files)
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(process_file, files))
+    # split each recording into examples, gathering them, and their mirror images, to be concatenated once
+    X, y = X_y2mirrored_examples([X_y for X_y in results if X_y is not None], n_frames=n_frames, mirror=mirror,
+        standardize=standardize, derive_features=derive_features)
+    synced_shuffle(X, y)
+    return X, y
@@ -0,0 +1,153 @@
+import os
+import json
+import math
+import shutil
+import numpy as np
+import tensorflow as tf
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from src.data_methods import file2X_y, get_window_starts, sliding_windows, Mirror, Standardizer, get_derived_feature_dict
+from src.cache import RecordingCache
+from src.recording import list_recordings
+
+#### methods for training on more recordings than fit in memory
+
+# Recordings are processed (as by folder2examples) once, and each recording's contiguous X and y are saved as .npy
+# files in an arrays folder, along with meta.json, holding the columns of X and how the recordings were processed,
+# and copies of the dictionaries and derived features they were standardized with (ARRAY_PARAM_FILES). A WindowSequence then reads examples from these by memory mapping, a batch at a time, so that only the batches being
+# used are ever held in memory.
+
+# files in params/ that the recordings in an arrays folder are processed with, and that mirroring them needs
+ARRAY_PARAM_FILES = ['means_dict.json', 'stds_dict.json', 'derived_features_one_handed.txt',
+    'derived_features_two_handed.txt']
+
+def recording2arrays(raw_file, arrays_dir, cache=None, **kwargs):
+    """processes a recording with file2X_y, and saves its X (as float32) and y to .npy files in arrays_dir
+
+    Returns:
+    name, columns -- file name the arrays are saved under, and the columns of X, or None if the recording was skipped.
+        The name keeps the recording's extension, so that e.g. foo.csv and foo.lrec don't overwrite one another
+    """
+    X_y = file2X_y(raw_file, cache=cache, **kwargs)
+    if X_y is None:
+        return None
+    X, y, columns = X_y
+    name = os.path.basename(os.path.normpath(raw_file))
+    np.save(os.path.join(arrays_dir, name + '.X.npy'), X.astype(np.float32))
+    np.save(os.path.join(arrays_dir, name + '.y.npy'), y)
+    return name, columns
+
+
+def folder2arrays(folder='data/loops/', arrays_dir='data/arrays/', target_fps=30,
+        g2idx={'no_gesture': 0, 'so_so': 1}, hands=['left', 'right'], standardize=True, derive_features=True,
+        cache_dir='data/cache/', processes=1):
+    """processes every recording in a folder, saving them to arrays_dir for training with a WindowSequence
+
+    The arguments are as for folder2examples, except that recordings aren't split into examples or mirrored,
+    which is left to the WindowSequence. Recordings are saved as they are processed, so only as many are held in memory
+    as there are processes.
+
+    Returns:
+    arrays_dir -- str
+    """
+    os.makedirs(arrays_dir, exist_ok=True)
+    # kept with the arrays, so that they are mirrored with what they were processed with, even once params/ changes
+    for name in ARRAY_PARAM_FILES:
+        shutil.copy(os.path.join('params', name), arrays_dir)
+    cache = RecordingCache(cache_dir) if cache_dir is not None else None
+    files = list_recordings(folder)
+    process_file = partial(recording2arrays, arrays_dir=arrays_dir, cache=cache, target_fps=target_fps, g2idx=g2idx,
+        hands=hands, standardize=standardize, derive_features=derive_features)
+    if processes == 1:
+        results = list(map(process_file, files))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(process_file, files))
+    results = [r for r in results if r is not None]
+    assert results, f'no recordings in {folder} contain data for every hand in {hands}'
+    columns = results[0][1]
+    for name, recording_columns in results:
+        assert recording_columns == columns, f'{name} has different columns to the other recordings'
+    meta = {'recordings': [name for name, _ in results], 'columns': columns, 'standardize': standardize,
+        'derive_features': derive_features, 'g2idx': g2idx}
+    with open(os.path.join(arrays_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    return arrays_dir
+
+
+class WindowSequence(tf.keras.utils.Sequence):
+    """batches of examples for model.fit, read from the memory mapped recordings in an arrays folder as they are needed
+
+    Examples are windows of n_frames from within a run of the same gesture, exactly as taken by X_y2examples. With
+    mirror, the mirror image of every example is included too, as with folder2examples, made as each batch is read.
+    Pass as the training data to model.fit, with workers to read batches in parallel with training.
+
+    Arguments:
+    arrays_dir -- str, folder written by folder2arrays
+    n_frames -- int, length of each example
+    stride -- int, how far apart examples within a run are, defaults to n_frames // 2
+    batch_size -- int, no. of examples per batch
+    shuffle -- bool, if true, the order of examples is shuffled every epoch
+    mirror -- bool, if true, the mirror images of examples are included, using the dictionaries and derived features
+        the recordings were processed with, as kept in arrays_dir
+    seed -- int, seed for shuffling
+    kwargs -- passed on to keras.utils.Sequence, e.g. workers=4 with keras 3, which takes it here rather than in fit
+    """
+    def __init__(self, arrays_dir='data/arrays/', n_frames=25, stride=None, batch_size=50, shuffle=True, mirror=True,
+            seed=None, **kwargs):
+        super().__init__(**kwargs)
+        with open(os.path.join(arrays_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.n_frames = n_frames
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        # read only windows over each recording, read from disk when indexed
+        self.windows = []
+        self.y = []
+        recording_idx, starts = [], []
+        for i, name in enumerate(self.meta['recordings']):
+            X = np.load(os.path.join(arrays_dir, name + '.X.npy'), mmap_mode='r')
+            y = np.load(os.path.join(arrays_dir, name + '.y.npy'))
+            recording_starts, _ = get_window_starts(y, n_frames=n_frames, stride=stride)
+            self.windows.append(sliding_windows(X, n_frames=n_frames))
+            self.y.append(y)
+            recording_idx.append(np.full(len(recording_starts), i))
+            starts.append(recording_starts)
+        # every example, as a recording index, the start of its window, and whether it is mirrored
+        recording_idx = np.concatenate(recording_idx)
+        starts = np.concatenate(starts)
+        mirrored = np.zeros(len(starts), dtype=bool)
+        self.mirror = None
+        if mirror:
+            params_path = os.path.join(arrays_dir, '')
+            self.mirror = Mirror(self.meta['columns'],
+                standardizer=Standardizer(params_path) if self.meta['standardize'] else None,
+                derived_feature_dict=get_derived_feature_dict(params_path) if self.meta['derive_features'] else None)
+            recording_idx = np.concatenate((recording_idx, recording_idx))
+            starts = np.concatenate((starts, starts))
+            mirrored = np.concatenate((mirrored, ~mirrored))
+        self.examples = np.rec.fromarrays((recording_idx, starts, mirrored), names='recording,start,mirrored')
+        self.order = np.arange(len(self.examples))
+        self.on_epoch_end()
+
+    def __len__(self):
+        return math.ceil(len(self.examples) / self.batch_size)
+
+    def __getitem__(self, idx):
+        batch = self.examples[self.order[idx * self.batch_size:(idx + 1) * self.batch_size]]
+        X = np.empty((len(batch), self.n_frames, len(self.meta['columns'])), dtype=np.float32)
+        y = np.empty(len(batch), dtype=np.int64)
+        # read each recording's examples in one go
+        for i in np.unique(batch.recording):
+            in_recording = batch.recording == i
+            starts = batch.start[in_recording]
+            X[in_recording] = self.windows[i][starts]
+            y[in_recording] = self.y[i][starts]
+        if self.mirror is not None and batch.mirrored.any():
+            X[batch.mirrored] = self.mirror.apply(X[batch.mirrored])
+        return X, y
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self.rng.shuffle(self.order)
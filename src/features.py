@@ -1,36 +1,162 @@
+import copy
 import numpy as np
 import pandas as pd
 
+FINGERS = ['thumb', 'index', 'middle', 'ring', 'pinky']
+
+def vector_sources(hands=['left', 'right']):
+    """dictionary of the vectors features are derived from, and the variable each is made of
+
+    e.g. 'left_f1' is made of 'left_thumb_tipPosition_0', 'left_thumb_tipPosition_1' and 'left_thumb_tipPosition_2'
+    """
+    sources = {}
+    for hand in hands:
+        for i, finger in enumerate(FINGERS):
+            sources[f'{hand}_f{i+1}'] = f'{hand}_{finger}_tipPosition'
+    for hand in hands:
+        sources[f'{hand}_palm_norm'] = f'{hand}_palmNormal'
+        sources[f'{hand}_palm_position'] = f'{hand}_palmPosition'
+        sources[f'{hand}_wrist'] = f'{hand}_wrist'
+        sources[f'{hand}_elbow'] = f'{hand}_elbow'
+        sources[f'{hand}_palm_velocity'] = f'{hand}_palmVelocity'
+    return sources
+
+
+def ordered_hands(hands):
+    """hands in a fixed order, left then right, so that features are derived the same whatever order hands are given in
+
+    e.g. palm_velocity is the same feature for either hand, and is the last hand's
+    """
+    return [hand for hand in ('left', 'right') if hand in hands]
+
+
 def get_derived_features(frame, derived_feature_dict, hands=['left', 'right']):
     """given a frame of gesture data, returns some derived features"""
-    # get fingertip positions
-    fingers = ['thumb', 'index', 'middle', 'ring', 'pinky']
     # create dictionary of the features needed for deriving new features
-    features = {}
-    for hand in hands:
-        for i, finger in enumerate(fingers):
-            features[f'{hand}_f{i+1}'] = np.array([frame[f'{hand}_{finger}_tipPosition_{j}'] for j in (0,1,2)])
-    for hand in hands:
-        features[f'{hand}_palm_norm'] = np.array([frame[f'{hand}_palmNormal_{i}'] for i in (0,1,2)])
-        features[f'{hand}_palm_position'] = np.array([frame[f'{hand}_palmPosition_{i}'] for i in (0,1,2)])
-        features[f'{hand}_wrist'] = np.array([frame[f'{hand}_wrist_{i}'] for i in (0,1,2)])
-        features[f'{hand}_elbow'] = np.array([frame[f'{hand}_elbow_{i}'] for i in (0,1,2)])
-        features[f'{hand}_palm_velocity'] = np.array([frame[f'{hand}_palmVelocity_{i}'] for i in (0,1,2)])
+    sources = vector_sources(hands)
+    features = {name: np.array([frame[f'{sources[name]}_{j}'] for j in (0,1,2)])
+        for name in required_vectors(derived_feature_dict, hands)}
+    return derive(features, derived_feature_dict, hands)
+
+
+def get_derived_features_batch(df, derived_feature_dict, hands=['left', 'right']):
+    """given a df of gesture data, returns a df of derived features for every frame, with the same index
+
+    Gives the same values as applying get_derived_features to each row, but computes each feature for all frames at once.
+    """
+    # (frames, 3) array of the x, y and z components of each vector
+    sources = vector_sources(hands)
+    features = {name: np.stack([df[f'{sources[name]}_{j}'].to_numpy(dtype=np.float64) for j in (0,1,2)], axis=-1)
+        for name in required_vectors(derived_feature_dict, hands)}
+    return pd.DataFrame(derive(features, derived_feature_dict, hands), index=df.index)
+
 
+def derive(features, derived_feature_dict, hands=['left', 'right']):
+    """computes the features in derived_feature_dict, from a dictionary of the vectors they are derived from
+
+    Vectors are either np arrays of shape (3,), for a single frame, or (frames, 3), for many frames at once.
+    Hands are taken left then right, however hands is ordered (see ordered_hands).
+    """
     # create dictionary of new features
     new_features = {}
     for f in derived_feature_dict['one_handed']:
-        for hand in hands:
-            globals()[f](new_features, features, hand)
+        for hand in ordered_hands(hands):
+            get_feature(f, two_handed=False)['method'](new_features, features, hand)
 
     if len(hands) == 2:
         # compute between hand features
         for f in derived_feature_dict['two_handed']:
-            globals()[f](new_features, features)
+            get_feature(f, two_handed=True)['method'](new_features, features)
 
     return new_features
 
 
+def _declared(derived_feature_dict, hands, field):
+    """names declared in the registry under field ('inputs' or 'outputs') for every feature derive would compute, in order"""
+    names = []
+    for f in derived_feature_dict['one_handed']:
+        for hand in ordered_hands(hands):
+            names += [name.format(hand=hand) for name in get_feature(f, two_handed=False)[field]]
+    if len(hands) == 2:
+        for f in derived_feature_dict['two_handed']:
+            names += get_feature(f, two_handed=True)[field]
+    # e.g. palm_velocity gives the same name for each hand
+    return list(dict.fromkeys(names))
+
+
+def derived_feature_names(derived_feature_dict, hands=['left', 'right']):
+    """names of the features that derive computes, in the order it computes them"""
+    return _declared(derived_feature_dict, hands, 'outputs')
+
+
+def required_vectors(derived_feature_dict, hands=['left', 'right'], fury=False):
+    """names of the vectors (see vector_sources) needed to derive the features in derived_feature_dict
+
+    With fury, the vectors get_fury2 needs are included too.
+    """
+    vectors = _declared(derived_feature_dict, hands, 'inputs')
+    if fury:
+        fury_vectors = [v.format(hand=hand) for hand in ('left', 'right') for v in FURY_VECTORS]
+        vectors += [v for v in fury_vectors if v not in vectors]
+    return vectors
+
+
+def required_variables(derived_feature_dict, hands=['left', 'right'], fury=False):
+    """variables of interest (without a hand, as in VoI.txt) needed to derive the features in derived_feature_dict"""
+    sources = vector_sources(['left', 'right'])
+    variables = []
+    for vector in required_vectors(derived_feature_dict, hands, fury):
+        # e.g. left_palm_norm is made of left_palmNormal_0, ..., so needs palmNormal_0, ...
+        variable = sources[vector].split('_', 1)[1]
+        variables += [f'{variable}_{j}' for j in (0,1,2) if f'{variable}_{j}' not in variables]
+    return variables
+
+
+#### registry of the features that can be derived
+
+# every feature method, by name, as a dict of:
+# method -- the function, called as method(new_features, features, hand), or without hand if two handed
+# inputs -- the vectors it is derived from, as named in vector_sources
+# outputs -- the names of the features it computes
+# two_handed -- whether it is a between hand feature
+# in the inputs and outputs of one handed features, {hand} stands for the hand
+FEATURES = {}
+
+def register_feature(inputs, outputs, two_handed=False):
+    """decorator adding a feature method to FEATURES, declaring what it is derived from and what it computes"""
+    def register(method):
+        FEATURES[method.__name__] = {'method': method, 'inputs': list(inputs), 'outputs': list(outputs),
+            'two_handed': two_handed}
+        return method
+    return register
+
+
+def get_feature(name, two_handed=False):
+    """the registry entry of a feature, checking that it exists, and is one or two handed as expected"""
+    entry = FEATURES.get(name)
+    if entry is None or entry['two_handed'] != two_handed:
+        kind = 'two handed' if two_handed else 'one handed'
+        known = [f for f, e in FEATURES.items() if e['two_handed'] == two_handed]
+        raise ValueError(f'{name} is not a {kind} feature, the {kind} features are {known}')
+    return entry
+
+
+#### features, each computed along the last axis, so that they work for one frame or many frames at once
+
+def dot(a, b):
+    """dot product of vectors along the last axis, the same as np.dot for a single pair of vectors"""
+    if isinstance(a, _Symbol):
+        return _Symbol(('dot', a.expr, b.expr))
+    # matmul gives exactly the same result as np.dot, where summing the products can differ in the last bit
+    return np.matmul(a[..., np.newaxis, :], b[..., :, np.newaxis])[..., 0, 0][()]
+
+def norm(v):
+    """euclidean length of vectors along the last axis, the same as np.linalg.norm for a single vector"""
+    if isinstance(v, _Symbol):
+        return _Symbol(('norm', v.expr))
+    return np.sqrt(dot(v, v))
+
+@register_feature(inputs=[f'{{hand}}_f{i}' for i in range(1,6)], outputs=[f'{{hand}}_f{i}_{i+1}' for i in range(1,5)])
 def adjacent_finger_distances(new_features, features, hand):
     """Calculates distances between fingertips for adjacent fingers, and stores them in new_features
 
@@ -44,43 +170,181 @@ def adjacent_finger_distances(new_features, features, hand):
     
     """
     for i in range(1, 5):
-        new_features[f'{hand}_f{i}_{i+1}'] = np.linalg.norm(features[f'{hand}_f{i}'] - features[f'{hand}_f{i+1}'])
+        new_features[f'{hand}_f{i}_{i+1}'] = norm(features[f'{hand}_f{i}'] - features[f'{hand}_f{i+1}'])
 
+@register_feature(inputs=['{hand}_palm_position'] + [f'{{hand}}_f{i}' for i in range(1,6)],
+    outputs=[f'{{hand}}_f{i}_p' for i in range(1,6)])
 def finger_palm_distances(new_features, features, hand):
     """Calculates distance to the center of the palm for each finger"""
     for i in range(1,6):
-        new_features[f'{hand}_f{i}_p'] = np.linalg.norm(features[f'{hand}_palm_position'] - features[f'{hand}_f{i}'])
+        new_features[f'{hand}_f{i}_p'] = norm(features[f'{hand}_palm_position'] - features[f'{hand}_f{i}'])
 
+@register_feature(inputs=['{hand}_palm_position', '{hand}_palm_norm'] + [f'{{hand}}_f{i}' for i in range(1,6)],
+    outputs=[f'{{hand}}_f{i}_p_plain' for i in range(1,6)])
 def finger_palm_plain_distances(new_features, features, hand):
     """Calculates distance to the palm plain for each finger"""
     for i in range(1,6):
-        new_features[f'{hand}_f{i}_p_plain'] = np.dot((features[f'{hand}_f{i}'] - features[f'{hand}_palm_position']), features[f'{hand}_palm_norm'])
+        new_features[f'{hand}_f{i}_p_plain'] = dot((features[f'{hand}_f{i}'] - features[f'{hand}_palm_position']), features[f'{hand}_palm_norm'])
 
+@register_feature(inputs=['{hand}_wrist', '{hand}_elbow', '{hand}_palm_norm'], outputs=['{hand}_wrist_angle'])
 def wrist_angle(new_features, features, hand):
     """calculates angle of wrist flexion/extension"""
     # get vector of elbow to wrist
     wrist_direction = features[f'{hand}_wrist'] - features[f'{hand}_elbow']
     # normalize it, so it is a unit vector
-    wrist_direction /= np.linalg.norm(wrist_direction)
+    wrist_direction /= norm(wrist_direction)[..., np.newaxis]
     # take dot product with palm normal vector. These are both unit vectors, so this will give the angle between them
-    new_features[f'{hand}_wrist_angle'] = np.dot(wrist_direction, features[f'{hand}_palm_norm'])
+    new_features[f'{hand}_wrist_angle'] = dot(wrist_direction, features[f'{hand}_palm_norm'])
 
+@register_feature(inputs=['{hand}_palm_velocity'], outputs=['palm_velocity'])
 def palm_velocity(new_features, features, hand):
     """calculates the magnitude of palm velocity"""
-    new_features[f'palm_velocity'] = np.linalg.norm(features[f'{hand}_palm_velocity'])
+    new_features[f'palm_velocity'] = norm(features[f'{hand}_palm_velocity'])
 
+@register_feature(inputs=['left_palm_position', 'right_palm_position'], outputs=['palm_distance'], two_handed=True)
 def interpalm_distance(new_features, features):
     """Calculates distance between center of each palm"""
-    new_features[f'palm_distance'] = np.linalg.norm(features[f'right_palm_position'] - features[f'left_palm_position'])
+    new_features[f'palm_distance'] = norm(features[f'right_palm_position'] - features[f'left_palm_position'])
 
+@register_feature(inputs=[f'{hand}_f{i}' for i in range(1,6) for hand in ('left', 'right')],
+    outputs=[f'f{i}_f{i}' for i in range(1,6)], two_handed=True)
 def interfinger_distances(new_features, features):
     """Calculates distances between left and right hand fingers of the same type"""
     for i in range(1,6):
-        new_features[f'f{i}_f{i}'] = np.linalg.norm(features[f'left_f{i}'] - features[f'right_f{i}'])
+        new_features[f'f{i}_f{i}'] = norm(features[f'left_f{i}'] - features[f'right_f{i}'])
 
+@register_feature(inputs=['left_palm_norm', 'right_palm_norm'], outputs=['palm_angle'], two_handed=True)
 def interpalm_angle(new_features, features):
     """calculate angle between palm norms... i.e. the dot product"""
-    new_features[f'palm_angle'] = np.dot(features[f'right_palm_norm'], features[f'left_palm_norm'])
+    new_features[f'palm_angle'] = dot(features[f'right_palm_norm'], features[f'left_palm_norm'])
+
+#### computing features live, a frame at a time
+
+class _Symbol:
+    """stands in for a vector while compiling features, recording how each feature is computed from it"""
+    def __init__(self, expr):
+        self.expr = expr
+
+    def __sub__(self, other):
+        return _Symbol(('sub', self.expr, other.expr))
+
+    def __truediv__(self, other):
+        return _Symbol(('div', self.expr, other.expr))
+
+    def __getitem__(self, key):
+        # e.g. adding an axis for broadcasting, which _evaluate does itself
+        return self
+
+
+def _pattern(expr, variables):
+    """the shape of an expression, with the variables it uses appended to variables in order"""
+    if expr[0] == 'var':
+        variables.append(expr[1])
+        return ('var',)
+    return (expr[0],) + tuple(_pattern(e, variables) for e in expr[1:])
+
+
+def _evaluate(pattern, vectors):
+    """evaluates a pattern, taking its variables in order from vectors, an iterator of arrays of shape (features, 3)"""
+    op = pattern[0]
+    if op == 'var':
+        return next(vectors)
+    args = [_evaluate(p, vectors) for p in pattern[1:]]
+    if op == 'sub':
+        return args[0] - args[1]
+    if op == 'div':
+        return args[0] / args[1][..., np.newaxis]
+    if op == 'dot':
+        return dot(args[0], args[1])
+    if op == 'norm':
+        return norm(args[0])
+    raise ValueError(f'unknown operation {op}')
+
+
+class LiveFeatureEngine:
+    """computes the model's input, and raw fury, from the values of a decoded frame in a few vectorized operations
+
+    Compiled once, at startup. The feature methods are traced with stand in vectors, giving each derived feature as an
+    expression of variables (e.g. norm(left_f1 - left_f2)). Features with the same expression are then computed
+    together, from values gathered out of the frame with precompiled indices. Values are the same as those of
+    get_derived_features, get_fury2 and a Standardizer, which are used in training.
+
+    Arguments:
+    columns -- list of the names of the values in a frame, e.g. FrameDecoder.columns
+    predictors -- list of the model's predictors, both variables in columns and derived features
+    derived_feature_dict -- dict of the features to derive, as from get_derived_feature_dict
+    standardizer -- Standardizer for the predictors, or None to not standardize
+    hands -- list of hands in the frame
+    """
+    def __init__(self, columns, predictors, derived_feature_dict, standardizer=None, hands=['left', 'right']):
+        column_idx = {c: i for i, c in enumerate(columns)}
+        self.standardizer = standardizer
+        self.predictors = standardizer.compile(predictors) if standardizer is not None else sorted(predictors)
+        # fury needs the distances between adjacent fingers, whether or not the model does
+        one_handed = list(derived_feature_dict['one_handed'])
+        if 'adjacent_finger_distances' not in one_handed:
+            one_handed.append('adjacent_finger_distances')
+        symbols = {name: _Symbol(('var', variable)) for name, variable in vector_sources(hands).items()}
+        derived = derive(symbols, {'one_handed': one_handed, 'two_handed': derived_feature_dict['two_handed']}, hands)
+        self.derived_names = list(derived)
+        derived_idx = {name: i for i, name in enumerate(self.derived_names)}
+        # group features with the same pattern of operations, each with the indices of the frame values it uses
+        groups = {}
+        for k, symbol in enumerate(derived.values()):
+            variables = []
+            pattern = _pattern(symbol.expr, variables)
+            features, indices = groups.setdefault(pattern, ([], []))
+            features.append(k)
+            indices.append([[column_idx[f'{variable}_{j}'] for j in (0,1,2)] for variable in variables])
+        # indices of shape (variables, features, 3), so that indexing a frame with them gives each variable in turn
+        self._groups = [(pattern, np.array(features), np.array(indices).transpose(1, 0, 2))
+            for pattern, (features, indices) in groups.items()]
+        self._derived = np.empty(len(self.derived_names))
+        # where each predictor comes from, either the frame, or the derived features
+        self._raw_positions = np.array([i for i, p in enumerate(self.predictors) if p not in derived_idx], dtype=int)
+        self._raw_idx = np.array([column_idx[p] for p in self.predictors if p not in derived_idx], dtype=int)
+        self._derived_positions = np.array([i for i, p in enumerate(self.predictors) if p in derived_idx], dtype=int)
+        self._derived_idx = np.array([derived_idx[p] for p in self.predictors if p in derived_idx], dtype=int)
+        # inputs of get_fury2, for the hands in the frame
+        self._velocity_idx = np.array([column_idx[f'{hand}_palmVelocity_{i}'] for i in (0,1,2) for hand in ordered_hands(hands)])
+        self._fingers_idx = np.array([derived_idx[f'{hand}_f{i}_{i+1}'] for i in (1,2,3,4) for hand in ordered_hands(hands)])
+        self._previous_fingers = None
+        self.raw_fury = 0
+
+    def reset(self):
+        """forget the previous frame, so that the next frame's raw fury is as for the first frame"""
+        self._previous_fingers = None
+        self.raw_fury = 0
+
+    def copy(self):
+        """a reset engine sharing this one's compiled computation, e.g. for processing another stream of frames"""
+        engine = copy.copy(self)
+        engine._derived = np.empty_like(self._derived)
+        engine.reset()
+        return engine
+
+    def process(self, frame):
+        """returns the (standardized) model input for a frame, a np array of the values named by columns
+
+        Also sets raw_fury, as get_fury2 would give for this frame and the previous one processed.
+        """
+        for pattern, features, indices in self._groups:
+            self._derived[features] = _evaluate(pattern, iter(frame[indices]))
+        model_input = np.empty(len(self.predictors))
+        model_input[self._raw_positions] = frame[self._raw_idx]
+        model_input[self._derived_positions] = self._derived[self._derived_idx]
+        # raw fury, from how fast the hands are moving, and how much the fingers have moved since the previous frame
+        fingers = self._derived[self._fingers_idx]
+        if self._previous_fingers is None:
+            self._previous_fingers = fingers
+        fur1 = np.max(np.abs(frame[self._velocity_idx])) / 1500
+        fur2 = np.max(np.abs(fingers - self._previous_fingers)) / 60
+        self._previous_fingers = fingers
+        self.raw_fury = max(min(fur1, 1), min(fur2, 1))
+        if self.standardizer is not None:
+            self.standardizer.apply(model_input, out=model_input)
+        return model_input
+
 
 def logistic_fn(x, k):
     return 1 / (1 + np.exp(-k * x))
@@ -95,6 +359,9 @@ def get_fury1(current_frame, previous_frame):
     fur2 -= 24
     return logistic_fn(fur1, 1/600), logistic_fn(fur2, 1/24)
 
+# vectors of both hands that get_fury2 uses: the palm velocity, and the fingertips for adjacent_finger_distances
+FURY_VECTORS = ['{hand}_palm_velocity'] + FEATURES['adjacent_finger_distances']['inputs']
+
 def get_fury2(current_frame, previous_frame):
     """calculates the speed of hand/interfinger movement, normalizes between 0 and 1 crudely but sensibly"""
     # get the max hand velocity in any direction
@@ -0,0 +1,672 @@
+import os
+import json
+import time
+import threading
+import collections
+import numpy as np
+from concurrent.futures import Future
+
+#### methods for running prediction models without tensorflow
+
+# The prediction models are small LSTMs (many2one_model and many2many in src/models.py), for which keras adds far
+# more time per prediction, and at startup, than the model itself takes. A NumpyModel runs the same forward pass with
+# numpy alone, from the weights of the model's .h5 file, or of a .npz exported from it, so that tensorflow is only
+# needed for training.
+
+# layers a NumpyModel can run, as named in keras model configs
+SUPPORTED_LAYERS = ['InputLayer', 'LSTM', 'Bidirectional', 'Dense', 'Dropout']
+
+
+def _sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def _softmax(x):
+    e = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    return e / np.sum(e, axis=-1, keepdims=True)
+
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'tanh': np.tanh,
+    'sigmoid': _sigmoid,
+    'relu': lambda x: np.maximum(x, 0),
+    'softmax': _softmax,
+}
+
+
+def _activation(name):
+    if name not in ACTIVATIONS:
+        raise ValueError(f'activation {name} is not supported, only {list(ACTIVATIONS)}')
+    return ACTIVATIONS[name]
+
+
+def lstm_step(z_x, h, c, recurrent_kernel, activation, recurrent_activation):
+    """one step of a keras LSTM, from its input already multiplied by the kernel (plus bias), returning the new h, c
+
+    Gates are in keras order: input, forget, cell, output.
+    """
+    z = z_x + h @ recurrent_kernel
+    i, f, g, o = np.split(z, 4, axis=-1)
+    c = recurrent_activation(f) * c + recurrent_activation(i) * activation(g)
+    h = recurrent_activation(o) * activation(c)
+    return h, c
+
+
+def lstm(x, kernel, recurrent_kernel, bias, config, reverse=False):
+    """runs a keras LSTM over sequences x of shape (batch, frames, features), from a zero state
+
+    Returns:
+    outputs -- (batch, frames, units) with return_sequences, in the order of x even if reversed, otherwise (batch, units)
+    """
+    activation = _activation(config.get('activation', 'tanh'))
+    recurrent_activation = _activation(config.get('recurrent_activation', 'sigmoid'))
+    reverse = reverse != config.get('go_backwards', False)
+    # the input's contribution to the gates, for every frame at once
+    z_x = x @ kernel + bias
+    h = np.zeros((x.shape[0], recurrent_kernel.shape[0]), dtype=x.dtype)
+    c = np.zeros_like(h)
+    frames = range(x.shape[1] - 1, -1, -1) if reverse else range(x.shape[1])
+    outputs = np.empty((x.shape[0], x.shape[1], h.shape[1]), dtype=x.dtype)
+    for t in frames:
+        h, c = lstm_step(z_x[:, t], h, c, recurrent_kernel, activation, recurrent_activation)
+        outputs[:, t] = h
+    return outputs if config.get('return_sequences', False) else h
+
+
+def _merge(forward, backward, mode):
+    if mode == 'concat':
+        return np.concatenate((forward, backward), axis=-1)
+    if mode == 'sum':
+        return forward + backward
+    if mode == 'mul':
+        return forward * backward
+    if mode == 'ave':
+        return (forward + backward) / 2
+    raise ValueError(f'merge mode {mode} is not supported')
+
+
+class NumpyModel:
+    """forward pass of a keras model made of a chain of LSTM, Bidirectional LSTM and Dense layers, in numpy alone
+
+    Use in place of the keras model for prediction: predict and input_shape work as they do for keras.
+
+    Arguments:
+    layers -- list of (class_name, config, weights) for each layer in order, as in the keras model config, weights
+        being a list of arrays in the order of keras' get_weights
+    input_shape -- tuple, the shape of the model's input, e.g. (None, 10, 50)
+    name -- str, name of the model
+    """
+    def __init__(self, layers, input_shape, name='model'):
+        for class_name, config, _ in layers:
+            if class_name not in SUPPORTED_LAYERS:
+                raise ValueError(f'{class_name} layers are not supported, only {SUPPORTED_LAYERS}')
+            if class_name == 'Bidirectional' and config['layer']['class_name'] != 'LSTM':
+                raise ValueError(f'only Bidirectional LSTM layers are supported, not {config["layer"]["class_name"]}')
+        self.layers = [(class_name, config, [np.asarray(w, dtype=np.float32) for w in weights])
+            for class_name, config, weights in layers if class_name not in ('InputLayer', 'Dropout')]
+        self.input_shape = tuple(input_shape)
+        self.name = name
+
+    @property
+    def unidirectional(self):
+        """whether the model only looks back in time, so can be run a frame at a time with step"""
+        return all(class_name != 'Bidirectional' for class_name, _, _ in self.layers) and \
+            any(class_name == 'LSTM' for class_name, _, _ in self.layers)
+
+    def predict(self, x, **kwargs):
+        """predictions for a batch of examples, an array of shape (batch, frames, features), as keras' predict"""
+        x = np.asarray(x, dtype=np.float32)
+        for class_name, config, weights in self.layers:
+            if class_name == 'LSTM':
+                x = lstm(x, *weights, config)
+            elif class_name == 'Bidirectional':
+                layer_config = config['layer']['config']
+                forward = lstm(x, *weights[:3], layer_config)
+                backward = lstm(x, *weights[3:], layer_config, reverse=True)
+                x = _merge(forward, backward, config.get('merge_mode', 'concat'))
+            elif class_name == 'Dense':
+                x = x @ weights[0]
+                if len(weights) > 1:
+                    x = x + weights[1]
+                x = _activation(config.get('activation', 'linear'))(x)
+        return x
+
+    def initial_states(self, batch_size=1):
+        """zero (h, c) states of each LSTM, for a batch of batch_size, as taken by step"""
+        return [np.zeros((batch_size, weights[1].shape[0]), dtype=np.float32)
+            for class_name, _, weights in self.layers if class_name == 'LSTM' for _ in ('h', 'c')]
+
+    def step(self, frame, states):
+        """advances a unidirectional model by a single frame, from the states after the previous frame
+
+        Arguments:
+        frame -- array of shape (features,)
+        states -- list of the h and c of each LSTM, from initial_states or the previous step. States of a batch of
+            several are each advanced by the same frame
+
+        Returns:
+        prediction, states -- array of the probability of each gesture (of shape (batch, gestures) for a batch of
+            several states), and the new states
+        """
+        if not self.unidirectional:
+            raise ValueError(f'{self.name} is bidirectional or has no LSTM, so it can\'t be run a frame at a time')
+        x = np.asarray(frame, dtype=np.float32).reshape(1, -1)
+        new_states = []
+        k = 0
+        for class_name, config, weights in self.layers:
+            if class_name == 'LSTM':
+                kernel, recurrent_kernel, bias = weights
+                h, c = lstm_step(x @ kernel + bias, states[k], states[k + 1], recurrent_kernel,
+                    _activation(config.get('activation', 'tanh')), _activation(config.get('recurrent_activation', 'sigmoid')))
+                new_states += [h, c]
+                k += 2
+                x = h
+            elif class_name == 'Dense':
+                x = x @ weights[0]
+                if len(weights) > 1:
+                    x = x + weights[1]
+                x = _activation(config.get('activation', 'linear'))(x)
+        return (x[0] if len(x) == 1 else x), new_states
+
+    @classmethod
+    def from_h5(cls, path):
+        """reads the config and weights of a model saved by keras as .h5, needing h5py but not tensorflow"""
+        import h5py
+        with h5py.File(path, 'r') as f:
+            model_config = f.attrs['model_config']
+            model_config = json.loads(model_config.decode() if isinstance(model_config, bytes) else model_config)
+            weights_group = f['model_weights']
+            layers = []
+            for layer in model_config['config']['layers']:
+                config = layer['config']
+                group = weights_group[config['name']] if config['name'] in weights_group else None
+                names = [n.decode() if isinstance(n, bytes) else n for n in group.attrs['weight_names']] if group else []
+                layers.append((layer['class_name'], config, [group[n][()] for n in names]))
+        input_config = model_config['config']['layers'][0]['config']
+        # keras 2 saves batch_input_shape, keras 3 batch_shape
+        input_shape = input_config.get('batch_input_shape', input_config.get('batch_shape'))
+        return cls(layers, input_shape, name=model_config['config'].get('name', 'model'))
+
+    @classmethod
+    def from_keras(cls, model):
+        """copies the config and weights of a keras model"""
+        layers = [(layer.__class__.__name__, _plain_config(layer), layer.get_weights()) for layer in model.layers]
+        return cls(layers, model.input_shape, name=model.name)
+
+    @classmethod
+    def load(cls, path):
+        """loads a model exported with save, which needs nothing but numpy"""
+        with np.load(path, allow_pickle=False) as npz:
+            meta = json.loads(str(npz['meta']))
+            layers = [(class_name, config, [npz[f'layer{i}_{k}'] for k in range(n_weights)])
+                for i, (class_name, config, n_weights) in enumerate(meta['layers'])]
+        return cls(layers, meta['input_shape'], name=meta['name'])
+
+    def save(self, path):
+        """saves the model as a .npz of its weights and the little of its config it needs"""
+        meta = {'name': self.name, 'input_shape': self.input_shape,
+            'layers': [(class_name, config, len(weights)) for class_name, config, weights in self.layers]}
+        arrays = {f'layer{i}_{k}': w for i, (_, _, weights) in enumerate(self.layers) for k, w in enumerate(weights)}
+        np.savez(path, meta=np.array(json.dumps(meta)), **arrays)
+        return path
+
+    def to_keras(self, batch_size=None, unroll=False):
+        """rebuilds the model in keras with the same weights, importing tensorflow
+
+        Arguments:
+        batch_size -- int, fixes the batch size of the model's input, None leaves it variable
+        unroll -- bool, whether to unroll the LSTMs, rather than loop over frames
+        """
+        import tensorflow as tf
+        layers = tf.keras.layers
+
+        def lstm_layer(config):
+            return layers.LSTM(config['units'], activation=config.get('activation', 'tanh'),
+                recurrent_activation=config.get('recurrent_activation', 'sigmoid'),
+                return_sequences=config.get('return_sequences', False), go_backwards=config.get('go_backwards', False),
+                unroll=unroll)
+
+        inputs = tf.keras.Input(batch_shape=(batch_size,) + tuple(self.input_shape[1:]))
+        x = inputs
+        for class_name, config, weights in self.layers:
+            if class_name == 'LSTM':
+                x = lstm_layer(config)(x)
+            elif class_name == 'Bidirectional':
+                x = layers.Bidirectional(lstm_layer(config['layer']['config']),
+                    merge_mode=config.get('merge_mode', 'concat'))(x)
+            elif class_name == 'Dense':
+                x = layers.Dense(weights[0].shape[1], activation=config.get('activation', 'linear'),
+                    use_bias=len(weights) > 1)(x)
+        model = tf.keras.Model(inputs, x)
+        model.set_weights([w for _, _, weights in self.layers for w in weights])
+        return model
+
+
+def can_stream(model):
+    """checks whether a model, a NumpyModel or keras model, only looks back in time, so can be run by a StreamingPredictor"""
+    if isinstance(model, NumpyModel):
+        return model.unidirectional
+    if isinstance(model, TFLiteModel):
+        # exported with a fixed window of frames, without its states
+        return False
+    from src.models import is_unidirectional
+    return is_unidirectional(model)
+
+
+class StreamingPredictor:
+    """predicts the gesture for each frame as it arrives, carrying the LSTM states from one frame to the next
+
+    Rather than re-running a whole window of frames for every prediction, each frame advances the model by one step.
+    The model was trained on windows of window_size frames, so rather than a single state covering every frame since
+    it started, window_size overlapping states are kept, one starting at each frame, and advanced together as a batch.
+    The oldest has seen exactly the last window_size frames, so its prediction is the one model.predict gives for
+    them, and it starts again from zero for the next frame. Until window_size frames have come, predictions are those
+    for a window of the frames so far. Everything is reset when frames stop coming, by their timestamps.
+
+    Arguments:
+    model -- trained unidirectional model, as from many2one_model(bidirectional=False) or many2many, either a
+        NumpyModel, or a keras model, which is run a frame at a time by a copy from streaming_model
+    max_gap -- float, seconds between consecutive frames after which the state is reset, None to never reset
+    window_size -- int, no. of frames each prediction covers, None for the model's window. A model taking windows
+        of any length (as many2many can) keeps a single state covering every frame since the last reset
+    """
+    def __init__(self, model, max_gap=0.5, window_size=None):
+        self.max_gap = max_gap
+        self.window_size = window_size or model.input_shape[-2]
+        if isinstance(model, NumpyModel):
+            if not model.unidirectional:
+                raise ValueError(f'{model.name} is bidirectional or has no LSTM, so it can\'t be run a frame at a time')
+
+            def numpy_step(frame, states):
+                prediction, states = model.step(frame, states)
+                return prediction.reshape(len(states[0]), -1), states
+
+            self._step = numpy_step
+            self._initial_states = model.initial_states
+        else:
+            import tensorflow as tf
+            from src.models import streaming_model
+            self.step_model = streaming_model(model)
+            step = tf.function(lambda inputs: self.step_model(inputs, training=False))
+            units = [layer.units for layer in model.layers if isinstance(layer, tf.keras.layers.LSTM)]
+
+            def keras_step(frame, states):
+                frames = np.broadcast_to(np.asarray(frame, dtype=np.float32).reshape(1, 1, -1),
+                    (len(states[0]), 1, len(frame)))
+                outputs = step([frames] + states)
+                return outputs[0].numpy()[:, -1], [np.array(state) for state in outputs[1:]]
+
+            self._step = keras_step
+            self._initial_states = lambda batch_size=1: [np.zeros((batch_size, u), dtype=np.float32)
+                for u in units for _ in ('h', 'c')]
+        self.reset()
+
+    def reset(self):
+        """forget every frame so far, the next frame starts from a zero state"""
+        self.states = self._initial_states(self.window_size or 1)
+        self.previous_timestamp = None
+        self.n_frames = 0
+
+    def update(self, frame, timestamp=None):
+        """advances the model by a frame, returning its prediction, an array of the probability of each gesture
+
+        Arguments:
+        frame -- array of shape (features,), standardized as for the model
+        timestamp -- leap timestamp of the frame, in microseconds. If it is more than max_gap after the previous frame's,
+            or before it, the state is reset first
+        """
+        if timestamp is not None and self.previous_timestamp is not None and self.max_gap is not None:
+            gap = (timestamp - self.previous_timestamp) / 1e6
+            if gap > self.max_gap or gap < 0:
+                self.reset()
+        self.previous_timestamp = timestamp
+        predictions, self.states = self._step(frame, self.states)
+        self.n_frames += 1
+        if not self.window_size:
+            return predictions[0]
+        # the state started window_size frames ago (or at the reset) has the prediction, and the next frame's state
+        # starts in its place. The states that haven't started yet are zeroed in turn just before they do
+        oldest = self.n_frames % self.window_size if self.n_frames >= self.window_size else 0
+        prediction = predictions[oldest].copy()
+        for state in self.states:
+            state[self.n_frames % self.window_size] = 0
+        return prediction
+
+
+class BatchScheduler:
+    """runs the windows of frames submitted by many streams (e.g. users or devices) through a model in batches
+
+    A model takes hardly longer to predict a batch of windows than a single one, so rather than each stream calling
+    predict for itself, streams submit their windows here, and a thread predicts everything that is waiting at once.
+    A batch is run as soon as max_batch_size windows are waiting, or when the first of them has waited max_delay,
+    so a prediction takes at most max_delay plus the time of one batch (and of any batch already running).
+
+    Arguments:
+    model -- model with predict, e.g. from load_prediction_model. A NumpyModel or keras model gains the most from
+        batching, a TFLiteModel runs a batch one window at a time
+    max_batch_size -- int, most windows to predict at once
+    max_delay -- float, seconds the first window of a batch may wait for others to join it
+    """
+    def __init__(self, model, max_batch_size=64, max_delay=0.005):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        # windows waiting to be predicted, as (window, future, time submitted)
+        self._pending = collections.deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self.reset_metrics()
+        self._thread = threading.Thread(target=self._run, name='BatchScheduler', daemon=True)
+        self._thread.start()
+
+    def submit(self, window):
+        """queues a window, an array of shape (frames, features), returning a Future of its prediction"""
+        return self._submit([window])[0]
+
+    def predict(self, windows, timeout=None):
+        """predicts the current window of each of several streams, in as few batches as possible
+
+        Arguments:
+        windows -- dict of stream: window, for any hashable stream id
+        timeout -- float, seconds to wait for the predictions, None to wait as long as it takes
+
+        Returns:
+        predictions -- dict of stream: array of the probability of each gesture
+        """
+        # queued all at once, so they're predicted in the same batch, if there are no more than max_batch_size
+        futures = dict(zip(windows, self._submit(list(windows.values()))))
+        return {stream: future.result(timeout) for stream, future in futures.items()}
+
+    def metrics(self):
+        """a dict of what the scheduler has done since it started, or since reset_metrics:
+
+        queue_depth -- no. of windows waiting now
+        max_queue_depth -- most windows there have been waiting at once
+        windows, batches -- no. of windows predicted, and of batches they were predicted in
+        mean_batch_size -- mean no. of windows per batch
+        batch_sizes -- dict of batch size: no. of batches of that size
+        mean_wait, max_wait -- seconds windows waited between being submitted and their batch starting
+        mean_batch_time -- mean seconds taken to predict a batch
+        """
+        with self._condition:
+            return {
+                'queue_depth': len(self._pending),
+                'max_queue_depth': self._max_queue_depth,
+                'windows': self._windows,
+                'batches': self._batches,
+                'mean_batch_size': self._windows / self._batches if self._batches else 0,
+                'batch_sizes': dict(sorted(self._batch_sizes.items())),
+                'mean_wait': self._total_wait / self._windows if self._windows else 0,
+                'max_wait': self._max_wait,
+                'mean_batch_time': self._total_batch_time / self._batches if self._batches else 0,
+            }
+
+    def reset_metrics(self):
+        with self._condition:
+            self._max_queue_depth = len(self._pending)
+            self._windows = 0
+            self._batches = 0
+            self._batch_sizes = collections.Counter()
+            self._total_wait = 0.0
+            self._max_wait = 0.0
+            self._total_batch_time = 0.0
+
+    def close(self):
+        """predicts any windows still waiting, then stops the scheduler's thread"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _submit(self, windows):
+        """queues windows together, returning a Future of the prediction of each"""
+        windows = [np.asarray(window, dtype=np.float32) for window in windows]
+        # a window of the wrong shape would fail the whole batch it was in
+        expected = tuple(self.model.input_shape[1:])
+        for window in windows:
+            if window.ndim != len(expected) or any(n is not None and n != m for n, m in zip(expected, window.shape)):
+                raise ValueError(f'windows must be of shape {expected}, not {window.shape}')
+        futures = [Future() for _ in windows]
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('the scheduler has been closed')
+            submitted = time.perf_counter()
+            self._pending.extend((window, future, submitted) for window, future in zip(windows, futures))
+            self._max_queue_depth = max(self._max_queue_depth, len(self._pending))
+            self._condition.notify()
+        return futures
+
+    def _next_batch(self):
+        """waits for a batch to be due, and takes it from the queue, returning an empty batch once closed"""
+        with self._condition:
+            while not self._pending and not self._closed:
+                self._condition.wait()
+            # wait for a full batch, or for the first window's deadline
+            deadline = self._pending[0][2] + self.max_delay if self._pending else 0
+            while len(self._pending) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return [self._pending.popleft() for _ in range(min(self.max_batch_size, len(self._pending)))]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            # windows cancelled while waiting are left out
+            batch = [(window, future, submitted) for window, future, submitted in batch
+                if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            start = time.perf_counter()
+            try:
+                predictions = self.model.predict(np.stack([window for window, _, _ in batch]), verbose=0)
+            except Exception as e:
+                # raised in each stream, when it asks for its prediction
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            end = time.perf_counter()
+            for (_, future, _), prediction in zip(batch, np.asarray(predictions)):
+                future.set_result(prediction)
+            with self._condition:
+                waits = [start - submitted for _, _, submitted in batch]
+                self._windows += len(batch)
+                self._batches += 1
+                self._batch_sizes[len(batch)] += 1
+                self._total_wait += sum(waits)
+                self._max_wait = max(self._max_wait, max(waits))
+                self._total_batch_time += end - start
+
+
+def _plain_config(layer):
+    """a keras layer's config, with what a NumpyModel uses in the same form as in a saved model config"""
+    config = layer.get_config()
+    if layer.__class__.__name__ == 'Bidirectional':
+        config = dict(config, layer={'class_name': layer.forward_layer.__class__.__name__,
+            'config': layer.forward_layer.get_config()})
+    # activations may be serialized as dicts, e.g. by keras 3
+    return json.loads(json.dumps(config, default=str))
+
+
+def export_model(h5_path, npz_path=None):
+    """exports a model saved as .h5 to a .npz that a NumpyModel can load with numpy alone
+
+    Arguments:
+    h5_path -- str, path of the .h5 file
+    npz_path -- str, path of the .npz to write, defaults to h5_path with .h5 replaced by .npz
+
+    Returns:
+    npz_path -- str
+    """
+    if npz_path is None:
+        npz_path = os.path.splitext(h5_path)[0] + '.npz'
+    NumpyModel.from_h5(h5_path).save(npz_path)
+    return npz_path
+
+
+#### TensorFlow Lite
+
+# For slower CPUs, a model can also be converted to TensorFlow Lite, by default quantized to int8, calibrated on the
+# examples of some recordings. Its input and output stay float32, so it's a drop in replacement for the other models.
+# LSTMs are unrolled and the batch size fixed to 1 for conversion, as quantizing keras' looping LSTMs fails.
+
+QUANTIZATIONS = ['int8', 'dynamic', 'float16', 'none']
+
+
+class TFLiteModel:
+    """runs a model exported by export_tflite, with the LiteRT interpreter (ai_edge_litert) or tflite_runtime if one of
+    them is installed, otherwise with tensorflow
+
+    Use in place of the keras model for prediction: predict and input_shape work as they do for keras.
+
+    Arguments:
+    path -- str, path of the .tflite file
+    """
+    def __init__(self, path):
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            try:
+                from tflite_runtime.interpreter import Interpreter
+            except ImportError:
+                import tensorflow as tf
+                Interpreter = tf.lite.Interpreter
+        self.interpreter = Interpreter(model_path=path)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self.input_shape = (None,) + tuple(int(n) for n in self._input['shape'][1:])
+        self.name = os.path.splitext(os.path.basename(path))[0]
+
+    def predict(self, x, **kwargs):
+        """predictions for a batch of examples, an array of shape (batch, frames, features), as keras' predict"""
+        x = np.asarray(x, dtype=np.float32)
+        outputs = np.empty((len(x),) + tuple(self._output['shape'][1:]), dtype=np.float32)
+        # the model is converted with a batch of one
+        for i in range(len(x)):
+            self.interpreter.set_tensor(self._input['index'], x[i:i + 1])
+            self.interpreter.invoke()
+            outputs[i] = self.interpreter.get_tensor(self._output['index'])[0]
+        return outputs
+
+
+def bundle_examples(files, path='models/prediction_model/', mirror=False, cache_dir='data/cache/'):
+    """examples from recordings, processed by CSV2examples as for the model in a model folder
+
+    Recordings are processed with the parameter files in params/, which must be the same as the model folder's.
+
+    Arguments:
+    files -- list of paths of recordings
+    path -- str, model folder
+    mirror -- bool, whether to include the mirror image of every example
+    cache_dir -- str, as for CSV2examples
+
+    Returns:
+    X, y -- arrays of examples and the index of each one's gesture, as in the model folder's gestures file
+    """
+    from src.cache import PARAM_FILES
+    from src.data_methods import CSV2examples, get_description, get_gestures
+    different = []
+    for name in PARAM_FILES:
+        if os.path.exists(os.path.join(path, name)):
+            with open(os.path.join(path, name), 'rb') as f, open(os.path.join('params', name), 'rb') as g:
+                if f.read() != g.read():
+                    different.append(name)
+    if different:
+        raise ValueError(f'{different} in {path} differ from those in params/, which recordings are processed with')
+    _, g2idx, _ = get_gestures(version='prediction', path=path)
+    description = get_description(path)
+    X, y = [], []
+    for raw_file in files:
+        X_file, y_file = CSV2examples(raw_file=raw_file, target_fps=int(description.get('fps', 5)), g2idx=g2idx,
+            n_frames=int(description.get('example length', 10)), mirror=mirror, cache_dir=cache_dir)
+        X.append(X_file)
+        y.append(y_file)
+    X, y = np.concatenate(X), np.concatenate(y)
+    if len(X) == 0:
+        raise ValueError(f'no examples of the gestures in {path} in {files}')
+    return X, y
+
+
+def export_tflite(path='models/prediction_model/', calibration_files=None, quantization='int8', tflite_path=None,
+        max_examples=500, seed=0, cache_dir='data/cache/'):
+    """converts the model in a model folder to TensorFlow Lite, importing tensorflow
+
+    Arguments:
+    path -- str, model folder, as for load_prediction_model
+    calibration_files -- list of paths of recordings to calibrate int8 quantization with, e.g. the model's training
+        recordings. Their examples are taken by bundle_examples
+    quantization -- str, one of QUANTIZATIONS: 'int8' quantizes weights and activations, calibrated on the examples,
+        'dynamic' quantizes weights only, 'float16' stores weights as float16, and 'none' keeps float32
+    tflite_path -- str, path of the .tflite to write, defaults to model.tflite in path
+    max_examples -- int, at most this many examples, chosen at random, are used for calibration
+    seed -- int, seed for choosing the examples
+    cache_dir -- str, as for CSV2examples
+
+    Returns:
+    tflite_path -- str
+    """
+    import tensorflow as tf
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f'unknown quantization {quantization}, use one of {QUANTIZATIONS}')
+    model = load_prediction_model(path, backend='numpy')
+    converter = tf.lite.TFLiteConverter.from_keras_model(model.to_keras(batch_size=1, unroll=True))
+    if quantization != 'none':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    if quantization == 'int8':
+        if not calibration_files:
+            raise ValueError('int8 quantization needs calibration_files')
+        X, _ = bundle_examples(calibration_files, path=path, cache_dir=cache_dir)
+        X = X[np.random.default_rng(seed).permutation(len(X))[:max_examples]].astype(np.float32)
+        converter.representative_dataset = lambda: ([X[i:i + 1]] for i in range(len(X)))
+    if tflite_path is None:
+        tflite_path = os.path.join(path, 'model.tflite')
+    with open(tflite_path, 'wb') as f:
+        f.write(converter.convert())
+    return tflite_path
+
+
+def load_prediction_model(path='models/prediction_model/', backend='numpy'):
+    """loads the model in a model folder, for prediction
+
+    Arguments:
+    path -- str, model folder, containing an .h5 file (and possibly a .npz or .tflite exported from it)
+    backend -- str, 'numpy' for a NumpyModel, from the .npz if it's up to date, otherwise from the .h5,
+        'tflite' for a TFLiteModel of the model.tflite written by export_tflite,
+        or 'keras' to load the .h5 with keras, which imports tensorflow
+
+    Returns:
+    model -- NumpyModel, TFLiteModel or keras model, with predict and input_shape
+    """
+    if backend == 'tflite':
+        tflite_path = os.path.join(path, 'model.tflite')
+        assert os.path.exists(tflite_path), f'No model.tflite in {path}, convert the model with export_tflite'
+        return TFLiteModel(tflite_path)
+    h5_files = sorted(file.path for file in os.scandir(path) if file.name.endswith('.h5'))
+    assert h5_files, f'No h5 file found in {path}'
+    h5_path = h5_files[0]
+    if backend == 'numpy':
+        npz_path = os.path.splitext(h5_path)[0] + '.npz'
+        if os.path.exists(npz_path) and os.path.getmtime(npz_path) >= os.path.getmtime(h5_path):
+            return NumpyModel.load(npz_path)
+        return NumpyModel.from_h5(h5_path)
+    if backend == 'keras':
+        import tensorflow as tf
+        try:
+            return tf.keras.models.load_model(h5_path, compile=False)
+        except (TypeError, ValueError):
+            # keras 3 can't load models saved by keras 2, which can be rebuilt from their weights instead
+            return NumpyModel.from_h5(h5_path).to_keras()
+    raise ValueError(f'unknown backend {backend}, use numpy, tflite or keras')
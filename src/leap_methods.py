@@ -1,83 +1,488 @@
 import config
 import websocket
 import json
+import threading
+import time
+from collections import deque
+import numpy as np
+from src.resampling import FrameResampler
 
 FINGERS = ["thumb", "index", "middle", "ring", "pinky"]
+HANDS = ["left", "right"]
 
-def collect_frame(frames_total, n, websocket_cache):
-    """Collects and unpacks a frame from a leap motion device
+def connect_device(i, device, timeout=None):
+    """opens a websocket connection to a leap motion device, and sends it the tracking mode
 
     Arguments:
-    frames_total -- total number of frames collected so far
-    n -- collect every nth frame, if frames_total % n == 0 then the frame will not be unpacked, and None will be returned
-    websocket_cache -- dictionary of websocket connections, which may be updated in place with new connections
+    i -- int, index of the device in config.devices
+    device -- dict, containing the device's "url" and "mode"
+    timeout -- float, seconds to wait on connecting and on each recv before giving up. None blocks forever
 
     Returns:
-    packed_frame -- empty dictionary if frames_total % n == 0, else a dictionary containing variable name / value pairs
+    ws -- websocket connection, with the version handshake already received
+    """
+    ws = websocket.create_connection(device["url"], timeout=timeout)
+    if device["mode"] == "desktop":
+        ws.send(json.dumps({"optimizeHMD": False}))
+    else:
+        ws.send(json.dumps({"optimizeHMD": True}))
+    version = ws.recv()
+    print(i, version)
+    return ws
 
+def pack_frame(frame, i, device):
+    """flattens a parsed leap frame into a dictionary of variable name / value pairs
 
-    Notes:
-    This function assumes that a frame is being collected for only one device!
+    Arguments:
+    frame -- dict, a frame parsed from the json sent by a leap motion device
+    i -- int, index of the device in config.devices
+    device -- dict, containing the device's "url" and "mode"
+
+    Returns:
+    packed_frame -- dict, e.g. {'right_palmPosition_0': ..., 'left_index_tipPosition_2': ..., ...}
     """
+    packed_frame = dict([(k,v) for k,v in frame.items() if type(v) in [int, float]])
+    packed_frame["device_index"] = i
+    packed_frame["device_mode"] = 0 if device["mode"] == "desktop" else 1
 
-    packed_frame = {}
-    for i, device in enumerate(config.devices):
-        if i not in websocket_cache:
-            ws = websocket.create_connection(device["url"])
-            if device["mode"] == "desktop":
-                ws.send(json.dumps({"optimizeHMD": False}))
+    for hand in frame["hands"]:
+        left_or_right = hand["type"]
+        for key, value in hand.items():
+            if key == "type":
+                continue
+            if key == "armBasis":
+                #flatten
+                value = [item for sublist in value for item in sublist]
+            if type(value) is list:
+                for j, v in enumerate(value):
+                    packed_frame["_".join((left_or_right, key, str(j)))] = v
+            else:
+                packed_frame["_".join((left_or_right, key))] = value
+    for finger in frame["pointables"]:
+        if finger["handId"] == packed_frame.get("left_id"):
+            left_or_right = "left"
+        elif finger["handId"] == packed_frame.get("right_id"):
+            left_or_right = "right"
+        finger_name = FINGERS[finger["type"]]
+        for key, value in finger.items():
+            if key == "type":
+                continue
+            if key == "bases":
+                #flatten
+                value = [item for sublist in value for subsublist in sublist for item in subsublist]
+            if key == "extended":
+                value = int(value)
+            if type(value) is list:
+                for j, v in enumerate(value):
+                    packed_frame["_".join((left_or_right, finger_name, key, str(j)))] = v
             else:
-                ws.send(json.dumps({"optimizeHMD": True}))
-            version = ws.recv()
-            print(i, version)
-            websocket_cache[i] = ws
-        if frames_total % n != 0:
-            # collect the frame, but don't unpack it
-            resp = websocket_cache[i].recv()
+                packed_frame["_".join((left_or_right, finger_name, key))] = value
+    return packed_frame
+
+def unpack_frame(packed_frame):
+    """rebuilds a leap frame, as parsed from the json sent by a device, from a packed frame
+
+    The inverse of pack_frame, e.g. for replaying a recording. Values that are missing or nan are left out (within
+    a vector, they are None), as are columns added while recording, such as gesture and device_index.
+    """
+    frame = {"hands": [], "pointables": []}
+    hands = {}
+    fingers = {}
+    for column, value in packed_frame.items():
+        if value != value:
+            # nan, e.g. a hand missing from this row of a recording
+            continue
+        hand, finger, key, index = parse_column(column)
+        if hand is None:
+            if column not in ('gesture', 'device_index', 'device_mode', 'aligned_timestamp'):
+                frame[key] = int(value) if key in ('id', 'timestamp') else value
+            continue
+        if finger is None:
+            target = hands.setdefault(hand, {"type": hand})
         else:
-            # collect and unpack
-            resp = websocket_cache[i].recv()
-            if "event" in resp:
-                # connect / disconnect
-                print(i, resp)
+            target = fingers.setdefault((hand, finger), {"type": finger})
+        if key in ('id', 'handId'):
+            value = int(value)
+        elif key in ('extended', 'tool'):
+            value = bool(value)
+        path = _index_path(key, index)
+        if not path:
+            target[key] = value
+            continue
+        # build up nested lists, matching the shapes flattened by pack_frame
+        if key not in target:
+            target[key] = {}
+        nested = target[key]
+        for p in path[:-1]:
+            nested = nested.setdefault(p, {})
+        nested[path[-1]] = value
+    def to_lists(value):
+        if type(value) is dict:
+            # values missing from a vector are None, so the others keep their positions
+            return [to_lists(value.get(k)) for k in range(max(value) + 1)]
+        return value
+    for hand in HANDS:
+        if hand in hands:
+            frame["hands"].append({k: to_lists(v) for k, v in hands[hand].items()})
+    for (hand, finger), pointable in sorted(fingers.items()):
+        if hand in hands:
+            frame["pointables"].append({k: to_lists(v) for k, v in pointable.items()})
+    return frame
+
+
+def peek_timestamp(resp):
+    """reads the timestamp of a frame from its json, without parsing the rest of it. None if it has no timestamp,
+    or the json ends before the timestamp does"""
+    start = resp.find('"timestamp":')
+    if start == -1:
+        return None
+    start += len('"timestamp":')
+    end = start
+    while end < len(resp) and resp[end] not in ',}':
+        end += 1
+    if end == len(resp):
+        return None
+    return int(resp[start:end])
+
+
+def parse_column(column):
+    """splits a packed frame column name into (hand, finger type, key, index)
+
+    e.g. 'right_index_tipPosition_2' -> ('right', 1, 'tipPosition', 2), 'currentFrameRate' -> (None, None, 'currentFrameRate', None)
+    hand, finger type and index are None when the column doesn't have them
+    """
+    parts = column.split('_')
+    if parts[0] not in HANDS:
+        return None, None, column, None
+    hand, parts = parts[0], parts[1:]
+    finger = None
+    if parts[0] in FINGERS:
+        finger, parts = FINGERS.index(parts[0]), parts[1:]
+    key = parts[0]
+    index = int(parts[1]) if len(parts) > 1 else None
+    return hand, finger, key, index
+
+
+def _index_path(key, index):
+    """path into a (possibly nested) leap value, matching the flattening done by pack_frame"""
+    if index is None:
+        return ()
+    if key == 'armBasis':
+        # 3 x 3
+        return (index // 3, index % 3)
+    if key == 'bases':
+        # 4 bones x 3 x 3
+        return (index // 9, (index // 3) % 3, index % 3)
+    return (index,)
+
+
+class FrameDecoder:
+    """decodes leap motion frames straight into a preallocated numpy vector, for a fixed list of columns
+
+    The list of columns is compiled once into a plan, so that decoding a frame only touches the values that are needed.
+    Column names are the same as those produced by pack_frame, e.g. 'left_palmPosition_0' or 'right_index_tipPosition_2'.
+    Columns of hands that aren't in a frame, and of fields missing from it, are nan.
+    """
+    def __init__(self, columns, hands=HANDS):
+        self.columns = list(columns)
+        self.hands = list(hands)
+        # reusable output vector, columns for hands that are not present are nan
+        self.values = np.full(len(self.columns), np.nan)
+        # whether or not each of self.hands was present in the last decoded frame
+        self.hands_present = np.zeros(len(self.hands), dtype=bool)
+        # plans, each a list of (key, index path, output index)
+        self._frame_plan = []
+        self._hand_plans = {hand: [] for hand in self.hands}
+        self._finger_plans = {}
+        for out, column in enumerate(self.columns):
+            hand, finger, key, index = parse_column(column)
+            step = (key, _index_path(key, index), out)
+            if hand is None:
+                self._frame_plan.append(step)
+            elif hand not in self._hand_plans:
+                raise ValueError(f'column {column} is for a hand not in {self.hands}')
+            elif finger is None:
+                self._hand_plans[hand].append(step)
             else:
-                frame = json.loads(resp)
-                if frame["hands"]:
-                    packed_frame = dict([(k,v) for k,v in frame.items() if type(v) in [int, float]])
-                    packed_frame["device_index"] = i
-                    packed_frame["device_mode"] = 0 if device["mode"] == "desktop" else 1
-                    packed_frame["currentFrameRate"] /= n #adjust frame rate by the number we're actually capturing at the moment 
-
-                    for hand in frame["hands"]:
-                        left_or_right = hand["type"]
-                        for key, value in hand.items():
-                            if key == "type":
-                                continue
-                            if key == "armBasis":
-                                #flatten
-                                value = [item for sublist in value for item in sublist]
-                            if type(value) is list:
-                                for j, v in enumerate(value):
-                                    packed_frame["_".join((left_or_right, key, str(j)))] = v
-                            else:
-                                packed_frame["_".join((left_or_right, key))] = value
-                    for finger in frame["pointables"]:
-                        if finger["handId"] == packed_frame.get("left_id"):
-                            left_or_right = "left"
-                        elif finger["handId"] == packed_frame.get("right_id"):
-                            left_or_right = "right"
-                        finger_name = FINGERS[finger["type"]]
-                        for key, value in finger.items():
-                            if key == "type":
-                                continue
-                            if key == "bases":
-                                #flatten
-                                value = [item for sublist in value for subsublist in sublist for item in subsublist]
-                            if key == "extended":
-                                value = int(value)
-                            if type(value) is list:
-                                for j, v in enumerate(value):
-                                    packed_frame["_".join((left_or_right, finger_name, key, str(j)))] = v
-                            else:
-                                packed_frame["_".join((left_or_right, finger_name, key))] = value
-    return packed_frame
\ No newline at end of file
+                self._finger_plans.setdefault((hand, finger), []).append(step)
+
+    def decode(self, frame):
+        """decodes a parsed leap frame into self.values, returning the number of hands found"""
+        values = self.values
+        values.fill(np.nan)
+        self.hands_present.fill(False)
+        # fields missing from the frame, or None, or beyond the end of a vector, e.g. in a frame replayed from a damaged
+        # recording, or one made with another version of the leap software, are left as nan
+        for key, path, out in self._frame_plan:
+            value = frame.get(key)
+            try:
+                for p in path:
+                    value = value[p]
+            except (TypeError, IndexError):
+                continue
+            if value is not None:
+                values[out] = value
+        if not frame["hands"]:
+            return 0
+        # pointables reference their hand by id
+        hand_types = {}
+        n_hands = 0
+        for hand in frame["hands"]:
+            hand_type = hand["type"]
+            if hand_type not in self._hand_plans:
+                continue
+            n_hands += 1
+            # without an id, the hand's fingers can't be found, and are left as nan
+            if "id" in hand:
+                hand_types[hand["id"]] = hand_type
+            self.hands_present[self.hands.index(hand_type)] = True
+            for key, path, out in self._hand_plans[hand_type]:
+                value = hand.get(key)
+                try:
+                    for p in path:
+                        value = value[p]
+                except (TypeError, IndexError):
+                    continue
+                if value is not None:
+                    values[out] = value
+        if self._finger_plans:
+            for finger in frame["pointables"]:
+                plan = self._finger_plans.get((hand_types.get(finger.get("handId")), finger["type"]))
+                if plan is None:
+                    continue
+                for key, path, out in plan:
+                    value = finger.get(key)
+                    try:
+                        for p in path:
+                            value = value[p]
+                    except (TypeError, IndexError):
+                        continue
+                    if value is not None:
+                        values[out] = value
+        return n_hands
+
+    def unpack(self, frame):
+        """decodes a parsed leap frame, returning copies of (values, hands_present), or None if it contains no hands"""
+        if self.decode(frame) == 0:
+            return None
+        return self.values.copy(), self.hands_present.copy()
+
+
+class LeapReader:
+    """reads frames from a leap motion device on a background thread, so that receiving never waits on the consumer
+
+    Unpacked frames are kept in a bounded ring. If the consumer falls behind, the oldest frames are dropped,
+    so that it never sees frames more than maxlen old. The number of frames dropped is kept in self.dropped.
+
+    Arguments:
+    websocket_cache -- dictionary of websocket connections, owned by the reader once started
+    i -- int, index of the device in config.devices to read from
+    unpack -- callable taking a parsed frame, returning the item to store, or None to skip the frame.
+        Defaults to pack_frame
+    target_fps -- float, frame rate to unpack frames at, using their timestamps (see FrameResampler).
+        Other frames are received but never parsed. None unpacks every frame
+    maxlen -- int, number of unpacked frames to keep
+    timeout -- float, seconds to wait when connecting, or for a frame, before checking the connection
+    reconnect_delay -- float, seconds to wait before trying to reconnect after a failed connection
+    condition -- threading.Condition to notify when a frame is stored, so several readers can be waited on together
+
+    Notes:
+    Items are returned as (frames_total, item), where frames_total counts all frames received from the device,
+    skipped or not.
+    """
+    def __init__(self, websocket_cache, i=0, unpack=None, target_fps=None, maxlen=4, timeout=1.0, reconnect_delay=1.0, condition=None):
+        self.websocket_cache = websocket_cache
+        self.i = i
+        self.device = config.devices[i]
+        if unpack is None:
+            unpack = self._pack_frame
+        self.unpack = unpack
+        self.resampler = FrameResampler(target_fps)
+        self.timeout = timeout
+        self.reconnect_delay = reconnect_delay
+        self.frames = deque(maxlen=maxlen)
+        # no. of frames received from the device
+        self.frames_total = 0
+        # no. of unpacked frames overwritten before the consumer got to them
+        self.dropped = 0
+        self.connected = threading.Event()
+        self._condition = condition if condition is not None else threading.Condition()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'LeapReader-{i}', daemon=True)
+
+    def start(self):
+        """start reading in the background, returns self"""
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """stop reading, and close the connection"""
+        self._stop.set()
+        self._thread.join()
+        self._disconnect()
+
+    def get(self, timeout=None):
+        """returns the oldest (frames_total, item) in the ring, waiting up to timeout seconds. None if there is none"""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.frames, timeout):
+                return None
+            return self.frames.popleft()
+
+    def get_latest(self, timeout=None):
+        """returns the newest (frames_total, item) in the ring, discarding any older ones. None if there is none"""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.frames, timeout):
+                return None
+            self.dropped += len(self.frames) - 1
+            latest = self.frames.pop()
+            self.frames.clear()
+            return latest
+
+    def _disconnect(self):
+        ws = self.websocket_cache.pop(self.i, None)
+        self.connected.clear()
+        if ws is not None:
+            ws.close()
+
+    def _put(self, item):
+        with self._condition:
+            if len(self.frames) == self.frames.maxlen:
+                self.dropped += 1
+            self.frames.append((self.frames_total, item))
+            self._condition.notify_all()
+
+    def _pack_frame(self, frame):
+        if not frame["hands"]:
+            return None
+        packed_frame = pack_frame(frame, self.i, self.device)
+        if self.resampler.target_fps is not None:
+            #adjust frame rate to the rate we're actually capturing at the moment
+            packed_frame["currentFrameRate"] = min(packed_frame["currentFrameRate"], self.resampler.target_fps)
+        return packed_frame
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.i not in self.websocket_cache:
+                try:
+                    self.websocket_cache[self.i] = connect_device(self.i, self.device, timeout=self.timeout)
+                except (websocket.WebSocketException, OSError) as e:
+                    print(self.i, 'could not connect:', e)
+                    self._stop.wait(self.reconnect_delay)
+                    continue
+                self.connected.set()
+            try:
+                resp = self.websocket_cache[self.i].recv()
+            except websocket.WebSocketTimeoutException:
+                continue
+            except (websocket.WebSocketException, OSError) as e:
+                print(self.i, 'connection lost:', e)
+                self._disconnect()
+                continue
+            self.frames_total += 1
+            timestamp = peek_timestamp(resp)
+            if timestamp is None:
+                # connect / disconnect
+                print(self.i, resp)
+                continue
+            if not self.resampler.accept(timestamp):
+                # received, but don't unpack
+                continue
+            item = self.unpack(json.loads(resp))
+            if item is not None:
+                self._put(item)
+
+
+class FrameMerger:
+    """captures frames from several leap motion devices at once, merging them in order of their timestamps
+
+    There is one LeapReader per device, so that each device is read at its own frame rate.
+    Frames from different devices whose timestamps lie within tolerance of one another are returned together as a group,
+    each frame keeping its device_index, and gaining an 'aligned_timestamp' shared by the group.
+    Frames with no match on another device are returned in a group of their own, rather than being dropped.
+
+    Arguments:
+    websocket_cache -- dictionary of websocket connections, owned by the readers once started
+    devices -- list of indices into config.devices to capture from, defaults to all of them
+    tolerance -- int, microseconds within which frames from different devices are considered simultaneous
+    max_wait -- float, seconds to wait for a device that has stopped sending frames before merging without it
+    reader_kwargs -- passed on to each LeapReader, e.g. target_fps or maxlen
+
+    Notes:
+    Leap timestamps are in microseconds, but each device counts from its own origin.
+    Before comparing them, each device's timestamps are shifted onto the clock of this computer, using the
+    smallest difference seen between the time a frame was taken off the reader and the frame's timestamp.
+    """
+    def __init__(self, websocket_cache, devices=None, tolerance=10000, max_wait=0.1, **reader_kwargs):
+        if devices is None:
+            devices = range(len(config.devices))
+        self.tolerance = tolerance
+        self.max_wait = max_wait
+        self._condition = threading.Condition()
+        self.readers = [LeapReader(websocket_cache, i=i, condition=self._condition, **reader_kwargs) for i in devices]
+        # per device: frames waiting to be merged, as (aligned timestamp, packed frame)
+        self._pending = [deque() for _ in self.readers]
+        # per device: offset from the device's timestamps to this computer's clock, in microseconds
+        self._offsets = [None for _ in self.readers]
+
+    @property
+    def dropped(self):
+        """total no. of frames dropped by the readers"""
+        return sum(reader.dropped for reader in self.readers)
+
+    def start(self):
+        """start all readers, returns self"""
+        for reader in self.readers:
+            reader.start()
+        return self
+
+    def stop(self):
+        """stop all readers, closing their connections"""
+        for reader in self.readers:
+            reader.stop()
+
+    def get(self, timeout=None):
+        """returns the next group of merged frames, a list of packed frames, waiting up to timeout seconds. None if there is none"""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            self._collect()
+            group = self._next_group()
+            if group is not None:
+                return group
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                return None
+            with self._condition:
+                # wake when any reader stores a frame, or when a stalled device should be given up on
+                self._condition.wait_for(lambda: any(reader.frames for reader in self.readers),
+                    self.max_wait if remaining is None else min(remaining, self.max_wait))
+
+    def _collect(self):
+        """move frames from the readers' rings to the pending queues, aligning their timestamps"""
+        for d, reader in enumerate(self.readers):
+            while True:
+                received = reader.get(timeout=0)
+                if received is None:
+                    break
+                packed_frame = received[1]
+                offset = time.time() * 1e6 - packed_frame["timestamp"]
+                if self._offsets[d] is None or offset < self._offsets[d]:
+                    self._offsets[d] = offset
+                self._pending[d].append((packed_frame["timestamp"] + self._offsets[d], packed_frame))
+
+    def _next_group(self):
+        """take the earliest group of frames within tolerance of each other, if it is ready"""
+        heads = [pending[0][0] for pending in self._pending if pending]
+        if not heads:
+            return None
+        t0 = min(heads)
+        # every device must have a frame pending, so that we know whether it has one within tolerance of t0
+        # unless the frame at t0 has waited long enough
+        if len(heads) < len(self._pending) and time.time() * 1e6 - t0 < self.tolerance + self.max_wait * 1e6:
+            return None
+        group = []
+        for pending in self._pending:
+            if pending and pending[0][0] <= t0 + self.tolerance:
+                packed_frame = pending.popleft()[1]
+                packed_frame["aligned_timestamp"] = int(t0)
+                group.append(packed_frame)
+        return group
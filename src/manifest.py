@@ -0,0 +1,230 @@
+import os
+import io
+import json
+import math
+import contextlib
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from src.recording import is_archive, archive_columns, read_archive, list_recordings
+from src.data_methods import CSV2VoI, df2X_y, get_window_starts, Standardizer
+
+#### methods for indexing a folder of recordings, and sampling examples from it without reading all of it
+
+# A manifest is a json file in a folder of recordings, by default manifest.json, holding for each recording:
+# signature -- size and modification time of the recording, to tell whether the entry is up to date
+# frames -- no. of frames (rows) in the recording
+# fps -- average frame rate of the recording
+# hands -- fraction of frames containing data for each hand
+# runs -- list of [start, stop, gesture], the rows of each run of the same gesture, stop being non inclusive
+
+MANIFEST_NAME = 'manifest.json'
+
+def _signature(path):
+    """size and latest modification time of a recording, either a file or an archive folder"""
+    if os.path.isdir(path):
+        stats = [os.stat(os.path.join(path, f)) for f in os.listdir(path)]
+    else:
+        stats = [os.stat(path)]
+    return [sum(s.st_size for s in stats), max(s.st_mtime_ns for s in stats)]
+
+
+def summarize_recording(raw_file, chunksize=50000):
+    """reads just the columns of a recording needed for its manifest entry, a chunk at a time, returning the entry"""
+    raw_file = os.fspath(raw_file)
+    if is_archive(raw_file):
+        columns = archive_columns(raw_file)
+    else:
+        with open(raw_file, 'r') as f:
+            columns = list(pd.read_csv(f, nrows=0).columns)
+    # a hand is present in a frame if its columns have values, so one column per hand is enough
+    hand_columns = {}
+    for hand in ('left', 'right'):
+        hand_columns[hand] = next((c for c in columns if c.startswith(hand + '_')), None)
+    usecols = [c for c in ['gesture', 'currentFrameRate'] + list(hand_columns.values()) if c in columns]
+    if is_archive(raw_file):
+        chunks = [read_archive(raw_file, columns=usecols)]
+    else:
+        chunks = pd.read_csv(raw_file, usecols=usecols, dtype={'gesture': str}, chunksize=chunksize)
+    n_frames, fps_sum, fps_count = 0, 0.0, 0
+    hand_frames = {hand: 0 for hand in hand_columns}
+    runs = []
+    for chunk in chunks:
+        gestures = chunk['gesture'].fillna('nan').to_numpy() if 'gesture' in chunk.columns else np.full(len(chunk), 'nan')
+        # start and end of each run within the chunk, joining the first run on to the last run of the previous chunk
+        changes = np.flatnonzero(gestures[1:] != gestures[:-1]) + 1
+        for start, stop in zip(np.concatenate(([0], changes)), np.concatenate((changes, [len(chunk)]))):
+            if runs and start == 0 and runs[-1][2] == gestures[0]:
+                runs[-1][1] = n_frames + int(stop)
+            else:
+                runs.append([n_frames + int(start), n_frames + int(stop), str(gestures[start])])
+        if 'currentFrameRate' in chunk.columns:
+            fps_sum += float(chunk['currentFrameRate'].sum())
+            fps_count += int(chunk['currentFrameRate'].count())
+        for hand, col in hand_columns.items():
+            if col is not None:
+                hand_frames[hand] += int(chunk[col].notna().sum())
+        n_frames += len(chunk)
+    return {
+        'frames': n_frames,
+        'fps': fps_sum / fps_count if fps_count else None,
+        'hands': {hand: count / n_frames if n_frames else 0 for hand, count in hand_frames.items()},
+        'runs': runs,
+    }
+
+
+def update_manifest(folder='data/loops/', manifest_name=MANIFEST_NAME):
+    """creates or updates the manifest of a folder of recordings, returning it as a dict of file name: entry
+
+    Only recordings that are new or have changed since the manifest was last updated are read.
+    """
+    path = os.path.join(folder, manifest_name)
+    manifest = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            manifest = json.load(f)
+    updated = {}
+    for raw_file in sorted(list_recordings(folder)):
+        name = os.path.basename(raw_file)
+        signature = _signature(raw_file)
+        entry = manifest.get(name)
+        if entry is None or entry['signature'] != signature:
+            print(f'indexing {name}')
+            entry = summarize_recording(raw_file)
+            entry['signature'] = signature
+        updated[name] = entry
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(updated, f)
+    os.replace(tmp_path, path)
+    return updated
+
+
+def gesture_counts(manifest, n_frames=None, target_fps=None, stride=None):
+    """counts frames of each gesture in a manifest, or if n_frames is given, the approximate no. of examples of each
+    gesture that X_y2examples would take, after resampling to target_fps
+    """
+    counts = {}
+    for entry in manifest.values():
+        # fraction of frames kept by resampling
+        keep = 1 if target_fps is None or not entry['fps'] else min(target_fps / entry['fps'], 1)
+        for start, stop, gesture in entry['runs']:
+            if n_frames is None:
+                count = stop - start
+            else:
+                length = int((stop - start) * keep)
+                count = (length - n_frames) // (stride or n_frames // 2) + 1 if length >= n_frames else 0
+            counts[gesture] = counts.get(gesture, 0) + count
+    return counts
+
+
+class BalancedSampler:
+    """draws examples with each gesture equally likely, reading only the rows of each recording that an example needs
+
+    The runs of each gesture are found from the folders' manifests. To draw an example, a gesture is chosen
+    uniformly, then a position within one of its runs (every position of every run being equally likely), and just
+    the block of rows around it is read and processed, as by CSV2VoI and df2X_y. Rare gestures can so be trained on as
+    much as common ones, without reading the frames of the common ones. Processed blocks are kept, up to cache_bytes of
+    them, so the rows of later examples drawn from the same block are not read and processed again.
+
+    Arguments:
+    folders -- list of folders of recordings, their manifests are updated if needed
+    g2idx -- dict mapping gesture names to integers, gestures not in it are never drawn
+    n_frames -- int, length of each example
+    target_fps -- int, frame rate of examples
+    hands, standardize, derive_features -- as for df2X_y
+    lead -- int, no. of rows read before each block, so that a hand missing at the start can be filled in
+    seed -- int, seed for drawing examples
+    block_rows -- int, no. of rows of a run that examples are drawn from each block of
+    cache_bytes -- int, size of the processed blocks kept, the least recently used are dropped beyond it
+    """
+    def __init__(self, folders=['data/loops/'], g2idx={'no_gesture': 0, 'so_so': 1}, n_frames=25, target_fps=30,
+            hands=['left', 'right'], standardize=True, derive_features=True, lead=10, seed=None, block_rows=2000,
+            cache_bytes=256 * 1024**2):
+        self.g2idx = g2idx
+        self.n_frames = n_frames
+        self.target_fps = target_fps
+        self.hands = hands
+        self.derive_features = derive_features
+        self.lead = lead
+        self.block_rows = block_rows
+        self.cache_bytes = cache_bytes
+        # processed blocks, as (file, run start, block): (X, starts of each window of n_frames, labels of each window)
+        self._blocks = OrderedDict()
+        self._cached_bytes = 0
+        self.standardizer = Standardizer() if standardize else None
+        self.rng = np.random.default_rng(seed)
+        # for each gesture, the runs long enough for an example, as (file, start, stop, rows needed for an example)
+        self.runs = {g: [] for g in g2idx}
+        for folder in folders:
+            for name, entry in update_manifest(folder).items():
+                if not all(entry['hands'].get(hand, 0) > 0 for hand in hands):
+                    continue
+                # rows needed for n_frames at target_fps, with a few to spare for jitter in the frame rate
+                rows = math.ceil(n_frames * max((entry['fps'] or target_fps) / target_fps, 1) * 1.1) + 1
+                for start, stop, gesture in entry['runs']:
+                    if gesture in g2idx and stop - start >= rows:
+                        self.runs[gesture].append((os.path.join(folder, name), start, stop, rows))
+        self.gestures = [g for g in g2idx if self.runs[g]]
+        assert self.gestures, 'no runs of any gesture are long enough for an example'
+        missing = [g for g in g2idx if not self.runs[g]]
+        if missing:
+            print(f'WARNING: no runs long enough for an example of {missing}')
+
+    def _block(self, raw_file, start, stop, rows, block):
+        """X, and the start and label of every window of n_frames in it, for a block of the rows of a run
+
+        Block k has the rows an example starting in the k-th block_rows rows of the run needs, read and processed the
+        first time it is asked for, and kept until it is the least recently used of more than cache_bytes of blocks.
+        """
+        key = (raw_file, start, block)
+        if key in self._blocks:
+            self._blocks.move_to_end(key)
+            return self._blocks[key]
+        first = start + block * self.block_rows
+        # the pipeline reports on everything it reads, which is just noise for a few rows
+        with contextlib.redirect_stdout(io.StringIO()):
+            df = CSV2VoI(raw_file=raw_file, target_fps=self.target_fps,
+                rows=(max(first - self.lead, 0), min(first + self.block_rows + rows, stop)),
+                derive_features=self.derive_features)
+            if all(len(df.filter(regex=hand).columns) > 0 for hand in self.hands):
+                X, y = df2X_y(df, self.g2idx, hands=self.hands, standardize=self.standardizer is not None,
+                    derive_features=self.derive_features, standardizer=self.standardizer)
+            else:
+                X, y = np.empty((0, 0)), np.empty(0, dtype=int)
+        # windows entirely within a gesture, frames at the start may have been lost to a missing hand
+        starts, labels = get_window_starts(y, n_frames=self.n_frames, stride=1)
+        self._blocks[key] = (X, starts, labels)
+        self._cached_bytes += X.nbytes + starts.nbytes + labels.nbytes
+        while self._cached_bytes > self.cache_bytes and len(self._blocks) > 1:
+            X, starts, labels = self._blocks.popitem(last=False)[1]
+            self._cached_bytes -= X.nbytes + starts.nbytes + labels.nbytes
+        return self._blocks[key]
+
+    def draw(self, gesture, attempts=10):
+        """draws a single example of gesture, returning X of shape (n_frames, features)"""
+        runs = self.runs[gesture]
+        # weight runs by the no. of positions an example could start at
+        weights = np.array([stop - start - rows + 1 for _, start, stop, rows in runs], dtype=float)
+        for _ in range(attempts):
+            raw_file, start, stop, rows = runs[self.rng.choice(len(runs), p=weights / weights.sum())]
+            first = int(self.rng.integers(start, stop - rows + 1))
+            X, starts, labels = self._block(raw_file, start, stop, rows, (first - start) // self.block_rows)
+            starts = starts[labels == self.g2idx[gesture]]
+            if len(starts) > 0:
+                # any window of the block, each being as likely as any other
+                window = starts[self.rng.integers(len(starts))]
+                return X[window:window + self.n_frames]
+        raise RuntimeError(f'could not read an example of {gesture} in {attempts} attempts')
+
+    def sample(self, batch_size=50):
+        """draws a batch of examples, with gestures chosen uniformly, returning X, y as from X_y2examples"""
+        gestures = self.rng.choice(self.gestures, size=batch_size)
+        X = np.stack([self.draw(g) for g in gestures])
+        y = np.array([self.g2idx[g] for g in gestures])
+        return X, y
+
+    def batches(self, batch_size=50):
+        """generator of batches for model.fit, which needs steps_per_epoch as the generator never ends"""
+        while True:
+            yield self.sample(batch_size)
@@ -75,7 +75,50 @@ def many2one_model(n_gestures=2, n_frames=35, n_features=21, rnn_units=4, bidire
 
     return model
 
-    
+
+#### streaming prediction, a frame at a time
+
+def is_unidirectional(model):
+    """checks whether a model only looks back in time, so can be run a frame at a time by a StreamingPredictor"""
+    return not any(isinstance(layer, layers.Bidirectional) for layer in model.layers) and \
+        any(isinstance(layer, layers.LSTM) for layer in model.layers)
+
+
+def streaming_model(model):
+    """copy of a unidirectional model that takes a single frame and the state of each LSTM, and returns its
+    prediction for the frame and the new states
+
+    Arguments:
+    model -- keras model made of a chain of layers, as from many2one_model(bidirectional=False) or many2many
+
+    Returns:
+    step_model -- keras model taking [frame, h1, c1, h2, c2, ...] and returning [prediction, h1, c1, h2, c2, ...], frame
+        being of shape (batch, 1, features), and prediction (batch, 1, gestures)
+    """
+    if not is_unidirectional(model):
+        raise ValueError(f'{model.name} is bidirectional or has no LSTM, so it can\'t be run a frame at a time')
+    frame = tf.keras.Input(shape=(1, model.input.shape[-1]))
+    x = frame
+    inputs, states = [frame], []
+    for layer in model.layers:
+        if isinstance(layer, layers.InputLayer):
+            continue
+        config = layer.get_config()
+        if isinstance(layer, layers.LSTM):
+            # a sequence of one frame, starting from the state passed in
+            config.update(return_sequences=True, return_state=True, stateful=False)
+            h, c = tf.keras.Input(shape=(layer.units,)), tf.keras.Input(shape=(layer.units,))
+            step_layer = layers.LSTM.from_config(config)
+            x, h_out, c_out = step_layer(x, initial_state=[h, c])
+            inputs += [h, c]
+            states += [h_out, c_out]
+        else:
+            step_layer = layer.__class__.from_config(config)
+            x = step_layer(x)
+        step_layer.set_weights(layer.get_weights())
+    return tf.keras.Model(inputs=inputs, outputs=[x] + states, name=f'{model.name}_streaming')
+
+
 def plt_metric(history, metric='loss'):
     """plots metrics from the history of a model
     
@@ -0,0 +1,298 @@
+import os
+import json
+import time
+import queue
+import threading
+import numpy as np
+import pandas as pd
+
+#### methods for writing recordings to disk while they are being recorded
+
+class StreamingRecorder:
+    """writes recorded frames to disk in chunks as they come in, from a background thread
+
+    Frames are gathered into chunks of chunk_size frames, each written to its own CSV file (a part) in parts_dir.
+    Only the chunk being gathered is held in memory, so memory use stays the same however long the recording is,
+    and if recording crashes, at most one chunk is lost: the parts can be put back together with merge_parts.
+    Each part has its own header, so columns may appear part way through a recording, e.g. when a second hand appears.
+
+    Arguments:
+    parts_dir -- str, folder to write parts to, created if it doesn't exist
+    chunk_size -- int, no. of frames per part
+    flush_interval -- float, seconds after which a chunk is written, even if it has fewer than chunk_size frames
+    """
+    def __init__(self, parts_dir, chunk_size=500, flush_interval=5.0):
+        self.parts_dir = parts_dir
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        os.makedirs(parts_dir, exist_ok=True)
+        self.n_frames = 0
+        self.n_parts = 0
+        self._chunk = []
+        self._last_flush = time.time()
+        # chunks waiting to be written, None tells the writer to stop
+        self._queue = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._write_parts, name='StreamingRecorder', daemon=True)
+        self._thread.start()
+
+    def add(self, packed_frame):
+        """add a frame (a dictionary of variable name / value pairs) to the recording"""
+        if self._error is not None:
+            raise self._error
+        self._chunk.append(packed_frame)
+        self.n_frames += 1
+        if len(self._chunk) >= self.chunk_size or time.time() - self._last_flush > self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """hand the current chunk to the writer"""
+        if self._chunk:
+            self._queue.put((self.n_parts, self._chunk))
+            self.n_parts += 1
+            self._chunk = []
+        self._last_flush = time.time()
+
+    def close(self, path=None):
+        """write any remaining frames, and wait for the writer to finish
+
+        Arguments:
+        path -- str, if given the parts are merged into a single CSV at path, and then removed
+        """
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        if path is not None:
+            merge_parts(self.parts_dir, path)
+
+    def _write_parts(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            part, chunk = item
+            try:
+                write_part(pd.DataFrame(chunk), os.path.join(self.parts_dir, f'part_{part:06d}.csv'))
+            except Exception as e:
+                # raise in the recording thread, on the next call to add or close
+                self._error = e
+                return
+
+
+def write_part(df, path):
+    """write a df to CSV so that path either doesn't exist, or contains all of df, even after a crash"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', newline='') as f:
+        df.to_csv(f, index=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def merge_parts(parts_dir, path, remove=True):
+    """merges the parts written by a StreamingRecorder into a single CSV, one part at a time
+
+    Columns are the union of the columns of all parts, in the order they first appeared. Frames from parts that
+    lack a column are left empty in that column, just as pd.DataFrame(frames).to_csv would leave them.
+
+    Arguments:
+    parts_dir -- str, folder containing the parts
+    path -- str, CSV file to write
+    remove -- bool, if true, the parts and parts_dir are removed once merged
+    """
+    parts = sorted(os.path.join(parts_dir, p) for p in os.listdir(parts_dir) if p.startswith('part_') and p.endswith('.csv'))
+    # read only the headers, to find every column
+    columns = []
+    seen = set()
+    for part in parts:
+        for col in pd.read_csv(part, nrows=0).columns:
+            if col not in seen:
+                seen.add(col)
+                columns.append(col)
+    with open(path, 'w', newline='') as f:
+        for i, part in enumerate(parts):
+            pd.read_csv(part).reindex(columns=columns).to_csv(f, index=False, header=(i == 0))
+    if remove:
+        for part in parts:
+            os.remove(part)
+        for leftover in os.listdir(parts_dir):
+            # a part that was being written when recording crashed
+            if leftover.endswith('.tmp'):
+                os.remove(os.path.join(parts_dir, leftover))
+        os.rmdir(parts_dir)
+    return path
+
+
+#### methods for a columnar archive format for recordings
+
+# An archive is a folder, by convention ending in .lrec, containing:
+# meta.json -- the columns, categories for columns of strings (e.g. gesture), and for each chunk its no. of rows
+#   and range of timestamps
+# timestamps.npy -- int64 timestamps for every row, used as an index for reading time ranges, and when reading
+#   the timestamp column, which would lose precision as float32
+# chunk_000000.npy, ... -- float32 array of shape (columns, rows), so each column is contiguous and can be memory mapped
+#   or chunk_000000.npz, ... if compressed, one member per column
+# Strings are stored as float32 codes into the column's categories, with nan for missing values.
+
+ARCHIVE_EXTENSION = '.lrec'
+
+def is_archive(path):
+    """checks whether path is a recording archive, rather than a CSV"""
+    return os.path.isfile(os.path.join(os.fspath(path), 'meta.json'))
+
+
+def list_recordings(folder):
+    """paths of the recordings in a folder, CSVs and archives, ignoring anything else (e.g. a manifest)"""
+    return [file.path for file in os.scandir(folder) if file.name.endswith('.csv') or is_archive(file.path)]
+
+
+def _archive_meta(path):
+    with open(os.path.join(os.fspath(path), 'meta.json')) as f:
+        return json.load(f)
+
+
+def archive_columns(path):
+    """returns the list of columns in an archive, without reading any data"""
+    return _archive_meta(path)['columns']
+
+
+def _column_to_float32(series, categories=None):
+    """converts a column to float32, returning (values, categories)
+
+    categories is a list of the strings in a column of strings (e.g. gesture), with values being codes into it,
+    or None for columns of numbers. A list of categories from previous chunks of the column is added to.
+    """
+    if categories is None:
+        if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+            return series.to_numpy(dtype=np.float32, na_value=np.nan), None
+        numeric = pd.to_numeric(series, errors='coerce')
+        is_bool = series.isin(['True', 'False', True, False])
+        if (numeric.notna() | is_bool | series.isna()).all():
+            # numbers or booleans that pandas couldn't parse, because of missing values
+            return numeric.where(~is_bool, series.isin(['True', True])).to_numpy(dtype=np.float32, na_value=np.nan), None
+        categories = []
+    codes = np.full(len(series), np.nan, dtype=np.float32)
+    lookup = {c: i for i, c in enumerate(categories)}
+    for i, value in enumerate(series):
+        if value == value:
+            if value not in lookup:
+                lookup[value] = len(categories)
+                categories.append(value)
+            codes[i] = lookup[value]
+    return codes, categories
+
+
+def csv2archive(csv_path, archive_path=None, chunk_rows=10000, compress=False):
+    """converts a CSV recording into a recording archive, reading chunk_rows rows of the CSV at a time
+
+    Arguments:
+    csv_path -- str, path of the CSV to convert
+    archive_path -- str, path of the archive to write, defaults to csv_path with .csv replaced by .lrec
+    chunk_rows -- int, no. of rows per chunk of the archive
+    compress -- bool, if true, chunks are compressed. Compressed chunks are smaller, but can't be memory mapped
+
+    Returns:
+    archive_path -- str
+    """
+    csv_path = os.fspath(csv_path)
+    if archive_path is None:
+        archive_path = os.path.splitext(csv_path)[0] + ARCHIVE_EXTENSION
+    os.makedirs(archive_path, exist_ok=True)
+    meta = {'version': 1, 'compressed': compress, 'columns': None, 'categories': {}, 'chunks': []}
+    timestamps = []
+    for k, chunk in enumerate(pd.read_csv(csv_path, chunksize=chunk_rows, low_memory=False)):
+        if meta['columns'] is None:
+            meta['columns'] = list(chunk.columns)
+        data = np.empty((len(meta['columns']), len(chunk)), dtype=np.float32)
+        for i, col in enumerate(meta['columns']):
+            data[i], categories = _column_to_float32(chunk[col], meta['categories'].get(col))
+            if categories is not None:
+                meta['categories'][col] = categories
+        chunk_timestamps = chunk['timestamp'].to_numpy(dtype=np.int64)
+        timestamps.append(chunk_timestamps)
+        if compress:
+            np.savez_compressed(os.path.join(archive_path, f'chunk_{k:06d}.npz'), **{f'c{i}': data[i] for i in range(len(data))})
+        else:
+            np.save(os.path.join(archive_path, f'chunk_{k:06d}.npy'), data)
+        meta['chunks'].append({'rows': len(chunk), 't_min': int(chunk_timestamps.min()), 't_max': int(chunk_timestamps.max())})
+    np.save(os.path.join(archive_path, 'timestamps.npy'), np.concatenate(timestamps))
+    # write meta last, so that an archive is only recognised once it is complete
+    with open(os.path.join(archive_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    return archive_path
+
+
+def folder2archives(folder='data/loops/', compress=False, remove_csv=False):
+    """converts every CSV in a folder to an archive, returning the paths of the archives"""
+    archives = []
+    for file in os.scandir(folder):
+        if file.name.endswith('.csv'):
+            archives.append(csv2archive(file.path, compress=compress))
+            if remove_csv:
+                os.remove(file.path)
+    return archives
+
+
+def read_archive(path, columns=None, time_range=None, rows=None):
+    """reads columns of a recording archive into a pandas df, reading only what is asked for
+
+    Arguments:
+    path -- str, path of the archive
+    columns -- list of columns to read, defaults to all. Columns not in the archive are ignored, as with pd.read_csv usecols
+    time_range -- (start, end) timestamps, only rows with start <= timestamp < end are read
+    rows -- (start, stop) row numbers, only these rows are read
+
+    Returns:
+    df -- pandas df of the requested columns. Numbers are float32, strings (e.g. gesture) are restored
+    """
+    path = os.fspath(path)
+    meta = _archive_meta(path)
+    if columns is None:
+        columns = archive_columns(path)
+    column_idx = {c: i for i, c in enumerate(meta['columns'])}
+    data_columns = [c for c in columns if c in column_idx and c != 'timestamp']
+    idx = [column_idx[c] for c in data_columns]
+    timestamps = np.load(os.path.join(path, 'timestamps.npy'), mmap_mode='r')
+    start_row, stop_row = rows if rows is not None else (0, len(timestamps))
+    data_parts, timestamp_parts = [], []
+    offset = 0
+    for k, chunk in enumerate(meta['chunks']):
+        lo, hi = offset, offset + chunk['rows']
+        offset = hi
+        # skip chunks outside the rows or time range asked for, without reading them
+        if hi <= start_row or lo >= stop_row:
+            continue
+        if time_range is not None and (chunk['t_max'] < time_range[0] or chunk['t_min'] >= time_range[1]):
+            continue
+        selection = np.zeros(chunk['rows'], dtype=bool)
+        selection[max(start_row - lo, 0):stop_row - lo] = True
+        chunk_timestamps = timestamps[lo:hi]
+        if time_range is not None:
+            selection &= (chunk_timestamps >= time_range[0]) & (chunk_timestamps < time_range[1])
+        if meta['compressed']:
+            with np.load(os.path.join(path, f'chunk_{k:06d}.npz')) as npz:
+                data = np.stack([npz[f'c{i}'] for i in idx]) if idx else np.empty((0, chunk['rows']), dtype=np.float32)
+        else:
+            data = np.load(os.path.join(path, f'chunk_{k:06d}.npy'), mmap_mode='r')[idx]
+        data_parts.append(data[:, selection])
+        timestamp_parts.append(chunk_timestamps[selection])
+    if data_parts:
+        data = np.concatenate(data_parts, axis=1)
+        timestamps = np.concatenate(timestamp_parts)
+    else:
+        data = np.empty((len(idx), 0), dtype=np.float32)
+        timestamps = np.empty(0, dtype=np.int64)
+    df = {}
+    for c in columns:
+        if c == 'timestamp' and c in column_idx:
+            df[c] = timestamps
+        elif c in column_idx:
+            values = data[data_columns.index(c)]
+            if c in meta['categories']:
+                categories = np.array(meta['categories'][c] + [np.nan], dtype=object)
+                # nan codes are mapped to the nan on the end of categories
+                values = categories[np.where(np.isnan(values), -1, values).astype(int)]
+            df[c] = values
+    return pd.DataFrame(df)
@@ -0,0 +1,111 @@
+import numpy as np
+
+#### resampling frames to a target frame rate
+
+class FrameResampler:
+    """decides which frames to keep so that frames are taken at a target frame rate, using their leap timestamps
+
+    The first frame at or after each tick of a fixed 1 / target_fps grid is kept. The same rule is used for recordings
+    (see resample_mask) and for live capture, so that models see the same frame rate in training and in use.
+
+    Arguments:
+    target_fps -- float, frame rate to resample to. None keeps every frame
+    """
+    def __init__(self, target_fps):
+        self.target_fps = target_fps
+        # leap timestamps are in microseconds
+        self.period = None if target_fps is None else 1e6 / target_fps
+        self.reset()
+
+    def reset(self):
+        """forget previous frames, the next frame will be kept"""
+        # the grid is origin + k * period, and ticks is the no. of ticks taken since the origin. Ticks are always
+        # worked out from the origin, rather than by adding up periods, so that resample_mask can find the same ticks
+        self.origin = None
+        self.ticks = 0
+
+    def tick(self, k):
+        """time of the k-th tick of the grid"""
+        return self.origin + k * self.period
+
+    def accept(self, timestamp):
+        """returns True if the frame with this timestamp should be kept"""
+        if self.period is None:
+            return True
+        if self.origin is not None:
+            if self.tick(self.ticks - 1) <= timestamp < self.tick(self.ticks):
+                return False
+            if self.tick(self.ticks) <= timestamp < self.tick(self.ticks + 1):
+                # stay on the grid, so that the average frame rate is exactly target_fps
+                self.ticks += 1
+                return True
+        # first frame, a gap of more than a period, or timestamps have restarted: start a new grid
+        self.origin = timestamp
+        self.ticks = 1
+        return True
+
+
+def _resample_group(timestamps, resampler, window=256, settle=32):
+    """mask of the frames resampler keeps, for timestamps from a single group, updating the resampler
+
+    Between restarts of the grid, each frame falls into a slot of the grid (origin + s * period <= t <
+    origin + (s + 1) * period). A frame is kept when its slot is one after the previous frame's, dropped when it is the
+    same, and restarts the grid otherwise. So the frames up to the next restart are resampled at once, a window of
+    frames at a time. After a restart, frames are taken one at a time until settle frames have gone by without one,
+    as restarts close together (e.g. from a device slower than target_fps) are quicker dealt with that way.
+    """
+    mask = np.zeros(len(timestamps), dtype=bool)
+    values = timestamps.tolist()
+    i, size, settled = 0, window, 0
+    while i < len(timestamps):
+        if settled < settle:
+            t = values[i]
+            mask[i] = resampler.accept(t)
+            settled = 0 if resampler.ticks == 1 and resampler.origin == t else settled + 1
+            i += 1
+            continue
+        t = timestamps[i:i + size]
+        slots = np.floor((t - resampler.origin) / resampler.period).astype(np.int64)
+        # correct slots that rounding has put either side of a tick, so that ticks are exactly those accept uses
+        slots -= resampler.tick(slots) > t
+        slots += resampler.tick(slots + 1) <= t
+        steps = np.diff(slots, prepend=resampler.ticks - 1)
+        restarts = np.flatnonzero((steps != 0) & (steps != 1))
+        n = restarts[0] if len(restarts) else len(t)
+        mask[i:i + n] = steps[:n] == 1
+        if n:
+            resampler.ticks = slots[n - 1].item() + 1
+        i += n
+        if len(restarts):
+            size, settled = window, 0
+        else:
+            size *= 2
+    return mask
+
+
+def resample_mask(timestamps, target_fps, groups=None, resamplers=None):
+    """boolean mask of the frames a FrameResampler keeps, for an array of timestamps
+
+    Arguments:
+    timestamps -- array like of leap timestamps, in microseconds
+    target_fps -- float, frame rate to resample to
+    groups -- optional array like, e.g. device_index. Each group is resampled separately
+    resamplers -- optional dict of group: FrameResampler, updated in place. Pass the same dict when
+        resampling consecutive chunks of a recording, so that they are resampled as one
+    """
+    timestamps = np.asarray(timestamps)
+    if target_fps is None:
+        return np.ones(len(timestamps), dtype=bool)
+    if resamplers is None:
+        resamplers = {}
+    mask = np.zeros(len(timestamps), dtype=bool)
+    if groups is None:
+        group_rows = [(0, slice(None))]
+    else:
+        values, inverse = np.unique(np.asarray(groups), return_inverse=True)
+        group_rows = [(g.item(), np.flatnonzero(inverse == k)) for k, g in enumerate(values)]
+    for g, rows in group_rows:
+        if g not in resamplers:
+            resamplers[g] = FrameResampler(target_fps)
+        mask[rows] = _resample_group(timestamps[rows], resamplers[g])
+    return mask
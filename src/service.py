@@ -0,0 +1,418 @@
+import json
+import time
+import queue
+import threading
+import collections
+import multiprocessing
+import multiprocessing.connection
+import numpy as np
+import src.features as features
+from src.data_methods import get_gestures, get_description, get_required_VoI, get_derived_feature_dict, Standardizer
+from src.leap_methods import FrameDecoder, peek_timestamp
+from src.resampling import FrameResampler
+from src.inference import load_prediction_model, StreamingPredictor, BatchScheduler, can_stream
+
+#### methods for predicting gestures for many sessions at once, in a pool of worker processes
+
+# Each session is a stream of messages from one client, e.g. the frames of one leap motion device, which is given
+# back the gesture, confidence, fury and angularity the GUI would show, for every frame it uses. A session is kept on
+# one worker process for as long as it's open, as its state (the last frames, the moving averages) lives there, and a
+# worker predicts for every session that is due a prediction at once, in a single batch.
+#
+# Messages are json, either a frame exactly as sent by a device (so a client can just pass on everything it receives,
+# events included), or {"timestamp": ..., "features": [...]}, the model's (standardized) input for a frame, computed
+# by the client, or {"settings": {...}}, to change any of SETTINGS for the session.
+
+# the defaults of the GUI's settings, by the same names
+SETTINGS = {
+    'prediction interval': 15,
+    'fury beta': 0.9,
+    'angularity beta': 0.975,
+    'confidence beta': 0.98,
+    'effective confidence zero': 0.7,
+}
+
+
+class PredictionPipeline:
+    """everything needed to predict from the frames of a device, as set up by predict_gui.py, shared by the sessions
+    of a worker
+
+    Arguments:
+    model_path -- str, model folder
+    backend -- str, as for load_prediction_model
+    target_fps -- float, frame rate frames are taken at, as in the GUI
+    hands -- list of hands the model uses
+    """
+    def __init__(self, model_path='models/prediction_model/', backend='numpy', target_fps=25, hands=['left', 'right']):
+        self.model = load_prediction_model(model_path, backend=backend)
+        self.streaming = can_stream(self.model)
+        _, _, self.idx2g = get_gestures(version='prediction', path=model_path)
+        self.model_fps = int(get_description(path=model_path).get('fps', 5))
+        self.target_fps = target_fps
+        self.hands = hands
+        VoI, VoI_drop = get_required_VoI(path=model_path, derive_features=True, fury=True)
+        self.decoder = FrameDecoder([hand + '_' + v for v in VoI for hand in hands] + ['timestamp'], hands=hands)
+        VoI_predictors = [hand + '_' + v for v in VoI if v not in VoI_drop for hand in hands]
+        derived_feature_dict = get_derived_feature_dict(path=model_path)
+        predictors = VoI_predictors + features.derived_feature_names(derived_feature_dict, hands)
+        self.feature_engine = features.LiveFeatureEngine(self.decoder.columns, predictors, derived_feature_dict,
+            Standardizer(path=model_path), hands)
+
+
+class PredictionSession:
+    """the state of one client's stream of frames, updated frame by frame just as predict_gui.py updates its own
+
+    Arguments:
+    pipeline -- PredictionPipeline
+    settings -- dict of any of SETTINGS to change, plus 'model fps', which defaults to the model's frame rate
+    """
+    def __init__(self, pipeline, settings={}):
+        self.pipeline = pipeline
+        self.settings = dict(SETTINGS, **{'model fps': pipeline.model_fps})
+        self.settings.update(settings)
+        self.keep = pipeline.model.input_shape[-2]
+        self.feature_engine = pipeline.feature_engine.copy()
+        self.resampler = FrameResampler(pipeline.target_fps)
+        self.model_resampler = FrameResampler(self.settings['model fps'])
+        # the frames the model is fed, starting from zeros as the GUI's buffer does
+        self.window = collections.deque(np.zeros((self.keep, pipeline.model.input_shape[-1])), maxlen=self.keep)
+        self.streamer = StreamingPredictor(pipeline.model) if pipeline.streaming else None
+        self.streamed_pred = None
+        # no. of frames used, as counted by the GUI
+        self.frames_recorded = 0
+        self.previous_values = None
+        self.fury = 0
+        self.previous_fury = 0
+        self.angularity = 0
+        self.confidence = 0
+        self.adjusted_raw_confidence = 0
+        self.gesture = 'no_gesture'
+        self.probability = 0
+
+    def receive(self, message):
+        """handles a message, a str of json
+
+        Returns:
+        result, window -- result is a dict for the client if the message was a frame that was used, otherwise None.
+            window is the model input to predict, if a prediction is due, and is to be passed to predicted with the
+            prediction, which completes the result
+        """
+        timestamp = peek_timestamp(message)
+        if timestamp is None:
+            # an event, the device's version, or settings
+            settings = json.loads(message).get('settings')
+            if settings is not None:
+                self.update_settings(settings)
+            return None, None
+        if not self.resampler.accept(timestamp):
+            return None, None
+        frame = json.loads(message)
+        if 'features' in frame:
+            model_frame = np.asarray(frame['features'], dtype=np.float64)
+            if model_frame.shape != (self.pipeline.model.input_shape[-1],):
+                raise ValueError(f'features must be a list of {self.pipeline.model.input_shape[-1]} values')
+            self.frames_recorded += 1
+            self.update_confidence()
+            return self.add_model_frame(model_frame, timestamp, {'status': 'ok', 'fury': None, 'angularity': None})
+        unpacked = self.pipeline.decoder.unpack(frame)
+        if unpacked is None:
+            # no hands
+            return None, None
+        values, hands_present = unpacked
+        self.frames_recorded += 1
+        if hands_present.sum() < len(self.pipeline.hands) and self.previous_values is None:
+            return self.result(timestamp, {'status': 'position hands', 'fury': None, 'angularity': None}), None
+        # fill in anything missing, a hand or just some of its values, from the previous frame
+        if self.previous_values is not None:
+            np.copyto(values, self.previous_values, where=np.isnan(values))
+        status = 'hand missing' if hands_present.sum() < len(self.pipeline.hands) else 'ok'
+        self.previous_values = values
+        model_frame = self.feature_engine.process(values)
+        self.update_affect(self.feature_engine.raw_fury)
+        self.update_confidence()
+        return self.add_model_frame(model_frame, timestamp,
+            {'status': status, 'fury': float(self.fury), 'angularity': float(self.angularity)})
+
+    def update_settings(self, settings):
+        unknown = [name for name in settings if name not in self.settings]
+        if unknown:
+            raise ValueError(f'unknown settings {unknown}, use any of {list(self.settings)}')
+        self.settings.update(settings)
+        if self.model_resampler.target_fps != self.settings['model fps']:
+            self.model_resampler = FrameResampler(self.settings['model fps'])
+
+    def update_affect(self, raw_fury):
+        """updates fury and angularity with a frame's raw fury, as the GUI does"""
+        self.fury = self.settings['fury beta'] * self.fury + (1 - self.settings['fury beta']) * raw_fury
+        raw_angularity = features.get_angularity(raw_fury, self.previous_fury)
+        # a sudden movement drives up angularity immediately
+        if raw_angularity > 0.72:
+            self.angularity = raw_angularity
+        else:
+            beta = self.settings['angularity beta']
+            self.angularity = beta * self.angularity + (1 - beta) * raw_angularity
+        if self.frames_recorded % 10 == 0:
+            self.previous_fury = raw_fury
+
+    def update_confidence(self):
+        beta = self.settings['confidence beta']
+        self.confidence = beta * self.confidence + (1 - beta) * self.adjusted_raw_confidence
+
+    def add_model_frame(self, model_frame, timestamp, result):
+        """feeds the model a frame if it's due one, returning the frame's result, and the window to predict, if any"""
+        if self.model_resampler.accept(timestamp):
+            if self.streamer is not None:
+                self.streamed_pred = self.streamer.update(model_frame, timestamp)
+            else:
+                self.window.append(model_frame)
+        result = self.result(timestamp, result)
+        if self.frames_recorded >= self.keep and self.frames_recorded % self.settings['prediction interval'] == 0:
+            if self.streamer is not None:
+                # the model has already seen every frame
+                self.predicted(self.streamed_pred, result)
+            else:
+                return result, np.stack(self.window)
+        return result, None
+
+    def predicted(self, pred, result):
+        """updates the gesture with a prediction, an array of the probability of each gesture, completing result"""
+        # the GUI sees nan at times at the start
+        if not np.isnan(pred[0]):
+            zero = self.settings['effective confidence zero']
+            self.adjusted_raw_confidence = max(float(np.max(pred) - zero) / (1 - zero), 0)
+        self.gesture = self.pipeline.idx2g[int(np.argmax(pred))]
+        self.probability = float(np.max(pred))
+        result.update(gesture=self.gesture, probability=self.probability, predicted=True)
+
+    def result(self, timestamp, result):
+        """what the client is sent for a frame: the latest gesture, its probability, the confidence the GUI plots,
+        and fury and angularity"""
+        return dict({'timestamp': timestamp, 'gesture': self.gesture, 'probability': self.probability,
+            'confidence': float(self.confidence), 'predicted': False}, **result)
+
+
+class Outbox:
+    """where a worker process puts its results, the sending end of a pipe of its own, so that a worker dying part way
+    through putting a result can't block the others, as it could if they shared a queue"""
+    def __init__(self, connection):
+        self.connection = connection
+
+    def put(self, item):
+        self.connection.send(item)
+
+
+def worker(inbox, outbox, model_path='models/prediction_model/', backend='numpy', target_fps=25, settings={},
+        max_messages=256):
+    """runs sessions, taking messages from inbox until it gives None, and putting (session id, json result) in outbox,
+    which can be a queue or an Outbox
+
+    Messages are ('open', session id, None), (session id, message) or ('close', session id, None). Every message
+    already waiting is handled in turn, then the windows of every session due a prediction are given to a
+    BatchScheduler together, which predicts them in one batch. Anything a message or a prediction raises is given as
+    {"error": ...} to the sessions concerned, which carry on.
+    """
+    pipeline = PredictionPipeline(model_path, backend=backend, target_fps=target_fps)
+    # the windows of a round of messages are all there is to wait for, so the batch needn't wait for more
+    scheduler = BatchScheduler(pipeline.model, max_batch_size=max_messages, max_delay=0)
+    sessions = {}
+    # sessions due a prediction, as session id: (result, window)
+    due = {}
+
+    def error(session_id, e):
+        outbox.put((session_id, json.dumps({'error': f'{type(e).__name__}: {e}'})))
+
+    def predict_due():
+        if due:
+            try:
+                predictions = scheduler.predict({session_id: window for session_id, (_, window) in due.items()})
+            except Exception as e:
+                for session_id in due:
+                    error(session_id, e)
+                due.clear()
+                return
+            for session_id, (result, _) in due.items():
+                sessions[session_id].predicted(predictions[session_id], result)
+                outbox.put((session_id, json.dumps(result)))
+            due.clear()
+
+    outbox.put((None, 'ready'))
+    while True:
+        messages = [inbox.get()]
+        while len(messages) < max_messages:
+            try:
+                messages.append(inbox.get_nowait())
+            except queue.Empty:
+                break
+        for message in messages:
+            if message is None:
+                predict_due()
+                scheduler.close()
+                return
+            if message[0] == 'open':
+                sessions[message[1]] = PredictionSession(pipeline, settings)
+                continue
+            if message[0] == 'close':
+                sessions.pop(message[1], None)
+                due.pop(message[1], None)
+                continue
+            session_id, text = message
+            if session_id not in sessions:
+                continue
+            if session_id in due:
+                # the session's next frame depends on its prediction
+                predict_due()
+            try:
+                result, window = sessions[session_id].receive(text)
+            except Exception as e:
+                # a bad message from one client mustn't stop the sessions of the others
+                error(session_id, e)
+                continue
+            if window is not None:
+                due[session_id] = (result, window)
+            elif result is not None:
+                outbox.put((session_id, json.dumps(result)))
+        predict_due()
+
+
+class PredictionService:
+    """a pool of worker processes, each running the sessions given to it
+
+    Sessions are opened on the worker with the fewest open sessions, and stay there until closed. Results are taken
+    from results, in the order each session's frames were sent. If a worker dies, it's restarted, and each of its
+    sessions is given {"error": ...} and starts again from scratch on the new worker.
+
+    Arguments:
+    processes -- int, no. of worker processes, None for one per core
+    model_path, backend, target_fps, settings -- as for worker
+    """
+    def __init__(self, processes=None, model_path='models/prediction_model/', backend='numpy', target_fps=25,
+            settings={}):
+        # spawned rather than forked, as the process that starts the workers may have other threads running
+        self.context = multiprocessing.get_context('spawn')
+        self.worker_args = (model_path, backend, target_fps, settings)
+        n_workers = processes or multiprocessing.cpu_count()
+        self.inboxes = [None] * n_workers
+        # the receiving end of each worker's Outbox
+        self.outboxes = [None] * n_workers
+        self.workers = [None] * n_workers
+        for i in range(n_workers):
+            self.start_worker(i)
+        # wait for every worker to load the model
+        loading = list(self.outboxes)
+        while loading:
+            for outbox in multiprocessing.connection.wait(loading, timeout=0.5):
+                try:
+                    outbox.recv()
+                except EOFError:
+                    self.terminate()
+                    raise RuntimeError('a prediction worker stopped while loading the model')
+                loading.remove(outbox)
+        self.n_sessions = [0] * n_workers
+        self.affinity = {}
+        # errors for the sessions of dead workers, given by results before anything from the workers
+        self.failed = collections.deque()
+        # results received but not yet taken
+        self.received = collections.deque()
+        self.stopping = False
+        self.last_check = time.monotonic()
+        # sessions are opened and closed by one thread and their results taken by another
+        self.lock = threading.Lock()
+
+    def start_worker(self, i):
+        if self.inboxes[i] is not None:
+            # messages still in the inbox of a dead worker will never be taken, so mustn't hold up exiting
+            self.inboxes[i].cancel_join_thread()
+        self.inboxes[i] = self.context.Queue()
+        self.outboxes[i], sender = self.context.Pipe(duplex=False)
+        self.workers[i] = self.context.Process(target=worker, args=(self.inboxes[i], Outbox(sender), *self.worker_args),
+            name=f'PredictionWorker-{i}', daemon=True)
+        self.workers[i].start()
+        # only the worker has the sending end, so the pipe ends when the worker does
+        sender.close()
+
+    def open(self, session_id):
+        """starts a session, with a hashable id"""
+        with self.lock:
+            i = int(np.argmin(self.n_sessions))
+            self.affinity[session_id] = i
+            self.n_sessions[i] += 1
+            self.inboxes[i].put(('open', session_id, None))
+
+    def send(self, session_id, message):
+        """passes a message, a str of json, to the session's worker"""
+        with self.lock:
+            self.inboxes[self.affinity[session_id]].put((session_id, message))
+
+    def close(self, session_id):
+        with self.lock:
+            i = self.affinity.pop(session_id)
+            self.n_sessions[i] -= 1
+            self.inboxes[i].put(('close', session_id, None))
+
+    def check_workers(self):
+        """restarts any worker that has died, reopening its sessions on the new worker, and failing what they had sent"""
+        self.last_check = time.monotonic()
+        with self.lock:
+            for i, process in enumerate(self.workers):
+                if process.is_alive() or self.stopping:
+                    continue
+                self.start_worker(i)
+                error = json.dumps({'error': f'prediction worker stopped (exit code {process.exitcode}), '
+                    'the session has been restarted'})
+                for session_id, j in self.affinity.items():
+                    if j == i:
+                        self.inboxes[i].put(('open', session_id, None))
+                        self.failed.append((session_id, error))
+
+    def results(self, timeout=None):
+        """waits for the next result, returning (session id, str of json), or None after timeout seconds"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if time.monotonic() - self.last_check >= 0.5:
+                self.check_workers()
+            if self.failed:
+                return self.failed.popleft()
+            if self.received:
+                return self.received.popleft()
+            # wait a little at a time, to notice dead workers
+            wait = 0.5 if deadline is None else min(max(deadline - time.monotonic(), 0), 0.5)
+            for outbox in multiprocessing.connection.wait(self.outboxes, timeout=wait):
+                try:
+                    result = outbox.recv()
+                except (EOFError, OSError):
+                    # the worker has died (or, when stopping, finished), so is restarted straight away
+                    self.workers[self.outboxes.index(outbox)].join(timeout=1)
+                    self.check_workers()
+                    continue
+                # a restarted worker announcing it's loaded the model
+                if result[0] is not None:
+                    self.received.append(result)
+            if not self.received and not self.failed and deadline is not None and time.monotonic() >= deadline:
+                return None
+
+    def shutdown(self):
+        """stops the workers, once they have handled every message sent, returning any results not yet taken"""
+        self.stopping = True
+        for inbox in self.inboxes:
+            inbox.put(None)
+        # a worker can't exit until the results it has put are taken
+        results = list(self.failed) + list(self.received)
+        self.failed.clear()
+        self.received.clear()
+        while any(process.is_alive() for process in self.workers):
+            result = self.results(timeout=0.1)
+            if result is not None:
+                results.append(result)
+        while True:
+            result = self.results(timeout=0)
+            if result is None:
+                return results
+            results.append(result)
+
+    def terminate(self):
+        """stops the workers at once"""
+        self.stopping = True
+        for inbox, process in zip(self.inboxes, self.workers):
+            inbox.cancel_join_thread()
+            if process.is_alive():
+                process.terminate()
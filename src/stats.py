@@ -0,0 +1,139 @@
+import os
+import json
+import numpy as np
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from src.data_methods import file2X_y
+from src.cache import RecordingCache, PARAM_FILES, DICT_FILES, processing_key, file_signature
+from src.recording import list_recordings
+
+#### methods for computing the means and standard deviations used to standardize data, over many recordings
+
+class RunningStats:
+    """count, mean and sum of squared differences from the mean of each column, computed in one pass
+
+    Batches are added with update, and stats computed separately (e.g. for different recordings, in different processes)
+    are combined with merge, using the parallel algorithm of Chan et al., so that no more than one batch is ever in memory.
+
+    Arguments:
+    columns -- list of the names of the columns
+    """
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.count = 0
+        self.mean = np.zeros(len(self.columns))
+        self.m2 = np.zeros(len(self.columns))
+
+    def update(self, X):
+        """adds a batch of data, an array of shape (rows, columns)"""
+        X = np.asarray(X, dtype=np.float64)
+        if len(X) == 0:
+            return self
+        batch = RunningStats(self.columns)
+        batch.count = len(X)
+        batch.mean = X.mean(axis=0)
+        batch.m2 = np.sum((X - batch.mean)**2, axis=0)
+        return self.merge(batch)
+
+    def merge(self, other):
+        """combines the stats of other into these stats, as if other's data had been added with update"""
+        assert other.columns == self.columns, 'can only merge stats of the same columns'
+        count = self.count + other.count
+        if other.count == 0:
+            return self
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / count
+        self.m2 = self.m2 + other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+        return self
+
+    def std(self, ddof=1):
+        """standard deviation of each column, with ddof=1 as pandas uses by default"""
+        return np.sqrt(self.m2 / (self.count - ddof))
+
+    def to_dict(self):
+        return {'columns': self.columns, 'count': self.count, 'mean': self.mean.tolist(), 'm2': self.m2.tolist()}
+
+    @classmethod
+    def from_dict(cls, d):
+        stats = cls(d['columns'])
+        stats.count = d['count']
+        stats.mean = np.array(d['mean'])
+        stats.m2 = np.array(d['m2'])
+        return stats
+
+
+def recording_stats(raw_file, cache=None, **kwargs):
+    """processes a recording with file2X_y, without standardizing it, and returns the stats of its predictors as a dict
+
+    Returns None if the recording was skipped.
+    """
+    X_y = file2X_y(raw_file, standardize=False, cache=cache, **kwargs)
+    if X_y is None:
+        return None
+    X, _, columns = X_y
+    return RunningStats(columns).update(X).to_dict()
+
+
+def folder2dicts(folders=['data/loops/'], target_fps=30, g2idx={'no_gesture': 0, 'so_so': 1}, hands=['left', 'right'],
+        derive_features=True, path='params/', state_file='data/stats.json', cache_dir='data/cache/', processes=1):
+    """computes the means and standard deviations of every predictor over all recordings in folders, writing them
+    to means_dict.json and stds_dict.json in path, as create_dicts does for a single df
+
+    Arguments:
+    folders -- list of folders of recordings
+    path -- str, folder to write the dictionaries to
+    state_file -- str, file in which the stats of each recording are kept. Only recordings that have been added or
+        changed since the last call are processed, so adding a few recordings to a large collection is quick
+    cache_dir -- str, folder for caching processed recordings (see src/cache.py), or None to not cache. Without a cache,
+        recordings are taken to have changed when their size or modification time has
+    processes -- int, no. of worker processes to process recordings in parallel with, None uses one per core
+    the other arguments are as for folder2examples
+
+    Returns:
+    means_dict, stds_dict
+    """
+    cache = RecordingCache(cache_dir) if cache_dir is not None else None
+    settings = dict(target_fps=target_fps, g2idx=g2idx, hands=hands, derive_features=derive_features)
+    state = {}
+    if os.path.exists(state_file):
+        with open(state_file) as f:
+            state = json.load(f)
+    files = [file for folder in folders for file in list_recordings(folder)]
+    # stats depend on the recording and what is derived from it, but not on the means and stds being computed
+    param_files = [name for name in PARAM_FILES if name not in DICT_FILES]
+    # identical copies of a recording each count, as they would in a single df
+    if cache is not None:
+        keys = [cache.key(file, param_files=param_files, file=os.path.abspath(file), **settings) for file in files]
+    else:
+        keys = [processing_key(f'{os.path.abspath(file)}:{file_signature(file)}', param_files=param_files, **settings)
+            for file in files]
+    new_files = [(file, key) for file, key in zip(files, keys) if key not in state]
+    process_file = partial(recording_stats, cache=cache, **settings)
+    if processes == 1:
+        results = list(map(process_file, [file for file, _ in new_files]))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(process_file, [file for file, _ in new_files]))
+    for (file, key), result in zip(new_files, results):
+        state[key] = {'file': file, 'stats': result}
+    # forget recordings that have been changed or removed
+    state = {key: state[key] for key in keys}
+    stats = None
+    for entry in state.values():
+        if entry['stats'] is not None:
+            recording = RunningStats.from_dict(entry['stats'])
+            stats = recording if stats is None else stats.merge(recording)
+    assert stats is not None, f'no recordings in {folders} contain data for every hand in {hands}'
+    print(f'{len(new_files)} of {len(files)} recordings processed, stats over {stats.count} frames')
+    if os.path.dirname(state_file):
+        os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    with open(state_file, 'w') as f:
+        json.dump(state, f)
+    means_dict = dict(zip(stats.columns, stats.mean.tolist()))
+    stds_dict = dict(zip(stats.columns, stats.std().tolist()))
+    with open(f'{path}means_dict.json', 'w') as f:
+        json.dump(means_dict, f)
+    with open(f'{path}stds_dict.json', 'w') as f:
+        json.dump(stds_dict, f)
+    return means_dict, stds_dict
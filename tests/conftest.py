@@ -0,0 +1,35 @@
+import os
+import sys
+import shutil
+import types
+import numpy as np
+import pandas as pd
+import pytest
+
+# src/leap_methods.py reads the devices from config.py, which each user writes for their own devices. Without one,
+# the tests use a single device, at the address replay_server.py serves on
+try:
+    import config
+except ImportError:
+    config = types.ModuleType('config')
+    config.devices = [{'url': 'ws://127.0.0.1:6437/v6.json', 'mode': 'desktop'}]
+    sys.modules['config'] = config
+
+from leap_frames import make_recording
+from src.recording import csv2archive
+
+PARAMS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'params')
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """a folder to work in, with its own copy of params/, and a folder of recordings: a CSV, and an archive with the
+    same name made from a different recording"""
+    shutil.copytree(PARAMS, tmp_path / 'params')
+    monkeypatch.chdir(tmp_path)
+    folder = tmp_path / 'recordings'
+    folder.mkdir()
+    pd.DataFrame(make_recording(np.random.default_rng(0))).to_csv(folder / 'a.csv', index=False)
+    pd.DataFrame(make_recording(np.random.default_rng(1))).to_csv(tmp_path / 'a.csv', index=False)
+    csv2archive(tmp_path / 'a.csv', folder / 'a.lrec')
+    return tmp_path
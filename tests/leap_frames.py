@@ -0,0 +1,40 @@
+import numpy as np
+from src.leap_methods import pack_frame
+
+# frames shaped like those sent by a leap motion device (v6 json), with random values
+
+DEVICE = {'url': 'ws://127.0.0.1:6437/v6.json', 'mode': 'desktop'}
+
+
+def make_frame(rng, frame_id=1, timestamp=1000000, hands=('left', 'right')):
+    """a parsed leap frame, with the given hands and all five fingers of each"""
+    vector = lambda n=3: rng.normal(scale=100, size=n).tolist()
+    frame = {'currentFrameRate': float(rng.uniform(100, 120)), 'id': frame_id, 'timestamp': timestamp,
+        'devices': [], 'hands': [], 'pointables': [], 'interactionBox': {'center': [0, 200, 0], 'size': [235, 235, 147]}}
+    for k, hand_type in enumerate(hands):
+        hand_id = frame_id * 10 + k
+        frame['hands'].append({'armBasis': [vector() for _ in range(3)], 'armWidth': 60.0,
+            'confidence': float(rng.uniform()), 'direction': vector(), 'elbow': vector(),
+            'grabStrength': float(rng.uniform()), 'id': hand_id, 'palmNormal': vector(), 'palmPosition': vector(),
+            'palmVelocity': vector(), 'pinchStrength': float(rng.uniform()), 'timeVisible': 1.5, 'type': hand_type,
+            'wrist': vector()})
+        # as sent by the devices the recordings were made with
+        frame['hands'][-1].update({'grabAngle': float(rng.uniform(0, np.pi)), 'palmWidth': 80.0,
+            'pinchDistance': float(rng.uniform(0, 100)), 'sphereRadius': float(rng.uniform(30, 150))})
+        for finger_type in range(5):
+            frame['pointables'].append({'bases': [[vector() for _ in range(3)] for _ in range(4)],
+                'btipPosition': vector(), 'direction': vector(), 'extended': bool(rng.uniform() > 0.5),
+                'handId': hand_id, 'id': hand_id * 10 + finger_type, 'length': 50.0, 'tipPosition': vector(),
+                'tool': False, 'touchZone': 'none', 'type': finger_type})
+    return frame
+
+
+def make_recording(rng, n_frames=230, gestures=('no_gesture', 'wave')):
+    """packed frames of a recording, as record.py adds them, with the left hand only appearing part way through"""
+    frames = []
+    for i in range(n_frames):
+        hands = ('right',) if i < 60 or i % 17 == 0 else ('left', 'right')
+        packed = pack_frame(make_frame(rng, frame_id=i, timestamp=10**6 + i * 9000, hands=hands), 0, DEVICE)
+        packed['gesture'] = gestures[0] if i <= 100 else gestures[1]
+        frames.append(packed)
+    return frames
@@ -0,0 +1,108 @@
+import numpy as np
+
+#### the implementations that later, faster ones replaced, kept as they were so the new ones can be checked against them
+
+# derived features, a frame (a dict or pd.Series) at a time, using np.linalg.norm and np.dot
+
+def get_derived_features(frame, derived_feature_dict, hands=['left', 'right']):
+    """given a frame of gesture data, returns some derived features"""
+    # get fingertip positions
+    fingers = ['thumb', 'index', 'middle', 'ring', 'pinky']
+    # create dictionary of the features needed for deriving new features
+    features = {}
+    for hand in hands:
+        for i, finger in enumerate(fingers):
+            features[f'{hand}_f{i+1}'] = np.array([frame[f'{hand}_{finger}_tipPosition_{j}'] for j in (0,1,2)])
+    for hand in hands:
+        features[f'{hand}_palm_norm'] = np.array([frame[f'{hand}_palmNormal_{i}'] for i in (0,1,2)])
+        features[f'{hand}_palm_position'] = np.array([frame[f'{hand}_palmPosition_{i}'] for i in (0,1,2)])
+        features[f'{hand}_wrist'] = np.array([frame[f'{hand}_wrist_{i}'] for i in (0,1,2)])
+        features[f'{hand}_elbow'] = np.array([frame[f'{hand}_elbow_{i}'] for i in (0,1,2)])
+        features[f'{hand}_palm_velocity'] = np.array([frame[f'{hand}_palmVelocity_{i}'] for i in (0,1,2)])
+
+    # create dictionary of new features
+    new_features = {}
+    for f in derived_feature_dict['one_handed']:
+        for hand in hands:
+            globals()[f](new_features, features, hand)
+
+    if len(hands) == 2:
+        # compute between hand features
+        for f in derived_feature_dict['two_handed']:
+            globals()[f](new_features, features)
+
+    return new_features
+
+
+def adjacent_finger_distances(new_features, features, hand):
+    for i in range(1, 5):
+        new_features[f'{hand}_f{i}_{i+1}'] = np.linalg.norm(features[f'{hand}_f{i}'] - features[f'{hand}_f{i+1}'])
+
+def finger_palm_distances(new_features, features, hand):
+    for i in range(1,6):
+        new_features[f'{hand}_f{i}_p'] = np.linalg.norm(features[f'{hand}_palm_position'] - features[f'{hand}_f{i}'])
+
+def finger_palm_plain_distances(new_features, features, hand):
+    for i in range(1,6):
+        new_features[f'{hand}_f{i}_p_plain'] = np.dot((features[f'{hand}_f{i}'] - features[f'{hand}_palm_position']), features[f'{hand}_palm_norm'])
+
+def wrist_angle(new_features, features, hand):
+    wrist_direction = features[f'{hand}_wrist'] - features[f'{hand}_elbow']
+    wrist_direction /= np.linalg.norm(wrist_direction)
+    new_features[f'{hand}_wrist_angle'] = np.dot(wrist_direction, features[f'{hand}_palm_norm'])
+
+def palm_velocity(new_features, features, hand):
+    new_features[f'palm_velocity'] = np.linalg.norm(features[f'{hand}_palm_velocity'])
+
+def interpalm_distance(new_features, features):
+    new_features[f'palm_distance'] = np.linalg.norm(features[f'right_palm_position'] - features[f'left_palm_position'])
+
+def interfinger_distances(new_features, features):
+    for i in range(1,6):
+        new_features[f'f{i}_f{i}'] = np.linalg.norm(features[f'left_f{i}'] - features[f'right_f{i}'])
+
+def interpalm_angle(new_features, features):
+    new_features[f'palm_angle'] = np.dot(features[f'right_palm_norm'], features[f'left_palm_norm'])
+
+
+def get_fury2(current_frame, previous_frame):
+    """calculates the speed of hand/interfinger movement, normalizes between 0 and 1 crudely but sensibly"""
+    fur1 = max([abs(current_frame[f'{hand}_palmVelocity_{i}']) for i in (0,1,2) for hand in ('left', 'right')])
+    fur2 = max([abs(current_frame[f'{hand}_f{i}_{i+1}'] - previous_frame[f'{hand}_f{i}_{i+1}']) for i in (1,2,3,4) for hand in ('left', 'right')])
+    fur1 /= 1500
+    fur2 /= 60
+    return max(min(fur1, 1), min(fur2, 1))
+
+
+def standardize(df, means_dict, stds_dict):
+    """standardizes each column of a df with the dictionaries, as predict_gui.py and df2X_y once did"""
+    return df.apply(lambda column: (column - means_dict[column.name]) / stds_dict[column.name])
+
+
+# splitting contiguous frames into examples, a window at a time
+
+def X_y2examples(X,y=[],n_frames=30, stride=None):
+    """splits a contiguous list of frames and labels up into single gesture examples of length n_frames"""
+    if len(y) == 0:
+        return np.array([X[i:i+n_frames] for i in range(0, len(X) - len(X) % n_frames, n_frames)])
+
+    if stride == None:
+        stride = n_frames // 2
+
+    Xsplit = [[0]]
+    ysplit = [y[0]]
+    for i, g in enumerate(y):
+        if g != ysplit[-1]:
+            Xsplit[-1].append(i-1)
+            Xsplit.append([i])
+            ysplit.append(g)
+    Xsplit[-1].append(len(X)-1)
+
+    X_final = []
+    y_final = []
+    for i, g in enumerate(ysplit):
+        for j in range(Xsplit[i][0] + n_frames, Xsplit[i][1] + 2, stride):
+            X_final.append(X[j-n_frames:j])
+            y_final.append(g)
+
+    return np.array(X_final), np.array(y_final)
@@ -0,0 +1,63 @@
+import os
+import json
+import types
+import numpy as np
+import pandas as pd
+import pytest
+from src.affect import moving_average, affect_curves, recording_affect
+from src.leap_methods import unpack_frame
+from src.service import SETTINGS, PredictionPipeline, PredictionSession
+
+MODEL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models', 'prediction_model', '')
+
+
+@pytest.mark.parametrize('n', [0, 1, 127, 128, 129, 5000])
+@pytest.mark.parametrize('beta', [0, 0.5, 0.9, 0.975])
+def test_moving_average(n, beta):
+    values = np.random.default_rng(n).normal(size=n)
+    expected = []
+    y = 0
+    for value in values:
+        y = beta * y + value
+        expected.append(y)
+    np.testing.assert_allclose(moving_average(values, beta), expected, rtol=1e-10, atol=1e-12)
+
+
+def test_affect_curves_matches_session():
+    # the GUI's, and a session's, frame by frame updates
+    rng = np.random.default_rng(0)
+    raw = rng.uniform(0, 0.3, size=3000)
+    # sudden movements, some of them in a row
+    raw[rng.choice(len(raw), 60)] = 1
+    raw[1000:1005] = [1, 0, 1, 0, 1]
+    # frames with no hands aren't used, but can leave gaps in frames_recorded
+    frames_recorded = np.cumsum(rng.choice([1, 1, 1, 2, 5], size=len(raw)))
+    session = types.SimpleNamespace(settings=dict(SETTINGS, **{'fury beta': 0.8}), fury=0, previous_fury=0,
+        angularity=0)
+    expected = []
+    for value, frames in zip(raw, frames_recorded):
+        session.frames_recorded = frames
+        PredictionSession.update_affect(session, value)
+        expected.append((session.fury, session.angularity))
+    fury, _, angularity = affect_curves(raw, frames_recorded, fury_beta=0.8)
+    np.testing.assert_allclose(fury, [f for f, _ in expected], atol=1e-12)
+    np.testing.assert_allclose(angularity, [a for _, a in expected], atol=1e-12)
+
+
+def test_recording_affect_matches_session(workdir):
+    pytest.importorskip('h5py')
+    df = pd.read_csv('recordings/a.csv')
+    # a hand with just some of its values missing, as sometimes recorded
+    df.loc[150:155, ['right_palmVelocity_0', 'right_palmVelocity_2']] = np.nan
+    df.to_csv('recordings/a.csv', index=False)
+    session = PredictionSession(PredictionPipeline(MODEL, backend='numpy'))
+    results = []
+    for row in df.to_dict('records'):
+        result, _ = session.receive(json.dumps(unpack_frame(row)))
+        if result is not None and result['fury'] is not None:
+            results.append(result)
+    curves = recording_affect('recordings/a.csv')
+    assert len(curves) == len(results) > 0
+    np.testing.assert_array_equal(curves['timestamp'], [r['timestamp'] for r in results])
+    np.testing.assert_allclose(curves['fury'], [r['fury'] for r in results], atol=1e-9)
+    np.testing.assert_allclose(curves['angularity'], [r['angularity'] for r in results], atol=1e-9)
@@ -0,0 +1,114 @@
+import os
+import shutil
+import numpy as np
+import pytest
+import src.cache as cache_module
+from src.cache import RecordingCache, PARAM_FILES
+
+PARAMS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'params')
+
+
+@pytest.fixture
+def params(tmp_path):
+    path = tmp_path / 'params'
+    path.mkdir()
+    for name in PARAM_FILES:
+        shutil.copy(os.path.join(PARAMS, name), path / name)
+    return path
+
+
+@pytest.fixture
+def recording(tmp_path):
+    path = tmp_path / 'recording.csv'
+    path.write_text('gesture,timestamp\nno_gesture,1000\n')
+    return path
+
+
+def test_key(tmp_path, params, recording, monkeypatch):
+    cache = RecordingCache(str(tmp_path / 'cache'))
+    key = lambda path=recording, **kwargs: cache.key(path, params_path=str(params), target_fps=25, **kwargs)
+    base = key()
+    assert key() == base
+    # the same content elsewhere is the same recording
+    shutil.copy(recording, tmp_path / 'copy.csv')
+    assert key(tmp_path / 'copy.csv') == base
+    assert key(hands=['left']) != base
+    # any of the param files, or the version of the processing code, changing changes the key
+    keys = {base}
+    for name in PARAM_FILES:
+        with open(params / name, 'a') as f:
+            f.write('\n')
+        keys.add(key())
+        assert len(keys) == 1 + PARAM_FILES.index(name) + 1, name
+    monkeypatch.setattr(cache_module, 'CACHE_VERSION', cache_module.CACHE_VERSION + 1)
+    keys.add(key())
+    # but only the param files asked for are hashed
+    before = key(param_files=PARAM_FILES[:4])
+    with open(params / 'means_dict.json', 'a') as f:
+        f.write('\n')
+    assert key(param_files=PARAM_FILES[:4]) == before
+    recording.write_text('gesture,timestamp\nno_gesture,10000\n')
+    keys.add(key())
+    assert len(keys) == len(PARAM_FILES) + 3
+
+
+def test_file_hash_remembered(tmp_path, recording):
+    cache = RecordingCache(str(tmp_path / 'cache'))
+    sha1 = cache.file_hash(recording)
+    # hashes are remembered on disk, for as long as the recording's size and modification time stay the same
+    assert RecordingCache(str(tmp_path / 'cache'))._hashes[str(recording)]['sha1'] == sha1
+    stat = os.stat(recording)
+    recording.write_text('gesture,timestamp\nno_gesture,2000\n')
+    os.utime(recording, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert RecordingCache(str(tmp_path / 'cache')).file_hash(recording) == sha1
+    os.utime(recording, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert RecordingCache(str(tmp_path / 'cache')).file_hash(recording) != sha1
+    # an archive is hashed as a whole
+    archive = tmp_path / 'recording.lrec'
+    archive.mkdir()
+    (archive / 'meta.json').write_text('{}')
+    (archive / 'chunk_000000.npy').write_bytes(b'1234')
+    sha1 = cache.file_hash(archive)
+    (archive / 'chunk_000000.npy').write_bytes(b'12345')
+    assert cache.file_hash(archive) != sha1
+
+
+def test_get_put(tmp_path, monkeypatch):
+    cache = RecordingCache(str(tmp_path / 'cache'))
+    assert cache.get('missing') is None
+    X, y = np.arange(12, dtype=np.float32).reshape(3, 4), np.array([0, 1, 1])
+    cache.put('a', X=X, y=y)
+    entry = cache.get('a')
+    assert sorted(entry) == ['X', 'y']
+    np.testing.assert_array_equal(entry['X'], X)
+    np.testing.assert_array_equal(entry['y'], y)
+    assert [f for f in os.listdir(cache.cache_dir) if f.endswith('.tmp.npz')] == []
+    # an entry removed by another process, e.g. while evicting, is a miss rather than an error, even when it
+    # goes just as it is being read
+    load = np.load
+    def evicted_load(path, **kwargs):
+        os.remove(path)
+        return load(path, **kwargs)
+    monkeypatch.setattr(cache_module.np, 'load', evicted_load)
+    assert cache.get('a') is None
+    monkeypatch.undo()
+    assert cache.get('a') is None
+
+
+def test_eviction(tmp_path):
+    X = np.zeros(1000)
+    cache = RecordingCache(str(tmp_path / 'cache'))
+    cache.put('a', X=X)
+    size = os.path.getsize(os.path.join(cache.cache_dir, 'a.npz'))
+    cache.max_bytes = 3 * size
+    for k, key in enumerate(['a', 'b', 'c']):
+        cache.put(key, X=X)
+        # as if put k seconds after the first, whatever the resolution of the file system's times
+        os.utime(os.path.join(cache.cache_dir, key + '.npz'), (1000 + k, 1000 + k))
+    # getting an entry makes it the most recently used, so the least recently used is removed first
+    assert cache.get('a') is not None
+    cache.put('d', X=X)
+    assert sorted(f for f in os.listdir(cache.cache_dir) if f.endswith('.npz')) == ['a.npz', 'c.npz', 'd.npz']
+    cache.put('e', X=X)
+    assert cache.get('c') is None and cache.get('a') is not None
+    assert cache.get('b') is None
@@ -0,0 +1,48 @@
+import os
+import json
+import numpy as np
+import pytest
+
+pytest.importorskip('tensorflow')
+from src.datasets import folder2arrays, WindowSequence, ARRAY_PARAM_FILES
+from src.data_methods import X_y2examples, Mirror, Standardizer, get_derived_feature_dict
+
+G2IDX = {'no_gesture': 0, 'wave': 1}
+
+
+def test_folder2arrays(workdir):
+    arrays_dir = folder2arrays('recordings/', 'arrays/', target_fps=25, g2idx=G2IDX, cache_dir=None)
+    with open(os.path.join(arrays_dir, 'meta.json')) as f:
+        meta = json.load(f)
+    # recordings that only differ by extension are kept apart
+    assert sorted(meta['recordings']) == ['a.csv', 'a.lrec']
+    X_csv, X_archive = [np.load(os.path.join(arrays_dir, f'{name}.X.npy')) for name in ('a.csv', 'a.lrec')]
+    assert X_csv.shape[1] == X_archive.shape[1] == len(meta['columns'])
+    assert not np.array_equal(X_csv[:10], X_archive[:10])
+    for name in ARRAY_PARAM_FILES:
+        assert open(os.path.join(arrays_dir, name)).read() == open(os.path.join('params', name)).read()
+
+
+def test_window_sequence_mirror(workdir):
+    arrays_dir = folder2arrays('recordings/', 'arrays/', target_fps=25, g2idx=G2IDX, cache_dir=None)
+    mirror = Mirror(json.load(open(os.path.join(arrays_dir, 'meta.json')))['columns'], standardizer=Standardizer(),
+        derived_feature_dict=get_derived_feature_dict())
+    # params/ changing after the recordings were processed doesn't change how they are mirrored
+    with open('params/means_dict.json') as f:
+        means_dict = json.load(f)
+    with open('params/means_dict.json', 'w') as f:
+        json.dump({c: mean + 1 for c, mean in means_dict.items()}, f)
+    sequence = WindowSequence(arrays_dir, n_frames=10, batch_size=1000, shuffle=False, mirror=True)
+    assert len(sequence) == 1
+    X, y = sequence[0]
+    n = len(X) // 2
+    expected_X, expected_y = [], []
+    for name in sequence.meta['recordings']:
+        X_file, y_file = X_y2examples(np.load(os.path.join(arrays_dir, f'{name}.X.npy')),
+            np.load(os.path.join(arrays_dir, f'{name}.y.npy')), n_frames=10)
+        expected_X.append(X_file)
+        expected_y.append(y_file)
+    expected_X, expected_y = np.concatenate(expected_X), np.concatenate(expected_y)
+    np.testing.assert_array_equal(X[:n], expected_X)
+    np.testing.assert_array_equal(y, np.concatenate((expected_y, expected_y)))
+    np.testing.assert_allclose(X[n:], mirror.apply(expected_X).astype(np.float32), rtol=1e-5, atol=1e-5)
@@ -0,0 +1,252 @@
+import json
+import numpy as np
+import pandas as pd
+import pytest
+import reference
+import src.features as features
+import src.data_methods as data_methods
+from src.data_methods import X_y2examples, X_y2mirrored_examples, Standardizer, Mirror, mirror_data, df2X_y
+from src.inference import NumpyModel, StreamingPredictor
+
+# The vectorized and precompiled versions of the pipeline must give the same values as the implementations they
+# replaced (kept in reference.py), as models trained on one are run on the other.
+
+HANDS = ['left', 'right']
+ALL_FEATURES = {
+    'one_handed': ['adjacent_finger_distances', 'finger_palm_distances', 'finger_palm_plain_distances', 'wrist_angle',
+        'palm_velocity'],
+    'two_handed': ['interpalm_distance', 'interfinger_distances', 'interpalm_angle'],
+}
+# palm_velocity isn't computed for each hand, so data containing it can't be mirrored
+MIRRORABLE_FEATURES = dict(ALL_FEATURES, one_handed=ALL_FEATURES['one_handed'][:-1])
+
+
+@pytest.fixture
+def frames():
+    """a df of random frames of both hands, with the variables every feature is derived from, and a gesture"""
+    rng = np.random.default_rng(0)
+    n = 120
+    variables = sorted(set(features.vector_sources(HANDS).values()))
+    df = pd.DataFrame({f'{variable}_{j}': rng.normal(scale=100, size=n) for variable in variables for j in (0,1,2)})
+    df['gesture'] = np.repeat(['no_gesture', 'wave', 'fist', 'wave'], [40, 7, 50, 23])
+    return df
+
+
+@pytest.fixture
+def standardizer(tmp_path, frames):
+    """a Standardizer with random means and stds for every raw variable and derived feature"""
+    rng = np.random.default_rng(1)
+    columns = [c for c in frames.columns if c != 'gesture'] + features.derived_feature_names(ALL_FEATURES, HANDS)
+    with open(tmp_path / 'means_dict.json', 'w') as f:
+        json.dump({c: float(rng.normal()) for c in columns}, f)
+    with open(tmp_path / 'stds_dict.json', 'w') as f:
+        json.dump({c: float(rng.uniform(0.5, 50)) for c in columns}, f)
+    return Standardizer(f'{tmp_path}/')
+
+
+def reference_X(df, derived_feature_dict, standardizer):
+    """the standardized predictors of a df, in sorted order, computed a row at a time"""
+    derived = pd.DataFrame([reference.get_derived_features(row, derived_feature_dict, HANDS) for _, row in df.iterrows()])
+    df = pd.concat([df.drop(columns=['gesture']).reset_index(drop=True), derived], axis=1)
+    df = reference.standardize(df, standardizer.means_dict, standardizer.stds_dict)
+    return df.reindex(sorted(df.columns), axis=1)
+
+
+def test_derived_features_batch(frames):
+    batch = features.get_derived_features_batch(frames, ALL_FEATURES, HANDS)
+    rows = pd.DataFrame([reference.get_derived_features(row, ALL_FEATURES, HANDS) for _, row in frames.iterrows()])
+    assert list(batch.columns) == list(rows.columns)
+    np.testing.assert_array_equal(batch.to_numpy(), rows.to_numpy())
+    # and a frame at a time
+    single = features.get_derived_features(frames.iloc[5], ALL_FEATURES, HANDS)
+    np.testing.assert_array_equal(np.array(list(single.values())), rows.iloc[5].to_numpy())
+
+
+@pytest.mark.parametrize('n_frames,stride', [(10, None), (7, 3), (25, 1), (60, None)])
+def test_X_y2examples(n_frames, stride):
+    rng = np.random.default_rng(2)
+    y = np.repeat([0, 1, 2, 1, 3], [30, 5, 61, 26, 10])
+    X = rng.normal(size=(len(y), 4))
+    X_old, y_old = reference.X_y2examples(X, y, n_frames=n_frames, stride=stride)
+    X_new, y_new = X_y2examples(X, y, n_frames=n_frames, stride=stride)
+    np.testing.assert_array_equal(y_new, y_old)
+    np.testing.assert_array_equal(X_new.reshape(-1, n_frames, 4), X_old.reshape(-1, n_frames, 4))
+    windows, starts, y_index = X_y2examples(X, y, n_frames=n_frames, stride=stride, as_index=True)
+    np.testing.assert_array_equal(windows[starts].reshape(-1, n_frames, 4), X_old.reshape(-1, n_frames, 4))
+    np.testing.assert_array_equal(y_index, y_old)
+    # without labels, X is just cut into examples
+    np.testing.assert_array_equal(X_y2examples(X, n_frames=n_frames), reference.X_y2examples(X, n_frames=n_frames))
+
+
+def test_mirror(frames, standardizer):
+    # unstandardizing and standardizing again rounds differently to applying a scale and offset, within float64 precision
+    X = reference_X(frames, MIRRORABLE_FEATURES, standardizer)
+    mirrored = mirror_data(frames.drop(columns=['gesture'])).assign(gesture=frames['gesture'])
+    X_mirrored = reference_X(mirrored, MIRRORABLE_FEATURES, standardizer)
+    mirror = Mirror(list(X.columns), standardizer=standardizer, derived_feature_dict=MIRRORABLE_FEATURES)
+    np.testing.assert_allclose(mirror.apply(X.to_numpy()), X_mirrored.to_numpy(), rtol=1e-13, atol=1e-12)
+
+
+def test_X_y2mirrored_examples():
+    rng = np.random.default_rng(5)
+    columns = ['left_palmPosition_0', 'left_palmPosition_1', 'right_palmPosition_0', 'right_palmPosition_1']
+    mirror = Mirror(columns)
+    # recordings of different lengths, one with every row dropped, and one too short for an example
+    lengths = [50, 0, 7, 33]
+    X_y = [(rng.normal(size=(n, 4)), np.repeat([0, 1], [n // 3, n - n // 3]), columns) for n in lengths]
+    for with_mirror in (True, False):
+        X, y = X_y2mirrored_examples(X_y, n_frames=10, mirror=with_mirror, standardize=False, derive_features=False)
+        expected_X, expected_y = [], []
+        for X_contiguous, y_contiguous, _ in X_y:
+            if len(y_contiguous):
+                X_file, y_file = X_y2examples(X_contiguous, y_contiguous, n_frames=10)
+                expected_X += [X_file, mirror.apply(X_file)] if with_mirror else [X_file]
+                expected_y += [y_file] * (2 if with_mirror else 1)
+        np.testing.assert_array_equal(X, np.concatenate(expected_X))
+        np.testing.assert_array_equal(y, np.concatenate(expected_y))
+        assert X.flags.writeable and X.flags.c_contiguous
+    # mirroring in place gives the same as mirroring a copy
+    mirrored = mirror.apply(X)
+    np.testing.assert_array_equal(mirror.apply(X, out=X), mirrored)
+    np.testing.assert_array_equal(X, mirrored)
+    X, y = X_y2mirrored_examples(X_y[1:3], n_frames=10, standardize=False, derive_features=False)
+    assert X.shape == (0, 10, 4) and y.shape == (0,)
+
+
+def test_live_feature_engine(frames, standardizer):
+    derived_feature_dict = {'one_handed': ['finger_palm_distances', 'wrist_angle'], 'two_handed': ['interpalm_angle']}
+    raw = [c for c in frames.columns if c != 'gesture']
+    # frames are decoded in an order of their own, and the model uses only some of the raw variables
+    columns = list(np.random.default_rng(3).permutation(raw)) + ['timestamp']
+    predictors = [c for c in raw if 'palmNormal' in c or 'tipPosition_1' in c] + \
+        features.derived_feature_names(derived_feature_dict, HANDS)
+    engine = features.LiveFeatureEngine(columns, predictors, derived_feature_dict, standardizer, HANDS)
+    with_fingers = dict(derived_feature_dict, one_handed=derived_feature_dict['one_handed'] + ['adjacent_finger_distances'])
+    previous = None
+    for i, row in frames.drop(columns=['gesture']).iterrows():
+        model_input = engine.process(row.reindex(columns).to_numpy(dtype=np.float64))
+        current = dict(row, **reference.get_derived_features(row, with_fingers, HANDS))
+        expected = [(current[p] - standardizer.means_dict[p]) / standardizer.stds_dict[p] for p in sorted(predictors)]
+        np.testing.assert_array_equal(model_input, expected)
+        assert engine.raw_fury == reference.get_fury2(current, previous if previous is not None else current)
+        previous = current
+    # a copy starts from scratch, without disturbing the original
+    copy = engine.copy()
+    raw_fury = engine.raw_fury
+    first = frames.drop(columns=['gesture']).iloc[0].reindex(columns).to_numpy(dtype=np.float64)
+    copy.process(first)
+    assert engine.raw_fury == raw_fury
+    assert copy.raw_fury == reference.get_fury2(*[dict(frames.iloc[0], **reference.get_derived_features(
+        frames.iloc[0], with_fingers, HANDS))] * 2)
+
+
+def test_hand_order(frames, monkeypatch):
+    # palm_velocity is the same feature for either hand, so hands must be taken in the same order in training and live
+    monkeypatch.setattr(data_methods, 'get_derived_feature_dict', lambda *args, **kwargs: ALL_FEATURES)
+    g2idx = {'no_gesture': 0, 'wave': 1, 'fist': 2}
+    X, y, columns = df2X_y(frames, g2idx, hands=['right', 'left'], standardize=False, return_columns=True)
+    X_other, y_other, columns_other = df2X_y(frames, g2idx, hands=['left', 'right'], standardize=False,
+        return_columns=True)
+    assert columns_other == columns
+    np.testing.assert_array_equal(X_other, X)
+    np.testing.assert_array_equal(y_other, y)
+    velocity = frames[[f'right_palmVelocity_{j}' for j in (0,1,2)]].to_numpy()
+    np.testing.assert_allclose(X[:, columns.index('palm_velocity')], np.linalg.norm(velocity, axis=1), rtol=1e-14)
+    raw = [c for c in frames.columns if c != 'gesture']
+    for hands in (['left', 'right'], ['right', 'left']):
+        engine = features.LiveFeatureEngine(raw, columns, ALL_FEATURES, None, hands)
+        live = np.stack([engine.process(row) for row in frames[raw].to_numpy(dtype=np.float64)])
+        np.testing.assert_allclose(live, X, rtol=1e-12)
+
+
+@pytest.mark.parametrize('hands', [['left', 'right'], ['right', 'left'], ['left'], ['right']])
+@pytest.mark.parametrize('feature', sorted(features.FEATURES))
+def test_live_feature_engine_each_feature(frames, feature, hands):
+    # each registered feature on its own, so that a feature the engine compiles wrongly can't hide behind the others
+    two_handed = features.FEATURES[feature]['two_handed']
+    if two_handed and len(hands) == 1:
+        pytest.skip('two handed features need both hands')
+    derived_feature_dict = {'one_handed': [] if two_handed else [feature], 'two_handed': [feature] if two_handed else []}
+    # only the hands' own columns, as decoded for a model of those hands
+    raw = [c for c in frames.columns if c.split('_')[0] in hands]
+    predictors = features.derived_feature_names(derived_feature_dict, hands)
+    engine = features.LiveFeatureEngine(raw, predictors, derived_feature_dict, None, hands)
+    with_fingers = dict(derived_feature_dict, one_handed=derived_feature_dict['one_handed'] + ['adjacent_finger_distances'])
+    previous = None
+    for _, row in frames[raw].iloc[:20].iterrows():
+        model_input = engine.process(row.to_numpy(dtype=np.float64))
+        current = dict(row, **reference.get_derived_features(row, with_fingers, features.ordered_hands(hands)))
+        np.testing.assert_array_equal(model_input, [current[p] for p in sorted(predictors)])
+        # fury from the hands in the frame
+        previous = previous or current
+        fur1 = max(abs(current[f'{hand}_palmVelocity_{i}']) for i in (0,1,2) for hand in hands) / 1500
+        fur2 = max(abs(current[f'{hand}_f{i}_{i+1}'] - previous[f'{hand}_f{i}_{i+1}']) for i in (1,2,3,4) for hand in hands) / 60
+        assert engine.raw_fury == max(min(fur1, 1), min(fur2, 1))
+        previous = current
+
+
+def test_live_feature_engine_missing_hand(frames):
+    # a hand missing from a frame gives nan for its features, and for between hand features, as in training
+    derived_feature_dict = ALL_FEATURES
+    raw = [c for c in frames.columns if c != 'gesture']
+    predictors = raw + features.derived_feature_names(derived_feature_dict, HANDS)
+    engine = features.LiveFeatureEngine(raw, predictors, derived_feature_dict, None, HANDS)
+    for missing in HANDS:
+        row = frames[raw].iloc[3].copy()
+        row[[c for c in raw if c.startswith(missing)]] = np.nan
+        model_input = engine.process(row.to_numpy(dtype=np.float64))
+        current = dict(row, **reference.get_derived_features(row, derived_feature_dict, HANDS))
+        np.testing.assert_array_equal(model_input, [current[p] for p in sorted(predictors)])
+        present = [p for p in sorted(predictors) if p.startswith(next(h for h in HANDS if h != missing))]
+        assert not np.isnan(model_input[[sorted(predictors).index(p) for p in present]]).any()
+
+
+@pytest.mark.parametrize('bidirectional', [True, False])
+def test_numpy_model(bidirectional):
+    pytest.importorskip('tensorflow')
+    models = pytest.importorskip('src.models')
+    keras_model = models.many2one_model(n_gestures=6, n_frames=12, n_features=9, rnn_units=5,
+        bidirectional=bidirectional)
+    rng = np.random.default_rng(4)
+    keras_model.set_weights([rng.normal(scale=0.5, size=w.shape) for w in keras_model.get_weights()])
+    X = rng.normal(size=(16, 12, 9)).astype(np.float32)
+    model = NumpyModel.from_keras(keras_model)
+    expected = keras_model.predict(X, verbose=0)
+    np.testing.assert_allclose(model.predict(X), expected, atol=1e-5)
+    if not bidirectional:
+        # a frame at a time, the final prediction is that for the whole window
+        states = model.initial_states()
+        for frame in X[0]:
+            prediction, states = model.step(frame, states)
+        np.testing.assert_allclose(prediction, expected[0], atol=1e-5)
+
+
+@pytest.mark.parametrize('backend', ['numpy', 'keras'])
+def test_streaming_predictor(backend):
+    rng = np.random.default_rng(5)
+    units, n_features = 5, 9
+    layers = [
+        ('LSTM', {'units': units},
+            [rng.normal(scale=0.5, size=s) for s in [(n_features, 4 * units), (units, 4 * units), (4 * units,)]]),
+        ('Dense', {'activation': 'softmax'}, [rng.normal(size=(units, 6)), rng.normal(size=6)]),
+    ]
+    numpy_model = NumpyModel(layers, (None, 12, n_features))
+    model = numpy_model
+    if backend == 'keras':
+        pytest.importorskip('tensorflow')
+        pytest.importorskip('src.models')
+        model = numpy_model.to_keras()
+    frames = rng.normal(size=(40, n_features)).astype(np.float32)
+    streamer = StreamingPredictor(model, max_gap=None)
+    streamed = np.stack([streamer.update(frame) for frame in frames])
+    # each prediction is model.predict's for the window of the last 12 frames, or of the frames so far
+    windows = [frames[max(0, n - 11):n + 1] for n in range(len(frames))]
+    expected = np.concatenate([numpy_model.predict(window[np.newaxis]) for window in windows])
+    np.testing.assert_allclose(expected[11:], model.predict(np.stack(windows[11:]), verbose=0), atol=1e-5)
+    np.testing.assert_allclose(streamed, expected, atol=1e-5)
+    # frames stopping for longer than max_gap start it all again
+    streamer = StreamingPredictor(model, max_gap=0.5)
+    for k, frame in enumerate(frames[:30]):
+        streamer.update(frame, timestamp=k * 10000)
+    np.testing.assert_allclose(streamer.update(frames[30], timestamp=10**6),
+        numpy_model.predict(frames[np.newaxis, 30:31])[0], atol=1e-5)
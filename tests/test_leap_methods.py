@@ -0,0 +1,175 @@
+import numpy as np
+import pytest
+from leap_frames import DEVICE, make_frame
+import src.leap_methods as leap_methods
+from src.leap_methods import FrameDecoder, pack_frame, unpack_frame, peek_timestamp
+
+
+def numeric_columns(packed_frame):
+    """the columns of a packed frame that a FrameDecoder can decode, i.e. those read from the frame itself"""
+    return [c for c, v in packed_frame.items() if type(v) in (int, float, bool) and c not in ('device_index', 'device_mode')]
+
+
+@pytest.fixture
+def frame():
+    return make_frame(np.random.default_rng(0))
+
+
+def test_frame_decoder_matches_pack_frame(frame):
+    packed = pack_frame(frame, 0, DEVICE)
+    columns = numeric_columns(packed)
+    decoder = FrameDecoder(columns)
+    assert decoder.decode(frame) == 2
+    np.testing.assert_array_equal(decoder.values, [packed[c] for c in columns])
+    np.testing.assert_array_equal(decoder.hands_present, [True, True])
+    # a frame rebuilt from its packed form decodes, and packs, the same
+    rebuilt = unpack_frame(packed)
+    assert pack_frame(rebuilt, 0, DEVICE) == packed
+    values, _ = decoder.unpack(rebuilt)
+    np.testing.assert_array_equal(values, [packed[c] for c in columns])
+
+
+def test_frame_decoder_missing_hands(frame):
+    columns = numeric_columns(pack_frame(frame, 0, DEVICE))
+    decoder = FrameDecoder(columns)
+    right_only = make_frame(np.random.default_rng(1), hands=('right',))
+    packed = pack_frame(right_only, 0, DEVICE)
+    assert decoder.decode(right_only) == 1
+    np.testing.assert_array_equal(decoder.hands_present, [False, True])
+    np.testing.assert_array_equal(decoder.values, [packed.get(c, np.nan) for c in columns])
+    assert np.isnan(decoder.values[[c.startswith('left') for c in columns]]).all()
+    # nothing is left over from the previous frame
+    assert decoder.unpack(make_frame(np.random.default_rng(2), hands=())) is None
+    # hands the decoder has no columns for aren't counted
+    right_decoder = FrameDecoder([c for c in columns if not c.startswith('left')], hands=['right'])
+    assert right_decoder.decode(frame) == 1
+    with pytest.raises(ValueError):
+        FrameDecoder(columns, hands=['right'])
+
+
+def test_frame_decoder_missing_fields(frame):
+    columns = numeric_columns(pack_frame(frame, 0, DEVICE))
+    del frame['currentFrameRate']
+    del frame['hands'][0]['palmVelocity']
+    del frame['pointables'][7]['bases']
+    packed = pack_frame(frame, 0, DEVICE)
+    decoder = FrameDecoder(columns)
+    decoder.decode(frame)
+    missing = [c not in packed for c in columns]
+    assert sum(missing) == 1 + 3 + 36
+    assert np.isnan(decoder.values[missing]).all()
+    np.testing.assert_array_equal(decoder.values[~np.array(missing)], [packed[c] for c in columns if c in packed])
+    # as in a row of a recording, with nan for the fields that were missing
+    row = {c: packed.get(c, np.nan) for c in columns}
+    values, _ = decoder.unpack(unpack_frame(row))
+    np.testing.assert_array_equal(values, decoder.values)
+    # a hand without an id is still decoded, but its fingers can't be told apart from the other hand's
+    del frame['hands'][1]['id']
+    assert decoder.decode(frame) == 2
+    right_fingers = [c.startswith('right') and c.split('_')[1] in leap_methods.FINGERS for c in columns]
+    assert np.isnan(decoder.values[right_fingers]).all()
+    np.testing.assert_array_equal(decoder.values[~np.array(right_fingers)],
+        [np.nan if c == 'right_id' else packed.get(c, np.nan) for c, finger in zip(columns, right_fingers) if not finger])
+
+
+def test_peek_timestamp():
+    assert peek_timestamp('{"currentFrameRate":110.5,"id":7,"timestamp":123456789,"hands":[]}') == 123456789
+    assert peek_timestamp('{"timestamp":42}') == 42
+    assert peek_timestamp('{"event":{"type":"deviceEvent"}}') is None
+    # truncated
+    assert peek_timestamp('{"timestamp":1') is None
+
+
+#### FrameMerger, fed frames directly rather than from devices, on a clock that only moves when told to
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def merger(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(leap_methods, 'time', clock)
+    monkeypatch.setattr(leap_methods.config, 'devices', [DEVICE, DEVICE])
+    merger = leap_methods.FrameMerger({}, tolerance=3000, max_wait=0.1, maxlen=100)
+    merger.clock = clock
+    return merger
+
+
+def send(merger, device, timestamp):
+    """a frame from a device, as its reader would store it"""
+    merger.readers[device]._put({'device_index': device, 'timestamp': timestamp})
+
+
+def test_frame_merger_aligns_devices(merger):
+    # each device counts from its own origin, and frames from device 1 arrive up to 2ms late
+    rng = np.random.default_rng(0)
+    groups = []
+    for k in range(50):
+        merger.clock.now = 1000 + k * 0.01
+        send(merger, 0, 10**6 + k * 10000)
+        merger.clock.now += rng.uniform(0, 0.002)
+        send(merger, 1, 7 * 10**9 + 500 + k * 10000)
+        group = merger.get(timeout=0)
+        if group is not None:
+            groups.append(group)
+    assert sum(len(group) for group in groups) == 100
+    # once the clocks have been matched, every frame is grouped with the other device's frame taken with it
+    assert all(len(group) == 2 for group in groups[1:])
+    for group in groups[1:]:
+        first, second = sorted(group, key=lambda f: f['device_index'])
+        assert second['timestamp'] - 7 * 10**9 - 500 == first['timestamp'] - 10**6
+        assert first['aligned_timestamp'] == second['aligned_timestamp']
+    aligned = [group[0]['aligned_timestamp'] for group in groups]
+    assert aligned == sorted(aligned)
+
+
+def test_frame_merger_device_stops(merger):
+    for k in range(5):
+        merger.clock.now = 1000 + k * 0.01
+        send(merger, 0, k * 10000)
+        send(merger, 1, k * 10000)
+        assert len(merger.get(timeout=0)) == 2
+    # device 1 stops sending: device 0's frame waits for it, then is returned on its own
+    merger.clock.now += 0.01
+    send(merger, 0, 50000)
+    assert merger.get(timeout=0) is None
+    merger.clock.now += 0.05
+    assert merger.get(timeout=0) is None
+    merger.clock.now += 0.1
+    group = merger.get(timeout=0)
+    assert [f['timestamp'] for f in group] == [50000]
+
+
+def test_frame_merger_late_device(merger):
+    # frames from device 1 arrive in a burst, after later frames from device 0
+    for k in range(5):
+        merger.clock.now = 1000 + k * 0.01
+        send(merger, 0, k * 10000)
+        send(merger, 1, k * 10000)
+        assert len(merger.get(timeout=0)) == 2
+    for k in range(5, 9):
+        merger.clock.now = 1000 + k * 0.01
+        send(merger, 0, k * 10000)
+        assert merger.get(timeout=0) is None
+    for k in range(5, 9):
+        send(merger, 1, k * 10000)
+    groups = [merger.get(timeout=0) for _ in range(4)]
+    assert [sorted(f['timestamp'] for f in group) for group in groups] == [[k * 10000] * 2 for k in range(5, 9)]
+    assert merger.get(timeout=0) is None
+
+
+def test_unpack_frame_partial_vectors(frame):
+    # a row of a recording with only some elements of a vector, e.g. a damaged row
+    packed = pack_frame(frame, 0, DEVICE)
+    columns = numeric_columns(packed)
+    row = dict(packed, right_palmVelocity_0=np.nan, right_palmVelocity_2=np.nan, left_index_bases_0=np.nan,
+        left_index_bases_13=np.nan)
+    rebuilt = unpack_frame(row)
+    assert rebuilt['hands'][1]['palmVelocity'] == [None, packed['right_palmVelocity_1']]
+    values, _ = FrameDecoder(columns).unpack(rebuilt)
+    np.testing.assert_array_equal(values, [row[c] for c in columns])
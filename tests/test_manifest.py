@@ -0,0 +1,95 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import pytest
+import src.manifest as manifest_module
+from src.manifest import update_manifest, summarize_recording, gesture_counts, BalancedSampler, MANIFEST_NAME
+from src.data_methods import file2X_y, X_y2examples
+
+G2IDX = {'no_gesture': 0, 'wave': 1}
+
+
+def test_update_manifest(workdir, capsys):
+    manifest = update_manifest('recordings/')
+    assert sorted(manifest) == ['a.csv', 'a.lrec']
+    assert 'indexing a.csv' in capsys.readouterr().out
+    df = pd.read_csv('recordings/a.csv')
+    entry = manifest['a.csv']
+    assert entry['frames'] == len(df) == 230
+    assert entry['runs'] == [[0, 101, 'no_gesture'], [101, 230, 'wave']]
+    assert entry['fps'] == pytest.approx(df['currentFrameRate'].mean())
+    assert entry['hands'] == {'left': pytest.approx(df['left_id'].notna().mean()), 'right': 1.0}
+    # read a chunk at a time, runs carry on from one chunk to the next
+    assert summarize_recording('recordings/a.csv', chunksize=17)['runs'] == entry['runs']
+    # the archive is read the same way, and its frame rate is float32
+    assert manifest['a.lrec']['runs'] == entry['runs']
+    assert manifest['a.lrec']['fps'] == pytest.approx(pd.read_csv('a.csv')['currentFrameRate'].mean(), rel=1e-6)
+    with open(os.path.join('recordings', MANIFEST_NAME)) as f:
+        assert json.load(f) == manifest
+    # only recordings that are new or have changed are read again, and those that have gone are dropped
+    assert update_manifest('recordings/') == manifest
+    assert 'indexing' not in capsys.readouterr().out
+    df.loc[df.index > 200, 'gesture'] = 'no_gesture'
+    df.to_csv('recordings/b.csv', index=False)
+    df.iloc[:150].to_csv('recordings/a.csv', index=False)
+    os.rename('recordings/a.lrec', 'a.lrec')
+    manifest = update_manifest('recordings/')
+    assert sorted(manifest) == ['a.csv', 'b.csv']
+    assert capsys.readouterr().out.count('indexing') == 2
+    assert manifest['a.csv']['runs'] == [[0, 101, 'no_gesture'], [101, 150, 'wave']]
+    assert manifest['b.csv']['runs'] == [[0, 101, 'no_gesture'], [101, 201, 'wave'], [201, 230, 'no_gesture']]
+
+
+def test_gesture_counts():
+    manifest = {
+        'a.csv': {'fps': 100.0, 'runs': [[0, 1000, 'no_gesture'], [1000, 1100, 'wave'], [1100, 1500, 'no_gesture']]},
+        'b.csv': {'fps': None, 'runs': [[0, 30, 'wave']]},
+    }
+    assert gesture_counts(manifest) == {'no_gesture': 1400, 'wave': 130}
+    # without resampling, e.g. (1000 - 10) // 5 + 1 examples of 10 frames in a run of 1000
+    assert gesture_counts(manifest, n_frames=10) == {'no_gesture': 199 + 79, 'wave': 19 + 5}
+    # at 25fps, a quarter of the frames of a.csv are kept, b.csv has no frame rate so all of its are
+    assert gesture_counts(manifest, n_frames=10, target_fps=25) == {'no_gesture': 49 + 19, 'wave': 4 + 5}
+    assert gesture_counts(manifest, n_frames=10, target_fps=25, stride=1) == {'no_gesture': 241 + 91, 'wave': 16 + 21}
+
+
+def test_gesture_counts_matches_examples(workdir):
+    manifest = update_manifest('recordings/')
+    counts = gesture_counts({'a.csv': manifest['a.csv']}, n_frames=10, target_fps=25)
+    _, y = X_y2examples(*file2X_y('recordings/a.csv', target_fps=25, g2idx=G2IDX)[:2], n_frames=10)
+    # roughly, as frames lost to a missing hand (here the left, at the start) aren't known from the manifest
+    assert abs(counts['wave'] - np.sum(y == 1)) <= 1
+    assert counts['no_gesture'] >= np.sum(y == 0)
+
+
+def test_balanced_sampler(workdir, monkeypatch):
+    reads = []
+    CSV2VoI = manifest_module.CSV2VoI
+    def counting_CSV2VoI(raw_file, **kwargs):
+        reads.append((raw_file, kwargs['rows']))
+        return CSV2VoI(raw_file=raw_file, **kwargs)
+    monkeypatch.setattr(manifest_module, 'CSV2VoI', counting_CSV2VoI)
+    sampler = BalancedSampler(folders=['recordings/'], g2idx=G2IDX, n_frames=5, target_fps=25, seed=0,
+        standardize=False, block_rows=50)
+    X, y = sampler.sample(batch_size=200)
+    assert X.shape[:2] == (200, 5) and sorted(set(y)) == [0, 1]
+    assert 0.35 < y.mean() < 0.65
+    # each block of each run is read and processed once, however many examples are drawn from it
+    assert len(reads) == len(set(reads)) == len(sampler._blocks)
+    # examples are windows of a single gesture, as folder2examples would take with a stride of 1
+    windows = {}
+    for name in ('a.csv', 'a.lrec'):
+        X_file, y_file = X_y2examples(*file2X_y(os.path.join('recordings', name), target_fps=25, g2idx=G2IDX,
+            standardize=False)[:2], n_frames=5, stride=1)
+        windows.update({example.tobytes(): label for example, label in zip(X_file, y_file)})
+    # though rows read from part way through a recording may be resampled on a different grid, so not all the same
+    matched = [windows.get(example.tobytes()) == label for example, label in zip(X, y)]
+    assert np.mean(matched) > 0.2
+    # beyond cache_bytes, the least recently used blocks are dropped, and read again if needed
+    reads.clear()
+    sampler = BalancedSampler(folders=['recordings/'], g2idx=G2IDX, n_frames=5, target_fps=25, seed=0,
+        standardize=False, block_rows=50, cache_bytes=0)
+    sampler.sample(batch_size=50)
+    assert len(sampler._blocks) == 1
+    assert len(reads) > len(set(reads))
@@ -0,0 +1,127 @@
+import io
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from leap_frames import make_recording
+import src.recording as recording
+from src.recording import StreamingRecorder, write_part, merge_parts, csv2archive, read_archive, archive_columns
+from src.data_methods import CSV2VoI
+
+
+@pytest.fixture
+def frames():
+    return make_recording(np.random.default_rng(0))
+
+
+def as_csv(frames):
+    """frames as they would be read back, had they been written in one go"""
+    return pd.read_csv(io.StringIO(pd.DataFrame(frames).to_csv(index=False)))
+
+
+def test_streaming_recorder_round_trip(tmp_path, frames):
+    parts_dir = str(tmp_path / 'parts')
+    recorder = StreamingRecorder(parts_dir, chunk_size=50, flush_interval=60)
+    for packed in frames:
+        recorder.add(packed)
+    recorder.close()
+    assert recorder.n_frames == 230 and recorder.n_parts == 5
+    assert sorted(os.listdir(parts_dir)) == [f'part_{i:06d}.csv' for i in range(5)]
+    # the first parts have no columns for the left hand
+    assert not any(c.startswith('left') for c in pd.read_csv(os.path.join(parts_dir, 'part_000000.csv'), nrows=0).columns)
+    path = merge_parts(parts_dir, str(tmp_path / 'recording.csv'))
+    assert not os.path.exists(parts_dir)
+    pd.testing.assert_frame_equal(pd.read_csv(path), as_csv(frames))
+
+
+def test_streaming_recorder_close_merges(tmp_path, frames):
+    recorder = StreamingRecorder(str(tmp_path / 'parts'), chunk_size=1000, flush_interval=60)
+    for packed in frames[:70]:
+        recorder.add(packed)
+    recorder.close(path=str(tmp_path / 'recording.csv'))
+    assert recorder.n_parts == 1
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / 'recording.csv'), as_csv(frames[:70]))
+
+
+def test_crash_mid_part(tmp_path, frames, monkeypatch):
+    # parts written before a crash are complete, and the part being written when it happened is left as a .tmp
+    parts_dir = tmp_path / 'parts'
+    parts_dir.mkdir()
+    for i in range(3):
+        write_part(pd.DataFrame(frames[i * 50:(i + 1) * 50]), str(parts_dir / f'part_{i:06d}.csv'))
+    def crash(src, dst):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(recording.os, 'replace', crash)
+    with pytest.raises(KeyboardInterrupt):
+        write_part(pd.DataFrame(frames[150:200]), str(parts_dir / 'part_000003.csv'))
+    monkeypatch.undo()
+    assert sorted(os.listdir(parts_dir)) == [f'part_{i:06d}.csv' for i in range(3)] + ['part_000003.csv.tmp']
+    # a half written .tmp, as if the crash had come part way through writing it
+    with open(parts_dir / 'part_000003.csv.tmp', 'r+') as f:
+        f.truncate(1000)
+    path = merge_parts(str(parts_dir), str(tmp_path / 'recording.csv'))
+    pd.testing.assert_frame_equal(pd.read_csv(path), as_csv(frames[:150]))
+    assert not os.path.exists(parts_dir)
+
+
+def test_streaming_recorder_write_error(tmp_path, frames, monkeypatch):
+    def fail(df, path):
+        raise OSError('disk full')
+    monkeypatch.setattr(recording, 'write_part', fail)
+    recorder = StreamingRecorder(str(tmp_path / 'parts'), chunk_size=10, flush_interval=60)
+    for packed in frames[:10]:
+        recorder.add(packed)
+    # the writer's error is raised in the recording thread
+    with pytest.raises(OSError, match='disk full'):
+        recorder.close()
+
+
+#### recording archives, which must read back as the CSV they were made from, to float32
+
+@pytest.fixture
+def recording_csv(tmp_path, frames):
+    path = str(tmp_path / 'recording.csv')
+    pd.DataFrame(frames).to_csv(path, index=False)
+    return path
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_archive_round_trip(recording_csv, compress):
+    path = csv2archive(recording_csv, chunk_rows=64, compress=compress)
+    assert path.endswith('recording.lrec')
+    csv = pd.read_csv(recording_csv)
+    assert archive_columns(path) == list(csv.columns)
+    archive = read_archive(path)
+    assert list(archive.columns) == list(csv.columns)
+    for c in csv.columns:
+        if c == 'timestamp':
+            np.testing.assert_array_equal(archive[c], csv[c])
+        elif pd.api.types.is_numeric_dtype(csv[c]) or pd.api.types.is_bool_dtype(csv[c]):
+            np.testing.assert_array_equal(archive[c], csv[c].to_numpy(dtype=np.float32, na_value=np.nan), err_msg=c)
+        elif archive[c].dtype == np.float32:
+            # booleans with missing values, e.g. the fingers of a hand that isn't always there
+            np.testing.assert_array_equal(archive[c], csv[c].map({True: 1.0, False: 0.0}), err_msg=c)
+        else:
+            # strings, e.g. gesture and device_mode, with missing values kept missing
+            pd.testing.assert_series_equal(archive[c], csv[c])
+    # only the rows, times and columns asked for
+    columns = ['gesture', 'timestamp', 'left_palmVelocity_0', 'not_a_column']
+    subset = read_archive(path, columns=columns, rows=(50, 150))
+    assert list(subset.columns) == columns[:3]
+    pd.testing.assert_frame_equal(subset, archive[columns[:3]].iloc[50:150].reset_index(drop=True))
+    start, end = csv['timestamp'][70], csv['timestamp'][200]
+    subset = read_archive(path, columns=columns, time_range=(start, end))
+    pd.testing.assert_frame_equal(subset, archive[columns[:3]].iloc[70:200].reset_index(drop=True))
+    assert len(read_archive(path, time_range=(0, 1))) == 0
+
+
+def test_archive_matches_csv_path(recording_csv, monkeypatch):
+    # CSV2VoI reads the CSV as float32 too, so both give exactly the same VoI
+    monkeypatch.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    path = csv2archive(recording_csv, chunk_rows=64)
+    from_csv = CSV2VoI(recording_csv)
+    from_archive = CSV2VoI(path)
+    assert list(from_archive.columns) == list(from_csv.columns)
+    pd.testing.assert_frame_equal(from_archive, from_csv)
+    for rows in [(0, 100), (37, 230)]:
+        pd.testing.assert_frame_equal(CSV2VoI(path, rows=rows), CSV2VoI(recording_csv, rows=rows))
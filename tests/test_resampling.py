@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from src.resampling import FrameResampler, resample_mask
+
+
+def kept(resampler, timestamps):
+    return [t for t in timestamps if resampler.accept(t)]
+
+
+@pytest.mark.parametrize('device_fps,target_fps', [(100, 25), (115, 25), (120, 5), (60, 25)])
+def test_frame_resampler_rate(device_fps, target_fps):
+    # 20s of frames, timestamps in microseconds, jittered by up to a third of a frame
+    rng = np.random.default_rng(0)
+    n = 20 * device_fps
+    timestamps = np.cumsum(1e6 / device_fps * rng.uniform(2/3, 4/3, size=n)).astype(np.int64) + 10**9
+    timestamps = kept(FrameResampler(target_fps), timestamps.tolist())
+    duration = (timestamps[-1] - timestamps[0]) / 1e6
+    # frames stay on the grid, so the average rate is the target
+    assert len(timestamps) - 1 == pytest.approx(duration * target_fps, abs=2)
+    # frames are taken at the first frame of each tick, so are never much closer together than a tick
+    assert np.diff(timestamps).min() >= max(1e6 / target_fps - 4/3 * 1e6 / device_fps, 1)
+
+
+def test_frame_resampler_grid():
+    resampler = FrameResampler(25)
+    # the first frame is always kept, and starts the grid
+    assert kept(resampler, [1000, 20000, 40000, 41000, 80000, 81000, 120000, 121500]) == [1000, 41000, 81000, 121500]
+    # a gap of more than a period starts a new grid
+    assert kept(resampler, [500000, 510000, 540000]) == [500000, 540000]
+    # as do timestamps that have restarted, e.g. a device reconnecting
+    assert kept(resampler, [3000, 30000, 43000]) == [3000, 43000]
+    resampler.reset()
+    assert resampler.accept(43001)
+    # None keeps every frame
+    assert kept(FrameResampler(None), [5, 5, 6]) == [5, 5, 6]
+
+
+@pytest.mark.parametrize('target_fps,max_step', [(25, 15000), (30, 15000), (7, 15000), (25, 90000)])
+def test_resample_mask(target_fps, max_step):
+    rng = np.random.default_rng(1)
+    # frames up to max_step apart, so with gaps of more than a period when it is large
+    timestamps = np.cumsum(rng.integers(5000, max_step, size=3000)) + 10**6
+    # two devices, each with its own clock, and a restart part way through the second's
+    groups = rng.integers(0, 2, size=len(timestamps))
+    timestamps[groups == 1] += 7 * 10**9
+    timestamps[(groups == 1) & (np.arange(len(timestamps)) > 2000)] -= 7 * 10**9
+    resamplers = {}
+    expected = [resamplers.setdefault(g, FrameResampler(target_fps)).accept(t) for t, g in zip(timestamps, groups)]
+    np.testing.assert_array_equal(resample_mask(timestamps, target_fps, groups=groups), expected)
+    # chunks resampled one after another, with the same resamplers, are resampled as one
+    resamplers = {}
+    chunks = [resample_mask(timestamps[i:i + 700], target_fps, groups=groups[i:i + 700], resamplers=resamplers)
+        for i in range(0, len(timestamps), 700)]
+    np.testing.assert_array_equal(np.concatenate(chunks), expected)
+    assert resample_mask(timestamps[:0], 25).shape == (0,)
+    np.testing.assert_array_equal(resample_mask(timestamps, None), True)
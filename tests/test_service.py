@@ -0,0 +1,199 @@
+import os
+import json
+import queue
+import numpy as np
+import pytest
+from leap_frames import make_recording
+from src.leap_methods import unpack_frame
+from src.inference import NumpyModel
+from src.data_methods import get_gestures
+import src.service as service
+from src.service import PredictionPipeline, PredictionSession, worker
+
+MODEL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models', 'prediction_model', '')
+
+
+class StubModel(NumpyModel):
+    """a small bidirectional model, with random weights, taking the prediction model's input, which remembers the size
+    of every batch it's asked to predict, and can be made to fail"""
+    def __init__(self, seed=0, fail=False):
+        rng = np.random.default_rng(seed)
+        n_features = 50
+        n_gestures = len(get_gestures(version='prediction', path=MODEL)[2])
+        lstm = [rng.normal(scale=0.1, size=s) for s in [(n_features, 16), (4, 16), (16,)]]
+        super().__init__([
+            ('Bidirectional', {'layer': {'class_name': 'LSTM', 'config': {'units': 4}}}, lstm + lstm),
+            ('Dense', {'activation': 'softmax'}, [rng.normal(size=(8, n_gestures)), rng.normal(size=n_gestures)]),
+        ], (None, 10, n_features), name='stub')
+        self.fail = fail
+        self.batches = []
+
+    def predict(self, x, **kwargs):
+        self.batches.append(len(x))
+        if self.fail:
+            raise MemoryError('out of memory')
+        return super().predict(x)
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    model = StubModel()
+    monkeypatch.setattr(service, 'load_prediction_model', lambda path, backend: model)
+    return model
+
+
+def messages(seed):
+    """the frames of a recording, as a device sends them"""
+    return [json.dumps(unpack_frame(packed)) for packed in make_recording(np.random.default_rng(seed))]
+
+
+def run_worker(inbox_messages, **kwargs):
+    """runs a worker on messages until it has handled them all, returning what it gave each session"""
+    inbox, outbox = queue.Queue(), queue.Queue()
+    for message in inbox_messages + [None]:
+        inbox.put(message)
+    worker(inbox, outbox, model_path=MODEL, **kwargs)
+    results = {}
+    assert outbox.get() == (None, 'ready')
+    while not outbox.empty():
+        session_id, text = outbox.get()
+        results.setdefault(session_id, []).append(json.loads(text))
+    return results
+
+
+def replay(session, texts, model):
+    """the results a session gives on its own, predicting each window as it's due"""
+    results = []
+    for text in texts:
+        result, window = session.receive(text)
+        if window is not None:
+            session.predicted(model.predict(window[np.newaxis])[0], result)
+        if result is not None:
+            results.append(result)
+    return results
+
+
+def assert_results_equal(results, expected):
+    assert len(results) == len(expected)
+    for result, expected_result in zip(results, expected):
+        assert sorted(result) == sorted(expected_result)
+        for key, value in expected_result.items():
+            assert result[key] == (value if isinstance(value, (str, bool)) or value is None else pytest.approx(value))
+
+
+def test_worker_batches(stub):
+    # the frames of every session are sent at the same rate, so they're all due a prediction at the same time
+    texts = {session_id: messages(session_id) for session_id in range(3)}
+    inbox_messages = [('open', session_id, None) for session_id in texts]
+    for frame in zip(*texts.values()):
+        inbox_messages += list(zip(texts, frame))
+    results = run_worker(inbox_messages)
+    predictions = [result for result in results[0] if result['predicted']]
+    assert len(predictions) > 1
+    # each time, the windows of every session are predicted together
+    assert stub.batches == [3] * len(predictions)
+    pipeline = PredictionPipeline(MODEL)
+    for session_id, session_texts in texts.items():
+        assert_results_equal(results[session_id], replay(PredictionSession(pipeline), session_texts, StubModel()))
+
+
+#### what a session, a worker and the service do when things go wrong
+
+def test_session_malformed_messages(stub):
+    session = PredictionSession(PredictionPipeline(MODEL))
+    texts = messages(0)
+    for text, error in [('{"timestamp": 1', ValueError), ('{"timestamp": "x", "hands": []}', ValueError),
+            ('{"timestamp": 5, "features": [0.0, 1.0]}', ValueError), ('{"settings": {"fury": 1}}', ValueError)]:
+        with pytest.raises(error):
+            session.receive(text)
+    # the session carries on just as if they had never been sent
+    assert_results_equal(replay(session, texts, stub), replay(PredictionSession(PredictionPipeline(MODEL)), texts, stub))
+
+
+def test_worker_malformed_message(stub):
+    texts = messages(0)
+    inbox_messages = [('open', 0, None), ('open', 1, None), (0, '{"timestamp": "x",'), (0, 'null')]
+    inbox_messages += [(session_id, text) for text in texts for session_id in (0, 1)]
+    results = run_worker(inbox_messages)
+    # each bad message gives its session an error, and only its session
+    errors = [result['error'] for result in results[0] if 'error' in result]
+    assert len(errors) == 2 and errors[0].startswith('ValueError')
+    assert not any('error' in result for result in results[1])
+    assert_results_equal([result for result in results[0] if 'error' not in result], results[1])
+
+
+def test_worker_failed_prediction(stub):
+    stub.fail = True
+    texts = messages(0)
+    results = run_worker([('open', 0, None), ('open', 1, None)] +
+        [(session_id, text) for text in texts for session_id in (0, 1)])
+    expected = replay(PredictionSession(PredictionPipeline(MODEL)), texts, StubModel())
+    n_predictions = sum(result['predicted'] for result in expected)
+    assert n_predictions > 0 and len(stub.batches) == n_predictions
+    for session_id in (0, 1):
+        # every session due the prediction is told it failed, in place of the frame's result
+        errors = [result['error'] for result in results[session_id] if 'error' in result]
+        assert errors == ['MemoryError: out of memory'] * n_predictions
+        # and the sessions carry on, just without the predictions
+        others = [result for result in results[session_id] if 'error' not in result]
+        assert len(others) == len(expected) - n_predictions
+        assert not any(result['predicted'] for result in others)
+        assert [result['fury'] for result in others] == \
+            pytest.approx([result['fury'] for result in expected if not result['predicted']])
+
+
+@pytest.fixture
+def stub_model_path(tmp_path, monkeypatch):
+    """a model folder for the stub model, for worker processes to load, which can also import a config"""
+    path = tmp_path / 'stub_model'
+    path.mkdir()
+    for name in os.listdir(MODEL):
+        if not name.endswith('.h5'):
+            with open(os.path.join(MODEL, name), 'rb') as f:
+                (path / name).write_bytes(f.read())
+    # the .npz is loaded as long as it's newer than the .h5
+    (path / 'model.h5').write_bytes(b'')
+    os.utime(path / 'model.h5', (0, 0))
+    StubModel().save(str(path / 'model.npz'))
+    (tmp_path / 'config.py').write_text("devices = [{'url': 'ws://127.0.0.1:6437/v6.json', 'mode': 'desktop'}]\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    return os.path.join(str(path), '')
+
+
+def test_service_worker_dies(stub_model_path):
+    texts = messages(0)
+    service_ = service.PredictionService(processes=1, model_path=stub_model_path)
+    try:
+        for session_id in (0, 1):
+            service_.open(session_id)
+        for text in texts[:100]:
+            for session_id in (0, 1):
+                service_.send(session_id, text)
+        assert service_.results(timeout=30) is not None
+        process = service_.workers[0]
+        process.kill()
+        process.join()
+        # the sessions of the dead worker are each told so, then start again on a new worker
+        errors = {}
+        while len(errors) < 2:
+            result = service_.results(timeout=30)
+            assert result is not None
+            session_id, text = result
+            if 'error' in json.loads(text):
+                errors[session_id] = json.loads(text)['error']
+        assert all('prediction worker stopped' in error for error in errors.values())
+        assert service_.workers[0] is not process and service_.workers[0].is_alive()
+        for text in texts:
+            for session_id in (0, 1):
+                service_.send(session_id, text)
+        for session_id in (0, 1):
+            service_.close(session_id)
+        results = {0: [], 1: []}
+        for session_id, text in service_.shutdown():
+            results[session_id].append(json.loads(text))
+    finally:
+        service_.terminate()
+    # from scratch, as a new session would be
+    expected = replay(PredictionSession(PredictionPipeline(stub_model_path)), texts, StubModel())
+    for session_id in (0, 1):
+        assert_results_equal(results[session_id], expected)
@@ -0,0 +1,59 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from src.stats import RunningStats, folder2dicts
+from src.data_methods import file2X_y
+from src.cache import RecordingCache
+
+G2IDX = {'no_gesture': 0, 'wave': 1}
+
+
+def test_running_stats():
+    rng = np.random.default_rng(0)
+    columns = ['a', 'b', 'c']
+    # recordings of different lengths and scales, one of them empty, as from different processes
+    recordings = [rng.normal(loc=1000, scale=s, size=(n, 3)) for n, s in [(50, 1), (1, 10), (0, 1), (300, 100), (7, 0.1)]]
+    stats = RunningStats(columns)
+    for X in recordings:
+        recording = RunningStats(columns)
+        # a batch at a time
+        for batch in np.array_split(X, 3):
+            recording.update(batch)
+        stats.merge(recording)
+    df = pd.DataFrame(np.concatenate(recordings), columns=columns)
+    assert stats.count == len(df)
+    np.testing.assert_allclose(stats.mean, df.mean(), rtol=1e-13)
+    np.testing.assert_allclose(stats.std(), df.std(), rtol=1e-10)
+    restored = RunningStats.from_dict(json.loads(json.dumps(stats.to_dict())))
+    np.testing.assert_array_equal(restored.std(), stats.std())
+
+
+def test_folder2dicts(workdir, capsys):
+    means_dict, stds_dict = folder2dicts(['recordings/'], target_fps=25, g2idx=G2IDX, cache_dir=None)
+    # without a cache_dir, nothing is cached
+    assert sorted(os.listdir('data')) == ['stats.json']
+    assert '2 of 2 recordings processed' in capsys.readouterr().out
+    # the same as the stats of the recordings concatenated into a single df
+    X_y = [file2X_y(os.path.join('recordings', name), target_fps=25, g2idx=G2IDX, standardize=False)
+        for name in ('a.csv', 'a.lrec')]
+    df = pd.DataFrame(np.concatenate([X for X, _, _ in X_y]), columns=X_y[0][2])
+    assert list(means_dict) == list(df.columns)
+    np.testing.assert_allclose(list(means_dict.values()), df.mean(), rtol=1e-10)
+    np.testing.assert_allclose(list(stds_dict.values()), df.std(), rtol=1e-10)
+    with open('params/means_dict.json') as f:
+        assert json.load(f) == means_dict
+    # the dictionaries just written don't change the recordings' stats, so they aren't processed again
+    assert folder2dicts(['recordings/'], target_fps=25, g2idx=G2IDX, cache_dir=None) == (means_dict, stds_dict)
+    assert '0 of 2 recordings processed' in capsys.readouterr().out
+
+
+def test_folder2dicts_cache(workdir, capsys):
+    folder2dicts(['recordings/'], target_fps=25, g2idx=G2IDX, cache_dir='cache/', state_file='stats.json')
+    capsys.readouterr()
+    # processed recordings are cached without the dictionaries they were used to compute in their key
+    os.remove('stats.json')
+    folder2dicts(['recordings/'], target_fps=25, g2idx=G2IDX, cache_dir='cache/', state_file='stats.json')
+    assert capsys.readouterr().out.count('using cached data') == 2
+    file2X_y('recordings/a.csv', target_fps=25, g2idx=G2IDX, standardize=False, cache=RecordingCache('cache/'))
+    assert 'using cached data' in capsys.readouterr().out